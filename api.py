@@ -0,0 +1,383 @@
+"""Headless HTTP API for ingestion, chat and quizzes.
+
+Run several stateless workers with ``uvicorn api:app --workers 4``. Vector tables, the
+ingestion cache manifest, question banks, quiz attempts and ingestion job status live under
+./tmp, so any worker can serve any document; chat memory is per worker, so route a
+conversation_id to the same worker for multi-turn context. Set ``use_fakes=1`` to serve from the stand-ins in fakes.py.
+"""
+from collections import OrderedDict
+from fastapi import BackgroundTasks, FastAPI, File, HTTPException, UploadFile
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional, Tuple
+import io
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from dotenv import load_dotenv
+
+from attempts import attempt_scores, attempt_store, comprehension, coverage, section_mastery
+from chat_agent import build_chat_agent, get_chat_response, stream_chat_response
+from fakes import USE_FAKES
+from ingestion import document_id, library_knowledge
+from question_bank import get_bank, get_quiz_questions, start_bank_build
+from registry import DocumentHandle, registry
+from tracing import metrics
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Ingestion job status files, shared by every worker so any of them can answer a poll
+JOBS_DIR = './tmp/jobs'
+# Chat agents (and their conversation memory) kept per worker before the least recently used is dropped
+API_MAX_CONVERSATIONS = int(os.getenv("api_max_conversations", "256"))
+
+logger = logging.getLogger(__name__)
+
+app = FastAPI(title="EduChat AI Learning Platform API")
+
+# (scope, conversation_id) -> (agent, lock held while the agent answers a message)
+_conversations: "OrderedDict[tuple, Tuple[Any, threading.Lock]]" = OrderedDict()
+_conversations_lock = threading.Lock()
+
+
+class ChatRequest(BaseModel):
+    message: str = Field(..., min_length=1)
+    # Follow-up questions with the same id share chat history
+    conversation_id: Optional[str] = None
+    stream: bool = True
+
+
+class LibraryChatRequest(ChatRequest):
+    # None searches every document in the library
+    doc_ids: Optional[List[str]] = None
+
+
+class LibrarySearchRequest(BaseModel):
+    query: str = Field(..., min_length=1)
+    # None searches every document in the library
+    doc_ids: Optional[List[str]] = None
+    num_documents: int = Field(5, ge=1, le=50)
+
+
+class QuizRequest(BaseModel):
+    # None samples questions from the whole document
+    topic: Optional[str] = None
+    num_questions: int = Field(5, ge=1, le=20)
+    # Question bank ids the client has already seen
+    exclude: List[str] = Field(default_factory=list)
+
+
+class QuizAttemptRequest(BaseModel):
+    user_id: str = Field(..., min_length=1)
+    # The quiz topic the questions were requested for, if any
+    topic: Optional[str] = None
+    # Question bank id -> index of the chosen option, None when left unanswered
+    answers: Dict[str, Optional[int]] = Field(..., min_length=1)
+
+
+def _job_path(job_id: str) -> str:
+    return os.path.join(JOBS_DIR, f"{job_id}.json")
+
+
+def _write_job(job_id: str, **fields) -> Dict[str, Any]:
+    job = _read_job(job_id) or {'job_id': job_id}
+    job.update(fields, updated=time.time())
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    tmp_path = f"{_job_path(job_id)}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(job, f)
+    os.replace(tmp_path, _job_path(job_id))
+    return job
+
+
+def _read_job(job_id: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(_job_path(job_id)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _run_ingestion(job_id: str, pdf_bytes: bytes, filename: str) -> None:
+    _write_job(job_id, status='running')
+    try:
+        pdf_file = io.BytesIO(pdf_bytes)
+        pdf_file.name = filename
+        handle = registry.open(pdf_file, name=filename.rsplit('.', 1)[0])
+        document = handle.document
+        progress = document.progress
+        # The document can be chatted with and quizzed on from its first batch of pages; report the rest as it goes
+        while not progress.wait(timeout=1.0):
+            _write_job(job_id, status='indexing', num_pages=document.num_pages, pages_indexed=progress.pages,
+                       chunks_indexed=progress.chunks)
+        if progress.error is not None:
+            raise progress.error
+        start_bank_build(document.knowledge, document.doc_id, document.sections, document.name)
+        _write_job(
+            job_id,
+            status='done',
+            num_pages=document.num_pages,
+            num_chunks=document.num_chunks,
+            sections=document.sections,
+            cached=document.cached,
+            timings=document.timings,
+        )
+        handle.release()
+    except Exception as e:
+        logger.exception("Ingestion job %s failed", job_id)
+        _write_job(job_id, status='failed', error=str(e))
+
+
+def _open_document(doc_id: str) -> DocumentHandle:
+    try:
+        return registry.attach(doc_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown document {doc_id}")
+
+
+def _library_knowledge(doc_ids: Optional[List[str]]):
+    try:
+        return library_knowledge(doc_ids)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=f"Unknown document {e.args[0]} or not in the library")
+
+
+def _library_key(doc_ids: Optional[List[str]]) -> str:
+    # Response cache and conversation key of a library scope
+    return "library:" + (",".join(sorted(doc_ids)) if doc_ids is not None else "*")
+
+
+def _chat_agent(scope: str, knowledge, conversation_id: Optional[str]):
+    """The agent answering a message and the conversation lock it holds, which the caller releases when done.
+
+    Follow-ups in the same conversation and scope (a doc_id or a library key) reuse the agent;
+    one arriving while the previous message is still being answered is a 409, since both runs
+    would write the same chat memory.
+    """
+    if conversation_id is None:
+        return build_chat_agent(knowledge), None
+    key = (scope, conversation_id)
+    with _conversations_lock:
+        conversation = _conversations.get(key)
+        if conversation is None:
+            conversation = _conversations[key] = (build_chat_agent(knowledge), threading.Lock())
+        _conversations.move_to_end(key)
+        while len(_conversations) > API_MAX_CONVERSATIONS:
+            _conversations.popitem(last=False)
+    agent, lock = conversation
+    if not lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail=f"Conversation {conversation_id} is still answering a message")
+    return agent, lock
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _chat_events(handle: Optional[DocumentHandle], agent, lock: Optional[threading.Lock], cache_key: str,
+                 message: str):
+    # The handle and the conversation lock are held for the lifetime of the stream, so the knowledge base
+    # stays registered and the conversation answers one message at a time
+    cached = False
+    try:
+        for kind, payload in stream_chat_response(agent, cache_key, message):
+            if kind in ("cached", "content"):
+                cached = cached or kind == "cached"
+                yield _sse("token", {"text": payload})
+            elif kind == "tool_started":
+                yield _sse("tool_started", {"tool_name": payload.get("tool_name"), "tool_args": payload.get("tool_args")})
+            elif kind == "tool_completed":
+                elapsed = getattr(payload.get("metrics"), "time", None)
+                yield _sse("tool_completed", {"tool_name": payload.get("tool_name"), "seconds": elapsed})
+        yield _sse("done", {"cached": cached})
+    except Exception as e:
+        logger.exception("Chat stream failed for %s", cache_key)
+        yield _sse("error", {"detail": str(e)})
+    finally:
+        if lock is not None:
+            lock.release()
+        if handle is not None:
+            handle.release()
+
+
+@app.get("/health")
+def health():
+    return {"status": "ok", "fakes": USE_FAKES}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Stage latency histograms and token, chunk and retrieval counters of this worker process."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/documents", status_code=202)
+def upload_document(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+    """Start ingesting a PDF in the background; poll /jobs/{job_id} until it is done.
+
+    The job reports ``indexing`` with pages and chunks indexed so far once the first batch of
+    pages is searchable. From then on the worker ingesting it serves chat and quiz requests for
+    the document; other workers serve them once the job is done.
+    """
+    pdf_bytes = file.file.read()
+    if not pdf_bytes:
+        raise HTTPException(status_code=400, detail="Empty upload")
+    job_id = uuid.uuid4().hex
+    doc_id = document_id(pdf_bytes)
+    job = _write_job(job_id, status='queued', doc_id=doc_id, name=file.filename, created=time.time())
+    background_tasks.add_task(_run_ingestion, job_id, pdf_bytes, file.filename or "document.pdf")
+    return job
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = _read_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return job
+
+
+@app.get("/documents/{doc_id}")
+def get_document(doc_id: str):
+    handle = _open_document(doc_id)
+    document = handle.document
+    handle.release()
+    return {
+        "doc_id": doc_id,
+        "name": document.name,
+        "num_pages": document.num_pages,
+        "num_chunks": document.num_chunks,
+        "sections": document.sections,
+        # False while later pages are still being indexed by this worker
+        "indexed": document.progress.done,
+        "pages_indexed": document.progress.pages,
+    }
+
+
+@app.post("/documents/{doc_id}/chat")
+def chat(doc_id: str, request: ChatRequest):
+    """Answer a question about the document, as server-sent events unless ``stream`` is false.
+
+    The stream sends ``token`` events with text deltas, ``tool_started`` / ``tool_completed``
+    for tool calls and a final ``done`` (or ``error``) event.
+    """
+    handle = _open_document(doc_id)
+    try:
+        agent, lock = _chat_agent(doc_id, handle.knowledge, request.conversation_id)
+    except HTTPException:
+        handle.release()
+        raise
+    if request.stream:
+        return StreamingResponse(_chat_events(handle, agent, lock, doc_id, request.message),
+                                 media_type="text/event-stream")
+    try:
+        answer, cached = get_chat_response(agent, doc_id, request.message)
+    finally:
+        if lock is not None:
+            lock.release()
+        handle.release()
+    return {"answer": answer, "cached": cached}
+
+
+@app.post("/documents/{doc_id}/quiz")
+def quiz(doc_id: str, request: QuizRequest):
+    """Serve quiz questions from the document's question bank, generating any shortfall."""
+    handle = _open_document(doc_id)
+    try:
+        questions = get_quiz_questions(
+            handle.knowledge,
+            doc_id,
+            request.topic,
+            request.num_questions,
+            exclude=request.exclude,
+            default_topic=handle.name,
+        )
+    finally:
+        handle.release()
+    if not questions:
+        raise HTTPException(status_code=422, detail="No valid questions could be generated for this topic")
+    return {"questions": questions}
+
+
+@app.post("/documents/{doc_id}/quiz/attempts")
+def record_quiz_attempt(doc_id: str, request: QuizAttemptRequest):
+    """Grade answers to questions served by /documents/{doc_id}/quiz and record them for /progress."""
+    handle = _open_document(doc_id)
+    name = handle.name
+    handle.release()
+    items = {item["id"]: item for item in get_bank(doc_id).items}
+    unknown = [question_id for question_id in request.answers if question_id not in items]
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown question ids: {', '.join(unknown)}")
+    questions = [items[question_id] for question_id in request.answers]
+    answers = list(request.answers.values())
+    attempt_id = attempt_store.record(request.user_id, doc_id, name, request.topic, questions, answers)
+    correct = sum(answer == question["correct"] for question, answer in zip(questions, answers))
+    return {
+        "attempt_id": attempt_id,
+        "score": correct,
+        "total": len(questions),
+        "correct": {question["id"]: question["correct"] for question in questions},
+    }
+
+
+@app.get("/documents/{doc_id}/progress")
+def get_progress(doc_id: str, user_id: str):
+    """A user's comprehension of the sections quizzed so far, the share of sections quizzed, score per
+    quiz attempt and mastery per section."""
+    handle = _open_document(doc_id)
+    sections = handle.document.sections or None
+    handle.release()
+    attempts = attempt_store.frame(doc_id=doc_id, user_id=user_id)
+    if attempts is None or len(attempts) == 0:
+        return {"comprehension": 0.0, "coverage": 0.0, "attempts": [],
+                "sections": {section: 0.0 for section in sections or []}}
+    scores = attempt_scores(attempts)
+    return {
+        "comprehension": comprehension(attempts, sections),
+        "coverage": coverage(attempts, sections),
+        "attempts": [
+            {"attempt_id": row.attempt_id, "answered_at": row.answered_at.timestamp(), "questions": int(row.questions),
+             "score": float(row.score)}
+            for row in scores.itertuples(index=False)
+        ],
+        "sections": section_mastery(attempts, sections).to_dict(),
+    }
+
+
+@app.post("/library/search")
+def library_search(request: LibrarySearchRequest):
+    """Chunks most relevant to ``query`` across ``doc_ids``, or across the whole library."""
+    knowledge = _library_knowledge(request.doc_ids)
+    documents = knowledge.search(request.query, num_documents=request.num_documents)
+    return {"results": [
+        {
+            "doc_id": document.meta_data.get("doc_id"),
+            "page": document.meta_data.get("page"),
+            "section": document.meta_data.get("section"),
+            "content": document.content,
+            "score": document.reranking_score,
+        }
+        for document in documents
+    ]}
+
+
+@app.post("/library/chat")
+def library_chat(request: LibraryChatRequest):
+    """Like /documents/{doc_id}/chat, answering from several documents or the whole library."""
+    scope = _library_key(request.doc_ids)
+    # Validate the scope up front, so an unknown document is a 404 rather than an error event
+    knowledge = _library_knowledge(request.doc_ids)
+    agent, lock = _chat_agent(scope, knowledge, request.conversation_id)
+    if request.stream:
+        return StreamingResponse(_chat_events(None, agent, lock, scope, request.message), media_type="text/event-stream")
+    try:
+        answer, cached = get_chat_response(agent, scope, request.message)
+    finally:
+        if lock is not None:
+            lock.release()
+    return {"answer": answer, "cached": cached}
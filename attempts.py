@@ -0,0 +1,296 @@
+"""Persistent store of quiz attempts, one row per answered question, in Parquet files.
+
+Every submitted quiz is written as its own small file, so sessions and worker processes never
+write to the same file; once enough small files pile up they are merged into one. Dashboards
+read the store into one pandas DataFrame, cached until the files change, and compute scores
+with vectorized group-bys rather than per-attempt Python loops.
+"""
+from typing import Any, Dict, Iterable, List, Optional
+import logging
+import os
+import threading
+import time
+import uuid
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Attempt files live next to the question banks, shared by every worker process
+ATTEMPTS_DIR = './tmp/quiz_attempts'
+# Small files are merged into one once this many pile up; files above the size are left alone
+ATTEMPTS_COMPACT_FILES = int(os.getenv("attempts_compact_files", "32"))
+ATTEMPTS_SMALL_FILE_BYTES = int(os.getenv("attempts_small_file_bytes", str(1024 * 1024)))
+# An answer this many days old counts half as much towards comprehension as one given today
+COMPREHENSION_HALF_LIFE_DAYS = float(os.getenv("comprehension_half_life_days", "14"))
+# Imaginary answers, half of them right, that every section starts from, so one lucky answer is not mastery
+MASTERY_PRIOR_ANSWERS = float(os.getenv("mastery_prior_answers", "2"))
+
+# String columns, stored and loaded dictionary encoded since they repeat on every row of an attempt
+_CATEGORIES = ["attempt_id", "user_id", "doc_id", "document", "topic", "section", "question_id"]
+
+logger = logging.getLogger(__name__)
+
+
+def _schema():
+    import pyarrow as pa
+
+    return pa.schema([pa.field(name, pa.string()) for name in _CATEGORIES] + [
+        pa.field("correct", pa.bool_()),
+        pa.field("answered_at", pa.timestamp("ms", tz="UTC")),
+    ])
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class AttemptStore:
+    """Append-only Parquet files of quiz answers under ``path``.
+
+    Rows hold attempt_id, user_id, doc_id, document, topic, section, question_id, correct and
+    answered_at. Files are never modified once written: merging writes a new file and then
+    removes the ones it replaces, which it first claims by renaming so no two processes merge
+    the same file.
+    """
+
+    def __init__(self, path: str = ATTEMPTS_DIR, compact_files: int = ATTEMPTS_COMPACT_FILES,
+                 small_file_bytes: int = ATTEMPTS_SMALL_FILE_BYTES):
+        self.path = path
+        self.compact_files = compact_files
+        self.small_file_bytes = small_file_bytes
+        self._lock = threading.Lock()
+        # Arrow tables of the files read so far, and the DataFrame of all of them
+        self._tables: Dict[str, Any] = {}
+        self._files: Optional[tuple] = None
+        self._frame = None
+
+    def record(self, user_id: str, doc_id: str, document: Optional[str], topic: Optional[str],
+               questions: List[Dict], answers: List[Optional[int]], answered_at: Optional[float] = None) -> str:
+        """Append one submitted quiz: a row per question, correct when the chosen option is the right one."""
+        attempt_id = uuid.uuid4().hex[:12]
+        timestamp = int((answered_at or time.time()) * 1000)
+        count = len(questions)
+        self.append({
+            "attempt_id": [attempt_id] * count,
+            "user_id": [user_id] * count,
+            "doc_id": [doc_id] * count,
+            "document": [document] * count,
+            "topic": [topic] * count,
+            "section": [question.get("section") for question in questions],
+            "question_id": [question.get("id") for question in questions],
+            "correct": [answer == question["correct"] for question, answer in zip(questions, answers)],
+            "answered_at": [timestamp] * count,
+        })
+        return attempt_id
+
+    def append(self, columns: Dict[str, list]) -> None:
+        """Write rows given as lists per column (answered_at in epoch milliseconds) as a new file."""
+        import pyarrow as pa
+
+        table = pa.Table.from_pydict(columns, schema=_schema())
+        if table.num_rows == 0:
+            return
+        self._write(table)
+        self._compact()
+
+    def frame(self, doc_id: Optional[str] = None, user_id: Optional[str] = None):
+        """Recorded answers, optionally of one document and/or user, as a DataFrame with categorical
+        string columns; None before the first answer.
+
+        Only files added since the last call are read. Filters are applied to the cached Arrow
+        tables, so a dashboard converts just its own rows. The unfiltered DataFrame is rebuilt
+        when the set of files changes and shared between callers otherwise, so treat it as
+        read-only.
+        """
+        import pyarrow as pa
+
+        paths = self._scan()
+        if not paths:
+            return None
+        files = tuple(sorted(paths))
+        with self._lock:
+            tables = self._load(files)
+            filters = {column: value for column, value in (("doc_id", doc_id), ("user_id", user_id)) if value is not None}
+            if not filters:
+                if self._frame is None or self._files != files:
+                    combined = pa.concat_tables(tables).unify_dictionaries() if tables else _schema().empty_table()
+                    # Dictionary columns become categoricals, so filters and group-bys compare integer codes
+                    self._frame = combined.to_pandas()
+                    self._files = files if len(tables) == len(files) else None
+                return self._frame
+        matching = pa.concat_tables([_matching(table, filters) for table in tables]) if tables else _schema().empty_table()
+        return matching.to_pandas(strings_to_categorical=True)
+
+    def _load(self, files: tuple) -> list:
+        import pyarrow.parquet as pq
+
+        tables = {}
+        for path in files:
+            table = self._tables.get(path)
+            if table is None:
+                try:
+                    table = pq.read_table(path, read_dictionary=_CATEGORIES)
+                except FileNotFoundError:
+                    # Merged into a new file meanwhile, which the next call picks up
+                    continue
+            tables[path] = table
+        self._tables = tables
+        return list(tables.values())
+
+    def _scan(self) -> List[str]:
+        try:
+            with os.scandir(self.path) as entries:
+                return [entry.path for entry in entries if entry.name.endswith(".parquet")]
+        except FileNotFoundError:
+            return []
+
+    def _write(self, table) -> str:
+        import pyarrow.parquet as pq
+
+        os.makedirs(self.path, exist_ok=True)
+        path = os.path.join(self.path, f"{time.time_ns()}-{os.getpid()}-{uuid.uuid4().hex[:8]}.parquet")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+        return path
+
+    def _compact(self) -> None:
+        self._recover_claims()
+        small = []
+        for path in self._scan():
+            try:
+                if os.path.getsize(path) < self.small_file_bytes:
+                    small.append(path)
+            except FileNotFoundError:
+                pass
+        if len(small) < self.compact_files:
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        claimed = []
+        for path in small:
+            try:
+                os.rename(path, f"{path}.{os.getpid()}.claimed")
+                claimed.append(path)
+            except FileNotFoundError:
+                # Another process is merging this one
+                pass
+        if not claimed:
+            return
+        try:
+            merged = pa.concat_tables(pq.read_table(f"{path}.{os.getpid()}.claimed", schema=_schema())
+                                      for path in claimed)
+            self._write(merged)
+        except Exception as e:
+            logger.warning("Could not merge %d quiz attempt files: %s", len(claimed), e)
+            for path in claimed:
+                os.rename(f"{path}.{os.getpid()}.claimed", path)
+            return
+        for path in claimed:
+            os.remove(f"{path}.{os.getpid()}.claimed")
+        logger.debug("Merged %d quiz attempt files (%d rows)", len(claimed), merged.num_rows)
+
+    def _recover_claims(self) -> None:
+        # Files claimed by a process that died before merging them are put back
+        try:
+            with os.scandir(self.path) as entries:
+                names = [entry.name for entry in entries if entry.name.endswith(".claimed")]
+        except FileNotFoundError:
+            return
+        for name in names:
+            original, pid, _ = name.rsplit(".", 2)
+            if not _pid_alive(int(pid)):
+                try:
+                    os.rename(os.path.join(self.path, name), os.path.join(self.path, original))
+                except FileNotFoundError:
+                    pass
+
+
+def _matching(table, filters: Dict[str, str]):
+    # Rows whose dictionary encoded columns equal the values: each value is looked up once in a
+    # batch's dictionary and then compared against the integer indices, never the strings
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    batches = []
+    for batch in table.to_batches():
+        mask = None
+        for column, value in filters.items():
+            array = batch.column(column)
+            position = pc.index(array.dictionary, value).as_py()
+            if position < 0:
+                break
+            matches = pc.equal(array.indices, pa.scalar(position, array.indices.type))
+            mask = matches if mask is None else pc.and_(mask, matches)
+        else:
+            batches.append(batch.filter(mask))
+    # Decoded, so the few matching rows do not carry the whole file's dictionaries into pandas
+    return pa.Table.from_batches(batches, schema=table.schema).cast(_schema())
+
+
+attempt_store = AttemptStore()
+
+
+def attempt_scores(frame):
+    """One row per attempt, oldest first: when it was submitted, its questions and the share answered correctly."""
+    scores = frame.groupby("attempt_id", observed=True, sort=False).agg(
+        answered_at=("answered_at", "min"),
+        questions=("correct", "size"),
+        score=("correct", "mean"),
+    )
+    return scores.sort_values("answered_at").reset_index()
+
+
+def section_mastery(frame, sections: Optional[Iterable[str]] = None, now: Optional[float] = None):
+    """Recency weighted share of correct answers per section, pulled towards one half for little evidence.
+
+    Questions without a section, e.g. from documents without headings, count as section "".
+    Sections in ``sections`` without any answers score 0.
+    """
+    import numpy as np
+    import pandas as pd
+
+    now = pd.Timestamp(now or time.time(), unit="s", tz="UTC")
+    age_days = (now - frame["answered_at"]).dt.total_seconds().to_numpy() / 86400
+    weight = np.exp2(-np.clip(age_days, 0, None) / COMPREHENSION_HALF_LIFE_DAYS)
+    weighted = pd.DataFrame({
+        "section": frame["section"],
+        "weight": weight,
+        "correct": weight * frame["correct"].to_numpy(),
+    }).groupby("section", observed=True, dropna=False).sum()
+    mastery = (weighted["correct"] + MASTERY_PRIOR_ANSWERS / 2) / (weighted["weight"] + MASTERY_PRIOR_ANSWERS)
+    mastery.index = pd.Index(mastery.index.astype(object), name="section").fillna("")
+    if sections is not None:
+        sections = list(dict.fromkeys(sections)) + ([""] if "" in mastery.index else [])
+        mastery = mastery.reindex(pd.Index(sections, name="section"), fill_value=0.0)
+    return mastery.astype(float)
+
+
+def comprehension(frame, sections: Optional[Iterable[str]] = None, now: Optional[float] = None) -> float:
+    """Mean mastery from 0 to 1 of the sections answered so far, limited to ``sections`` when given.
+
+    Sections without answers are left out rather than counted as 0; see ``coverage`` for how many there are.
+    """
+    if frame is None or len(frame) == 0:
+        return 0.0
+    mastery = section_mastery(frame, now=now)
+    if sections is not None:
+        mastery = mastery[mastery.index.isin(list(sections) + [""])]
+    return float(mastery.mean()) if len(mastery) else 0.0
+
+
+def coverage(frame, sections: Optional[Iterable[str]]) -> float:
+    """Share of ``sections`` with at least one answer in ``frame``, 0 without sections."""
+    sections = set(sections or ())
+    if frame is None or len(frame) == 0 or not sections:
+        return 0.0
+    answered = set(frame["section"].dropna().astype(str).unique())
+    return len(sections & answered) / len(sections)
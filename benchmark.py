@@ -0,0 +1,1070 @@
+"""Offline benchmarks for the ingestion and answering pipeline.
+
+Usage:
+    python benchmark.py chunking [--pages 300] [--pdf notes.pdf] [--modes paragraph token agentic]
+    python benchmark.py embedding [--chunks 2000] [--batch-size 32] [--in-flight 4] [--rps 20] [--failure-rate 0.05]
+    python benchmark.py load [--users 1 8 32] [--pages 5 50 200] [--chat-turns 3] [--quiz-questions 5]
+                             [--model-latency 0.2] [--model-rps 50] [--failure-rate 0.01] [--baseline old.json]
+    python benchmark.py startup [--repeat 5] [--modules ingestion chat_agent] [--baseline old.json]
+    python benchmark.py answer-modes [--questions 40] [--modes direct agentic] [--input-price 0.10] [--output-price 0.40]
+    python benchmark.py retrieval [--pages 100] [--queries 200] [--k 5] [--modes vector lexical hybrid]
+    python benchmark.py library [--chunks 1000 10000 50000] [--dimensions 768] [--ann-min-rows 20000]
+    python benchmark.py ingest [--pages 50 400] [--workers 1 4] [--batch-pages 16] [--embed-latency 0.05]
+    python benchmark.py attempts [--attempts 1000 100000 300000] [--users 2000] [--docs 100] [--questions 5]
+    python benchmark.py tools [--users 1 8 32] [--calls 20] [--queries 50] [--tool-latency 0.5]
+    python benchmark.py history [--turns 10 100 1000] [--repeat 3]
+
+Pass --json out.json before the command to also write machine-readable results; ``load``,
+``startup``, ``answer-modes``, ``retrieval``, ``library``, ``ingest``, ``attempts``, ``tools`` and
+``history`` compare against a previous results file with --baseline and exit non-zero on regressions.
+
+Nothing here needs API keys unless a mode that calls a model (e.g. agentic chunking) is requested:
+the model, embedder and tools are the local stand-ins from fakes.py.
+"""
+import argparse
+import gc
+import io
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# The load benchmark runs the real pipeline against the stand-ins in fakes.py
+os.environ["use_fakes"] = "1"
+
+from agno.document.base import Document
+
+from chunking import chunk_pages, get_chunking_strategy
+from embedding import embed_documents
+from fakes import FakeEmbedder
+
+_WORDS = (
+    "gradient descent converges when the learning rate is small enough and the loss surface is smooth "
+    "the eigenvalues of the hessian determine curvature while momentum accelerates progress along shallow "
+    "directions regularisation penalises large weights and cross validation estimates generalisation error "
+    "the bias variance trade off explains why simple models underfit and flexible models overfit"
+).split()
+
+
+def synthetic_pages(num_pages, seed=0, words_per_page=450):
+    """Deterministic lecture-note-like pages with numbered headings and paragraphs."""
+    rng = random.Random(seed)
+    pages = []
+    for page_number in range(1, num_pages + 1):
+        lines = [f"{page_number}.{rng.randint(1, 9)} {' '.join(rng.sample(_WORDS, 3)).title()}"]
+        remaining = words_per_page
+        while remaining > 0:
+            n = min(remaining, rng.randint(40, 120))
+            sentence = " ".join(rng.choice(_WORDS) for _ in range(n))
+            lines.append(sentence[0].upper() + sentence[1:] + ".")
+            remaining -= n
+        pages.append(Document(
+            name="synthetic",
+            id=f"synthetic_{page_number}",
+            meta_data={"page": page_number},
+            content="\n\n".join(lines),
+        ))
+    return pages
+
+
+def _pdf_text(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def synthetic_pdf(num_pages, seed=0, words_per_page=450):
+    """A minimal valid PDF of synthetic_pages, one text line per paragraph, for ingestion benchmarks."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in synthetic_pages(num_pages, seed=seed, words_per_page=words_per_page):
+        paragraphs = page.content.split("\n\n")
+        stream = "BT /F1 10 Tf 40 800 Td 12 TL " + " ".join(f"({_pdf_text(p)}) '" for p in paragraphs) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        )
+        kids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in kids)}] /Count {len(kids)} >>"
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return out
+
+
+def load_pages(args):
+    if args.pdf:
+        from agno.knowledge.pdf import PDFReader
+
+        with open(args.pdf, "rb") as f:
+            return PDFReader(chunk=False).read(f)
+    return synthetic_pages(args.pages, seed=args.seed)
+
+
+def bench_chunking(args):
+    pages = load_pages(args)
+    results = []
+    for mode in args.modes:
+        strategy = get_chunking_strategy(mode)
+        start = time.perf_counter()
+        chunks = chunk_pages(pages, strategy)
+        elapsed = time.perf_counter() - start
+        results.append({
+            "mode": mode,
+            "pages": len(pages),
+            "chunks": len(chunks),
+            "seconds": round(elapsed, 4),
+            "pages_per_sec": round(len(pages) / elapsed, 1) if elapsed else None,
+            "avg_chunk_chars": round(sum(len(c.content) for c in chunks) / len(chunks)) if chunks else 0,
+        })
+    return results
+
+
+def bench_embedding(args):
+    pages = synthetic_pages(max(1, args.chunks // 2), seed=args.seed)
+    chunks = chunk_pages(pages, get_chunking_strategy("token"))[:args.chunks]
+    results = []
+    for batch_size in args.batch_size:
+        for in_flight in args.in_flight:
+            embedder = FakeEmbedder(
+                latency=args.latency,
+                requests_per_second=args.rps,
+                failure_rate=args.failure_rate,
+                seed=args.seed,
+            )
+            _, stats = embed_documents(
+                chunks, embedder, batch_size=batch_size, max_in_flight=in_flight, backoff=args.backoff,
+            )
+            results.append({
+                "batch_size": batch_size,
+                "in_flight": in_flight,
+                "chunks": stats["embedded"],
+                "requests": stats["requests"],
+                "retries": stats["retries"],
+                "rate_limited": stats["rate_limited"],
+                "seconds": round(stats["seconds"], 3),
+                "chunks_per_sec": round(stats["chunks_per_sec"], 1),
+            })
+    return results
+
+
+_QUESTIONS = [
+    "Explain how {a} relates to {b}",
+    "What does the text say about {a} and {b}?",
+    "Summarise the section on {a}",
+    "Find articles and a youtube tutorial about {a}",
+    "Make a study plan covering {a} and {b}",
+]
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def _rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Process lifetime peak where /proc is unavailable (kilobytes on Linux, bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class _RssSampler(threading.Thread):
+    """Samples resident memory in the background and keeps the peak."""
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak_mb = _rss_mb()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, _rss_mb())
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.peak_mb = max(self.peak_mb, _rss_mb())
+        return self.peak_mb
+
+
+def _simulate_user(user, args, pdfs, record):
+    """One study session: upload a PDF, ask a few questions, then take a quiz."""
+    from chat_agent import build_chat_agent, stream_chat_response
+    from question_bank import get_quiz_questions
+    from registry import registry
+
+    rng = random.Random(args.seed * 1000 + user)
+    num_pages, pdf_bytes = pdfs[user % len(pdfs)]
+
+    start = time.perf_counter()
+    try:
+        pdf_file = io.BytesIO(pdf_bytes)
+        pdf_file.name = f"user{user}_{num_pages}p.pdf"
+        handle = registry.open(pdf_file, name=pdf_file.name)
+    except Exception:
+        record("ingest", time.perf_counter() - start, ok=False)
+        return
+    record("ingest", time.perf_counter() - start, pages=num_pages)
+
+    agent = build_chat_agent(handle.knowledge)
+    for _ in range(args.chat_turns):
+        a, b = rng.sample(_WORDS, 2)
+        question = rng.choice(_QUESTIONS).format(a=a, b=b)
+        start = time.perf_counter()
+        first_token = None
+        try:
+            for kind, _ in stream_chat_response(agent, handle.doc_id, question):
+                if first_token is None and kind in ("content", "cached"):
+                    first_token = time.perf_counter() - start
+        except Exception:
+            record("chat", time.perf_counter() - start, ok=False)
+            continue
+        record("chat", time.perf_counter() - start)
+        if first_token is not None:
+            record("chat_first_token", first_token)
+
+    if args.quiz_questions:
+        start = time.perf_counter()
+        try:
+            questions = get_quiz_questions(handle.knowledge, handle.doc_id, None, args.quiz_questions,
+                                           default_topic=rng.choice(_WORDS))
+        except Exception:
+            record("quiz", time.perf_counter() - start, ok=False)
+        else:
+            record("quiz", time.perf_counter() - start, ok=bool(questions))
+    handle.release()
+
+
+def bench_load(args):
+    # Vector tables, caches and question banks all live under ./tmp, so isolate them per run
+    workdir = args.workdir or tempfile.mkdtemp(prefix="study-buddy-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    # Import the pipeline, including the modules it imports lazily on first use, up front so
+    # import time is not counted as request latency (``startup`` measures that separately)
+    import agno.knowledge.pdf, agno.run.response, agno.vectordb.lancedb  # noqa: F401
+    import chat_agent, question_bank, registry  # noqa: F401
+    from fakes import fake_services
+
+    faults = {"requests_per_second": args.model_rps, "failure_rate": args.failure_rate}
+    tool_faults = {"latency": args.tool_latency, "failure_rate": args.failure_rate}
+    fake_services.configure(
+        model=dict(faults, latency=args.model_latency, token_latency=args.token_latency),
+        embedder={"latency": args.embed_latency, "requests_per_second": args.embed_rps,
+                  "failure_rate": args.failure_rate},
+        tavily=tool_faults, youtube=tool_faults, todoist=tool_faults,
+        seed=args.seed,
+    )
+
+    results = []
+    run = 0
+    for users in args.users:
+        # Fresh PDF bytes per run and user so every upload is really ingested rather than served from cache
+        pdfs = [(pages, synthetic_pdf(pages, seed=run * 100000 + user))
+                for user, pages in zip(range(users), args.pages * users)]
+        run += 1
+        samples = {}
+        lock = threading.Lock()
+
+        def record(op, seconds, ok=True, **_):
+            with lock:
+                samples.setdefault(op, {"latencies": [], "errors": 0})
+                if ok:
+                    samples[op]["latencies"].append(seconds)
+                else:
+                    samples[op]["errors"] += 1
+
+        requests_before = fake_services.requests
+        sampler = _RssSampler()
+        sampler.start()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=users) as executor:
+            list(executor.map(lambda user: _simulate_user(user, args, pdfs, record), range(users)))
+        wall = time.perf_counter() - start
+        peak_rss = sampler.stop()
+        requests = {k: v - requests_before.get(k, 0) for k, v in fake_services.requests.items()}
+
+        for op, sample in samples.items():
+            latencies = sorted(sample["latencies"])
+            results.append({
+                "users": users,
+                "op": op,
+                "count": len(latencies),
+                "errors": sample["errors"],
+                "p50_ms": round(_percentile(latencies, 0.50) * 1000, 1) if latencies else None,
+                "p95_ms": round(_percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+                "p99_ms": round(_percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+                "per_sec": round(len(latencies) / wall, 2),
+                "wall_s": round(wall, 2),
+                "peak_rss_mb": round(peak_rss, 1),
+                "model_requests": requests["model"],
+                "embed_requests": requests["embedder"],
+            })
+    return results
+
+
+def bench_answer_modes(args):
+    """Latency, model round-trips, tokens and cost of the direct and agentic chat modes on one question set."""
+    workdir = args.workdir or tempfile.mkdtemp(prefix="study-buddy-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    import agno.knowledge.pdf, agno.run.response, agno.vectordb.lancedb  # noqa: F401
+    from chat_agent import build_chat_agent, needs_tools, stream_chat
+    from fakes import fake_services
+    from registry import registry
+    from tracing import token_usage
+
+    fake_services.configure(
+        model={"latency": args.model_latency, "token_latency": args.token_latency},
+        embedder={"latency": args.embed_latency},
+        tavily={"latency": args.tool_latency}, youtube={"latency": args.tool_latency},
+        todoist={"latency": args.tool_latency},
+        seed=args.seed,
+    )
+    pdf_file = io.BytesIO(synthetic_pdf(args.pages, seed=args.seed))
+    pdf_file.name = "answer_modes.pdf"
+    handle = registry.open(pdf_file, name=pdf_file.name, wait=True)
+
+    rng = random.Random(args.seed)
+    questions = []
+    for _ in range(args.questions):
+        a, b = rng.sample(_WORDS, 2)
+        questions.append(rng.choice(_QUESTIONS).format(a=a, b=b))
+
+    results = []
+    for mode in args.modes:
+        agent = build_chat_agent(handle.knowledge, mode=mode)
+        samples = {}
+        for question in questions:
+            requests_before = fake_services.requests["model"]
+            start = time.perf_counter()
+            first_token = None
+            # stream_chat rather than stream_chat_response, so repeated questions are really answered
+            for kind, _ in stream_chat(agent, question):
+                if first_token is None and kind == "content":
+                    first_token = time.perf_counter() - start
+            elapsed = time.perf_counter() - start
+            usage = token_usage(agent.run_response)
+            for op in ("chat", "chat_tools" if needs_tools(question) else "chat_document"):
+                sample = samples.setdefault(op, {"latencies": [], "first_tokens": [], "requests": 0,
+                                                 "input_tokens": 0, "output_tokens": 0})
+                sample["latencies"].append(elapsed)
+                sample["first_tokens"].append(first_token or elapsed)
+                sample["requests"] += fake_services.requests["model"] - requests_before
+                sample["input_tokens"] += usage["input_tokens"]
+                sample["output_tokens"] += usage["output_tokens"]
+
+        for op, sample in samples.items():
+            latencies = sorted(sample["latencies"])
+            count = len(latencies)
+            cost = (sample["input_tokens"] * args.input_price + sample["output_tokens"] * args.output_price) / 1e6
+            results.append({
+                "mode": mode,
+                "op": op,
+                "count": count,
+                "p50_ms": round(_percentile(latencies, 0.50) * 1000, 1),
+                "p95_ms": round(_percentile(latencies, 0.95) * 1000, 1),
+                "first_token_p50_ms": round(_percentile(sorted(sample["first_tokens"]), 0.50) * 1000, 1),
+                "model_requests_per_answer": round(sample["requests"] / count, 2),
+                "input_tokens_per_answer": round(sample["input_tokens"] / count),
+                "output_tokens_per_answer": round(sample["output_tokens"] / count),
+                "usd_per_1k_answers": round(cost / count * 1000, 4),
+            })
+    handle.release()
+    return results
+
+
+def _retrieval_queries(index, count, rng):
+    """Queries with known relevant chunks: section numbers (exact terms), phrases quoted from a chunk,
+    and questions wrapping a phrase in words the document does not contain, which need the vector search."""
+    import re
+
+    queries = []
+    sections = [(m.group(0), i) for i, d in enumerate(index.documents)
+                for m in re.finditer(r"^\d+\.\d+", d["content"], re.MULTILINE)]
+    while len(queries) < count:
+        if sections and len(queries) % 3 == 0:
+            number, _ = rng.choice(sections)
+            relevant = {d["content"] for d in index.documents if re.search(rf"^{re.escape(number)}\b", d["content"], re.MULTILINE)}
+            queries.append(("exact", f"What does section {number} cover?", relevant))
+        else:
+            words = rng.choice(index.documents)["content"].split()
+            start = rng.randrange(max(1, len(words) - 8))
+            phrase = " ".join(words[start:start + 8])
+            relevant = {d["content"] for d in index.documents if phrase in d["content"]}
+            if len(queries) % 3 == 1:
+                queries.append(("phrase", phrase, relevant))
+            else:
+                queries.append(("question", f"Why, according to the lecture, {phrase}?", relevant))
+    return queries
+
+
+def bench_retrieval(args):
+    """Recall@k, query latency and embedding requests of vector, lexical and hybrid retrieval."""
+    workdir = args.workdir or tempfile.mkdtemp(prefix="study-buddy-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    import agno.knowledge.pdf, agno.vectordb.lancedb  # noqa: F401
+    from fakes import fake_services
+    from ingestion import ingest_pdf
+
+    fake_services.configure(embedder={"latency": args.embed_latency}, seed=args.seed)
+    pdf_file = io.BytesIO(synthetic_pdf(args.pages, seed=args.seed))
+    pdf_file.name = "retrieval.pdf"
+    knowledge = ingest_pdf(pdf_file, name=pdf_file.name, wait=True).knowledge
+    queries = _retrieval_queries(knowledge.lexical, args.queries, random.Random(args.seed))
+    embedder = knowledge.vector_db.embedder
+
+    results = []
+    for mode in args.modes:
+        knowledge.retrieval_mode = mode
+        samples = {}
+        for kind, query, relevant in queries:
+            requests_before = embedder.requests
+            start = time.perf_counter()
+            documents = knowledge.search(query, num_documents=args.k)
+            elapsed = time.perf_counter() - start
+            for op in ("retrieve", f"retrieve_{kind}"):
+                sample = samples.setdefault(op, {"latencies": [], "hits": 0, "embed_requests": 0})
+                sample["latencies"].append(elapsed)
+                sample["hits"] += any(d.content in relevant for d in documents)
+                sample["embed_requests"] += embedder.requests - requests_before
+        for op, sample in samples.items():
+            latencies = sorted(sample["latencies"])
+            results.append({
+                "mode": mode,
+                "op": op,
+                "chunks": len(knowledge.lexical),
+                "count": len(latencies),
+                f"recall@{args.k}": round(sample["hits"] / len(latencies), 3),
+                "p50_ms": round(_percentile(latencies, 0.50) * 1000, 2),
+                "p95_ms": round(_percentile(latencies, 0.95) * 1000, 2),
+                "embed_requests_per_query": round(sample["embed_requests"] / len(latencies), 2),
+            })
+    return results
+
+
+def bench_library(args):
+    """Search latency through library_knowledge (attach plus hybrid search) and ANN recall (against
+    an exact scan) as the shared library table grows. ``cold_ms`` is the first search of a scope,
+    which loads its documents' BM25 indexes; later ones reuse them."""
+    workdir = args.workdir or tempfile.mkdtemp(prefix="study-buddy-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    import numpy as np
+    from embedding import PrecomputedEmbedder, _text_key
+    from ingestion import LANCEDB_URI, library_knowledge
+    from ingestion_cache import IngestionCache
+    from lexical import BM25Index, index_path
+    from library import LibraryDb, library_table_name
+
+    # Chunk vectors scattered around one direction per document, like embeddings of one PDF's topics;
+    # the hashing fake embedder has too small a vocabulary to spread tens of thousands of chunks out
+    rng = np.random.default_rng(args.seed)
+    embedder = PrecomputedEmbedder(embedder=FakeEmbedder(dimensions=args.dimensions))
+    table_name = library_table_name(embedder)
+    library = LibraryDb(uri=LANCEDB_URI, table_name=table_name, embedder=embedder)
+    cache = IngestionCache(LANCEDB_URI, max_bytes=2 ** 62)
+    centers = {}
+    chunks = {}
+
+    def unit(vector):
+        return (vector / np.linalg.norm(vector)).astype(np.float32)
+
+    def query_text(n):
+        # Spelled in letters, so the BM25 index matches nothing and every search embeds the query
+        return "library question " + "".join(chr(ord("a") + int(digit)) for digit in str(n))
+
+    results = []
+    inserted = 0
+    for size in sorted(args.chunks):
+        changed = set()
+        while inserted < size:
+            batch = []
+            for n in range(inserted, min(size, inserted + 1000)):
+                doc = n // args.chunks_per_doc
+                if doc not in centers:
+                    centers[doc] = unit(rng.standard_normal(args.dimensions))
+                content = f"doc{doc} chunk {n}"
+                embedder.vectors[_text_key(content)] = unit(centers[doc] + rng.standard_normal(args.dimensions) * 0.06).tolist()
+                batch.append(Document(name=f"doc{doc}", content=content,
+                                      meta_data={"doc_id": f"doc{doc}", "page": n % args.chunks_per_doc // 4 + 1}))
+                chunks.setdefault(doc, []).append(batch[-1])
+                changed.add(doc)
+            library.insert(batch)
+            inserted += len(batch)
+        # Each document's BM25 index and ingestion cache entry, as ingest_pdf leaves them
+        for doc in sorted(changed):
+            doc_id = f"doc{doc}"
+            BM25Index.build(chunks[doc]).save(index_path(LANCEDB_URI, cache.table_name_for(doc_id)))
+            cache.put(doc_id, {"table_name": table_name, "library": True, "name": doc_id, "num_pages": 1,
+                               "num_chunks": len(chunks[doc]), "sections": [],
+                               "size_bytes": len(chunks[doc]) * 4 * args.dimensions})
+        queries = []
+        for d in rng.integers(0, len(centers), args.queries):
+            vector = unit(centers[int(d)] + rng.standard_normal(args.dimensions) * 0.06).tolist()
+            embedder.vectors[_text_key(query_text(len(queries)))] = vector
+            queries.append((query_text(len(queries)), vector))
+        start = time.perf_counter()
+        library.ensure_index(min_rows=args.ann_min_rows)
+        index_seconds = time.perf_counter() - start
+        ann = any(library._vector_col in index.columns for index in library.table.list_indices())
+
+        num_docs = (size + args.chunks_per_doc - 1) // args.chunks_per_doc
+        scopes = {
+            "one": [f"doc{rng.integers(num_docs)}"],
+            "set": [f"doc{i}" for i in rng.choice(num_docs, min(10, num_docs), replace=False)],
+            "all": None,
+        }
+        for scope, doc_ids in scopes.items():
+            filters = {"doc_id": doc_ids} if doc_ids is not None else None
+            latencies, recalls = [], []
+            for text, vector in queries:
+                start = time.perf_counter()
+                found = library_knowledge(doc_ids, cache=cache, embedder=embedder).search(text, num_documents=args.k)
+                latencies.append(time.perf_counter() - start)
+                exact = {d.content for d in library.search_vector(vector, args.k, filters, exact=True)}
+                recalls.append(len(exact & {d.content for d in found}) / len(exact) if exact else 1.0)
+            cold = latencies[0]
+            latencies.sort()
+            results.append({
+                "mode": scope,
+                "op": f"search_{size}",
+                "chunks": size,
+                "documents": num_docs if doc_ids is None else len(doc_ids),
+                "ann_index": ann,
+                "index_s": round(index_seconds, 2),
+                f"recall@{args.k}": round(sum(recalls) / len(recalls), 3),
+                "cold_ms": round(cold * 1000, 2),
+                "p50_ms": round(_percentile(latencies, 0.50) * 1000, 2),
+                "p95_ms": round(_percentile(latencies, 0.95) * 1000, 2),
+            })
+    return results
+
+
+def bench_ingest(args):
+    """Time until a new PDF is searchable, and until it is fully indexed, with streaming ingestion.
+
+    ``blocking`` indexes the whole PDF as one batch, so nothing is searchable until it is done;
+    the other modes stream batches of --batch-pages pages with that many extraction processes.
+    """
+    workdir = args.workdir or tempfile.mkdtemp(prefix="study-buddy-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    import extraction
+    from fakes import fake_services
+    from ingestion import LANCEDB_URI, ingest_pdf
+    from ingestion_cache import IngestionCache
+
+    fake_services.configure(embedder={"latency": args.embed_latency}, seed=args.seed)
+    # Import and table creation costs are paid by a throwaway run, not by the first mode measured
+    pdf_file = io.BytesIO(synthetic_pdf(2, seed=args.seed + 1))
+    pdf_file.name = "warmup.pdf"
+    ingest_pdf(pdf_file, name=pdf_file.name, wait=True)
+
+    modes = [("blocking", None, 1)] + [(f"workers={w}", args.batch_pages, w) for w in args.workers]
+    results = []
+    for num_pages in args.pages:
+        pdf_bytes = synthetic_pdf(num_pages, seed=args.seed)
+        for mode, batch_pages, workers in modes:
+            extraction.PDF_PAGE_BATCH = batch_pages or num_pages
+            extraction.PDF_EXTRACT_WORKERS = workers
+            samples = {"first_batch": [], "total": []}
+            for run in range(args.repeat):
+                pdf_file = io.BytesIO(pdf_bytes)
+                pdf_file.name = f"ingest_{num_pages}p.pdf"
+                # A fresh manifest, so every run ingests the PDF again rather than attaching it
+                cache = IngestionCache(LANCEDB_URI, manifest_path=os.path.join(workdir, f"manifest_{mode}_{num_pages}_{run}.json"))
+                start = time.perf_counter()
+                document = ingest_pdf(pdf_file, name=pdf_file.name, cache=cache)
+                samples["first_batch"].append(time.perf_counter() - start)
+                document.progress.wait()
+                samples["total"].append(time.perf_counter() - start)
+            for op, latencies in samples.items():
+                latencies.sort()
+                results.append({
+                    "mode": mode,
+                    "op": f"{op}_{num_pages}p",
+                    "pages": num_pages,
+                    "chunks": document.num_chunks,
+                    "p50_ms": round(_percentile(latencies, 0.50) * 1000, 1),
+                    "p95_ms": round(_percentile(latencies, 0.95) * 1000, 1),
+                })
+    return results
+
+
+def bench_attempts(args):
+    """Quiz attempt store latency as it grows: recording, loading and the per-user dashboard queries.
+
+    ``dashboard`` is what the Learning Progress panel computes for one user and document,
+    ``cold_dashboard`` the same in a new process that has read no files yet, ``record`` submits
+    one quiz and ``refresh`` is a submit followed by the dashboard that shows it.
+    """
+    workdir = args.workdir or tempfile.mkdtemp(prefix="study-buddy-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    import numpy as np
+    from attempts import AttemptStore, attempt_scores, comprehension
+
+    rng = np.random.default_rng(args.seed)
+    store = AttemptStore("./tmp/quiz_attempts")
+    sections = [f"Section {n}" for n in range(args.sections)]
+    questions = [{"id": f"q{n}", "section": sections[n % args.sections], "correct": 0} for n in range(args.questions)]
+    now_ms = int(time.time() * 1000)
+
+    def timed(op, size, fn, repeat):
+        latencies = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        return {
+            "mode": "parquet",
+            "op": f"{op}_{size}",
+            "attempts": size,
+            "rows": sum(table.num_rows for table in store._tables.values()),
+            "files": len(store._scan()),
+            "p50_ms": round(_percentile(latencies, 0.50) * 1000, 2),
+            "p95_ms": round(_percentile(latencies, 0.95) * 1000, 2),
+        }
+
+    def user_and_doc():
+        return f"user{rng.integers(args.users)}", f"doc{rng.integers(args.docs)}"
+
+    def record():
+        user_id, doc_id = user_and_doc()
+        store.record(user_id, doc_id, doc_id, None, questions, rng.integers(0, 2, args.questions).tolist())
+
+    def dashboard(store=store):
+        user_id, doc_id = user_and_doc()
+        mine = store.frame(doc_id=doc_id, user_id=user_id)
+        comprehension(mine, sections)
+        attempt_scores(mine)
+
+    results = []
+    recorded = 0
+    for size in sorted(args.attempts):
+        # Bulk history in files of up to 50000 attempts, answered over the last 90 days
+        while recorded < size:
+            count = min(size - recorded, 50000)
+            rows = count * args.questions
+            attempt = np.repeat(np.arange(recorded, recorded + count), args.questions)
+            question = np.tile(np.arange(args.questions), count)
+            store.append({
+                "attempt_id": np.char.add("a", attempt.astype(str)),
+                "user_id": np.char.add("user", rng.integers(0, args.users, count).repeat(args.questions).astype(str)),
+                "doc_id": np.char.add("doc", rng.integers(0, args.docs, count).repeat(args.questions).astype(str)),
+                "document": [None] * rows,
+                "topic": [None] * rows,
+                "section": np.array(sections)[question % args.sections],
+                "question_id": np.char.add("q", question.astype(str)),
+                "correct": rng.random(rows) < 0.7,
+                "answered_at": now_ms - rng.integers(0, 90 * 86400 * 1000, count).repeat(args.questions),
+            })
+            recorded += count
+        results.append(timed("dashboard", size, dashboard, args.repeat))
+        results.append(timed("cold_dashboard", size, lambda: dashboard(AttemptStore("./tmp/quiz_attempts")), 3))
+        results.append(timed("record", size, record, args.repeat))
+        results.append(timed("refresh", size, lambda: (record(), dashboard()), args.repeat))
+    return results
+
+
+def bench_tools(args):
+    """Web search and YouTube tool latency and backend requests with and without the tool cache.
+
+    Concurrent users each make --calls tool calls, with queries drawn from a pool of --queries
+    so popular ones repeat (Zipf distributed, like a class studying the same course) and
+    phrased differently in case and punctuation. ``burst`` is every user asking the same new
+    question at once, which only in-flight coalescing saves.
+    """
+    workdir = args.workdir or tempfile.mkdtemp(prefix="study-buddy-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    from fakes import FakeTool, _Faults
+    from tool_cache import ToolCache
+
+    weights = [1 / (rank + 1) ** args.zipf for rank in range(args.queries)]
+    tools = [("web_search_using_tavily", "query", "photosynthesis {a} and {b} explained"),
+             ("get_youtube_video_captions", "url", "https://www.youtube.com/watch?v={a}{b}")]
+    results = []
+    for mode in ("uncached", "cached"):
+        for users in args.users:
+            backends = {name: FakeTool(name, (), _Faults(latency=args.tool_latency)) for name, _, _ in tools}
+            cache = ToolCache(os.path.join(workdir, f"tool_cache_{mode}_{users}"), ttls=None if mode == "cached" else {})
+            calls = {name: cache.wrap(name, backend) for name, backend in backends.items()}
+            latencies = {"tool_call": [], "burst": []}
+            lock = threading.Lock()
+
+            def call(op, rng, query_rank):
+                name, argument, template = tools[query_rank % len(tools)]
+                a, b = _WORDS[query_rank % len(_WORDS)], _WORDS[query_rank // len(_WORDS) % len(_WORDS)]
+                value = template.format(a=a, b=b)
+                if argument == "query" and rng.random() < 0.5:
+                    value = value.capitalize() + "?"
+                start = time.perf_counter()
+                calls[name](value)
+                with lock:
+                    latencies[op].append(time.perf_counter() - start)
+
+            def session(user):
+                rng = random.Random(args.seed * 1000 + user)
+                for _ in range(args.calls):
+                    call("tool_call", rng, rng.choices(range(args.queries), weights)[0])
+
+            phases = {
+                "tool_call": lambda: list(executor.map(session, range(users))),
+                # A question nobody has asked before, from every user at the same moment
+                "burst": lambda: list(executor.map(lambda user: call("burst", random.Random(user), args.queries + 1),
+                                                   range(users))),
+            }
+            with ThreadPoolExecutor(max_workers=users) as executor:
+                for op, run in phases.items():
+                    before = sum(backend.faults.requests for backend in backends.values())
+                    run()
+                    requests = sum(backend.faults.requests for backend in backends.values()) - before
+                    values = sorted(latencies[op])
+                    results.append({
+                        "users": users,
+                        "mode": mode,
+                        "op": op,
+                        "calls": len(values),
+                        "backend_requests": requests,
+                        "p50_ms": round(_percentile(values, 0.50) * 1000, 1),
+                        "p95_ms": round(_percentile(values, 0.95) * 1000, 1),
+                    })
+    return results
+
+
+def bench_history(args):
+    """Streamlit rerun time and prompt size as one chat session grows to --turns exchanges.
+
+    ``window`` renders the most recent page of messages, as the app does; ``all`` renders every
+    message, as it did before chat history was paged. prompt_tokens is the largest prompt of
+    the last ten turns, rolling summary included.
+    """
+    workdir = args.workdir or tempfile.mkdtemp(prefix="study-buddy-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    from streamlit.testing.v1 import AppTest
+    from chat_agent import build_chat_agent, get_chat_response
+    from chat_history import CHAT_HISTORY_PAGE_MESSAGES, ChatHistory
+    from fakes import fake_services
+    from registry import registry
+
+    # Only rendering and prompt size are measured, so the fakes answer instantly
+    instant = {"latency": 0}
+    fake_services.configure(model=dict(instant, token_latency=0), embedder=instant, tavily=instant, youtube=instant,
+                            todoist=instant, seed=args.seed)
+    pdf_file = io.BytesIO(synthetic_pdf(args.pages, seed=args.seed))
+    pdf_file.name = "history.pdf"
+    handle = registry.open(pdf_file, name="history", wait=True)
+    agent = build_chat_agent(handle.knowledge)
+    history = ChatHistory()
+    main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    rng = random.Random(args.seed)
+    prompt_tokens = []
+
+    def render(visible):
+        app = AppTest.from_file(main_py, default_timeout=120)
+        app.session_state.current_topic = "history"
+        app.session_state.pdf_data = {"history": {
+            "handle": handle, "chat": agent, "chat_history": history, "visible_messages": visible, "scope": [],
+            "quiz_state": {"active": False, "questions": [], "answers": [], "score": 0, "total": 0,
+                           "custom_topic": "", "seen": []},
+        }}
+        start = time.perf_counter()
+        app.run()
+        return time.perf_counter() - start, len(app.chat_message)
+
+    # The first render imports everything main.py needs
+    render(CHAT_HISTORY_PAGE_MESSAGES)
+    results = []
+    for turns in sorted(args.turns):
+        while len(history) < 2 * turns:
+            a, b = rng.sample(_WORDS, 2)
+            # Numbered, so no question is answered from the response cache
+            question = f"{rng.choice(_QUESTIONS).format(a=a, b=b)} ({len(history) // 2})"
+            history.append({"role": "user", "content": question})
+            agent.additional_context = history.summary
+            answer, cached = get_chat_response(agent, handle.doc_id, question)
+            history.append({"role": "assistant", "content": answer, "cached": cached})
+            prompt_tokens.append(agent.run_response.metrics["input_tokens"][0])
+        # Objects the simulated turns left behind elsewhere (response cache entries, traces) are
+        # frozen, so garbage collections during a render do not scan them and only rendering is timed
+        gc.collect()
+        gc.freeze()
+        for mode, visible in (("window", CHAT_HISTORY_PAGE_MESSAGES), ("all", len(history))):
+            timings, rendered = [], 0
+            for _ in range(args.repeat):
+                elapsed, rendered = render(visible)
+                timings.append(elapsed)
+            timings.sort()
+            results.append({
+                "mode": mode,
+                "op": f"render_{turns}",
+                "turns": turns,
+                "messages_rendered": rendered,
+                "messages_in_memory": len(history._recent),
+                "prompt_tokens": max(prompt_tokens[-10:]),
+                "p50_ms": round(_percentile(timings, 0.50) * 1000, 1),
+                "p95_ms": round(_percentile(timings, 0.95) * 1000, 1),
+            })
+        gc.unfreeze()
+    handle.release()
+    return results
+
+
+_IMPORT_SNIPPET = "import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+_RENDER_SNIPPET = (
+    "import time\n"
+    "from streamlit.testing.v1 import AppTest\n"
+    "app = AppTest.from_file({path!r}, default_timeout=120)\n"
+    "start = time.perf_counter()\n"
+    "app.run()\n"
+    "print(time.perf_counter() - start)\n"
+)
+
+
+def _time_in_fresh_interpreter(code):
+    # Startup only means anything in a new process, with nothing imported yet and no fakes
+    env = {k: v for k, v in os.environ.items() if k != "use_fakes"}
+    here = os.path.dirname(os.path.abspath(__file__))
+    output = subprocess.run([sys.executable, "-c", code], cwd=here, env=env, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def bench_startup(args):
+    targets = [(f"import {module}", _IMPORT_SNIPPET.format(module=module)) for module in args.modules]
+    if not args.skip_render:
+        targets.append(("first render main.py", _RENDER_SNIPPET.format(path="main.py")))
+    results = []
+    for op, code in targets:
+        timings = sorted(_time_in_fresh_interpreter(code) for _ in range(args.repeat))
+        results.append({
+            "op": op,
+            "count": len(timings),
+            "p50_ms": round(_percentile(timings, 0.50) * 1000, 1),
+            "p95_ms": round(_percentile(timings, 0.95) * 1000, 1),
+            "max_ms": round(timings[-1] * 1000, 1),
+        })
+    return results
+
+
+def compare_results(baseline, results, tolerance):
+    """Rows of ``results`` whose p95 latency regressed more than ``tolerance`` against ``baseline``."""
+    previous = {(row.get("users"), row.get("mode"), row["op"]): row for row in baseline}
+    regressions = []
+    for row in results:
+        old = previous.get((row.get("users"), row.get("mode"), row["op"]))
+        if old is None or not old.get("p95_ms") or row.get("p95_ms") is None:
+            continue
+        change = row["p95_ms"] / old["p95_ms"] - 1
+        if change > tolerance:
+            regressions.append({"users": row.get("users"), "mode": row.get("mode"), "op": row["op"],
+                                "baseline_p95_ms": old["p95_ms"], "p95_ms": row["p95_ms"], "change": f"{change:+.0%}"})
+    return regressions
+
+
+def print_table(rows):
+    if not rows:
+        return
+    columns = list(rows[0].keys())
+    widths = {c: max(len(c), *(len(str(r.get(c, ""))) for r in rows)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for row in rows:
+        print("  ".join(str(row.get(c, "")).ljust(widths[c]) for c in columns))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--json", help="write machine-readable results to this file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    chunking = subparsers.add_parser("chunking", help="compare chunk counts and time across chunking modes")
+    chunking.add_argument("--pages", type=int, default=300, help="synthetic pages to generate")
+    chunking.add_argument("--pdf", help="benchmark a real PDF instead of synthetic pages")
+    chunking.add_argument("--seed", type=int, default=0)
+    chunking.add_argument("--modes", nargs="+", default=["paragraph", "token"])
+    chunking.set_defaults(func=bench_chunking)
+
+    embedding = subparsers.add_parser("embedding", help="embedding throughput against a rate-limited fake embedder")
+    embedding.add_argument("--chunks", type=int, default=2000)
+    embedding.add_argument("--batch-size", type=int, nargs="+", default=[1, 16, 64])
+    embedding.add_argument("--in-flight", type=int, nargs="+", default=[1, 4])
+    embedding.add_argument("--latency", type=float, default=0.05, help="seconds per fake embedding request")
+    embedding.add_argument("--rps", type=float, default=20, help="fake provider requests per second before 429s")
+    embedding.add_argument("--failure-rate", type=float, default=0.02, help="fraction of requests failing with 503")
+    embedding.add_argument("--backoff", type=float, default=0.05, help="base retry backoff in seconds")
+    embedding.add_argument("--seed", type=int, default=0)
+    embedding.set_defaults(func=bench_embedding)
+
+    load = subparsers.add_parser("load", help="concurrent users ingesting, chatting and quizzing against the fakes")
+    load.add_argument("--users", type=int, nargs="+", default=[1, 8, 32], help="concurrent users, one run each")
+    load.add_argument("--pages", type=int, nargs="+", default=[5, 50, 200], help="PDF sizes, assigned round-robin")
+    load.add_argument("--chat-turns", type=int, default=3)
+    load.add_argument("--quiz-questions", type=int, default=5)
+    load.add_argument("--model-latency", type=float, default=0.2, help="seconds before the fake model's first token")
+    load.add_argument("--token-latency", type=float, default=0.002, help="seconds per streamed word")
+    load.add_argument("--model-rps", type=float, default=None, help="fake model requests per second before 429s")
+    load.add_argument("--embed-latency", type=float, default=0.05, help="seconds per fake embedding request")
+    load.add_argument("--embed-rps", type=float, default=None, help="fake embedder requests per second before 429s")
+    load.add_argument("--tool-latency", type=float, default=0.3, help="seconds per fake Tavily/YouTube/Todoist call")
+    load.add_argument("--failure-rate", type=float, default=0.0, help="fraction of fake calls failing with 503")
+    load.add_argument("--workdir", help="directory for vector tables and caches (default: a fresh temp dir)")
+    load.add_argument("--baseline", help="previous --json results to check for p95 regressions")
+    load.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 slowdown against the baseline")
+    load.add_argument("--seed", type=int, default=0)
+    load.set_defaults(func=bench_load)
+
+    startup = subparsers.add_parser("startup", help="module import and first Streamlit render time in fresh processes")
+    startup.add_argument("--repeat", type=int, default=5)
+    startup.add_argument("--modules", nargs="+",
+                         default=["ingestion", "registry", "question_bank", "chat_agent", "quiz_agent"])
+    startup.add_argument("--skip-render", action="store_true", help="only time the imports")
+    startup.add_argument("--baseline", help="previous --json results to check for p95 regressions")
+    startup.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 slowdown against the baseline")
+    startup.set_defaults(func=bench_startup)
+
+    answer_modes = subparsers.add_parser("answer-modes", help="direct vs agentic chat answers on the same questions")
+    answer_modes.add_argument("--questions", type=int, default=40)
+    answer_modes.add_argument("--modes", nargs="+", default=["direct", "agentic"])
+    answer_modes.add_argument("--pages", type=int, default=50, help="synthetic pages in the document")
+    answer_modes.add_argument("--model-latency", type=float, default=0.4, help="seconds per fake model request")
+    answer_modes.add_argument("--token-latency", type=float, default=0.002, help="seconds per streamed word")
+    answer_modes.add_argument("--embed-latency", type=float, default=0.05, help="seconds per fake embedding request")
+    answer_modes.add_argument("--tool-latency", type=float, default=0.3, help="seconds per fake Tavily/YouTube/Todoist call")
+    # gemini-2.0-flash list prices in USD per million tokens
+    answer_modes.add_argument("--input-price", type=float, default=0.10, help="USD per million input tokens")
+    answer_modes.add_argument("--output-price", type=float, default=0.40, help="USD per million output tokens")
+    answer_modes.add_argument("--workdir", help="directory for vector tables and caches (default: a fresh temp dir)")
+    answer_modes.add_argument("--baseline", help="previous --json results to check for p95 regressions")
+    answer_modes.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 slowdown against the baseline")
+    answer_modes.add_argument("--seed", type=int, default=0)
+    answer_modes.set_defaults(func=bench_answer_modes)
+
+    retrieval = subparsers.add_parser("retrieval", help="recall@k and latency of vector, lexical and hybrid retrieval")
+    retrieval.add_argument("--pages", type=int, default=100, help="synthetic pages in the document")
+    retrieval.add_argument("--queries", type=int, default=200)
+    retrieval.add_argument("--k", type=int, default=5, help="chunks retrieved per query")
+    retrieval.add_argument("--modes", nargs="+", default=["vector", "lexical", "hybrid"])
+    retrieval.add_argument("--embed-latency", type=float, default=0.05, help="seconds per fake embedding request")
+    retrieval.add_argument("--workdir", help="directory for vector tables and caches (default: a fresh temp dir)")
+    retrieval.add_argument("--baseline", help="previous --json results to check for p95 regressions")
+    retrieval.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 slowdown against the baseline")
+    retrieval.add_argument("--seed", type=int, default=0)
+    retrieval.set_defaults(func=bench_retrieval)
+
+    library = subparsers.add_parser("library", help="library_knowledge search latency and ANN recall as the shared library grows")
+    library.add_argument("--chunks", type=int, nargs="+", default=[1000, 10000, 50000], help="library sizes, in order")
+    library.add_argument("--chunks-per-doc", type=int, default=200)
+    library.add_argument("--dimensions", type=int, default=768, help="vector size (gemini embeddings are 768)")
+    library.add_argument("--ann-min-rows", type=int, default=20000, help="rows before the IVF_PQ index is built")
+    library.add_argument("--queries", type=int, default=100)
+    library.add_argument("--k", type=int, default=5, help="chunks retrieved per query")
+    library.add_argument("--workdir", help="directory for the library table (default: a fresh temp dir)")
+    library.add_argument("--baseline", help="previous --json results to check for p95 regressions")
+    library.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 slowdown against the baseline")
+    library.add_argument("--seed", type=int, default=0)
+    library.set_defaults(func=bench_library)
+
+    ingest = subparsers.add_parser("ingest", help="time until a new PDF is searchable and fully indexed")
+    ingest.add_argument("--pages", type=int, nargs="+", default=[50, 400], help="synthetic PDF sizes")
+    ingest.add_argument("--workers", type=int, nargs="+", default=[1, 4], help="page extraction processes")
+    ingest.add_argument("--batch-pages", type=int, default=16, help="pages indexed per batch")
+    ingest.add_argument("--repeat", type=int, default=3)
+    ingest.add_argument("--embed-latency", type=float, default=0.05, help="seconds per fake embedding request")
+    ingest.add_argument("--workdir", help="directory for vector tables and caches (default: a fresh temp dir)")
+    ingest.add_argument("--baseline", help="previous --json results to check for p95 regressions")
+    ingest.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 slowdown against the baseline")
+    ingest.add_argument("--seed", type=int, default=0)
+    ingest.set_defaults(func=bench_ingest)
+
+    attempts = subparsers.add_parser("attempts", help="quiz attempt store recording, loading and dashboard query latency")
+    attempts.add_argument("--attempts", type=int, nargs="+", default=[1000, 100000, 300000], help="stored attempts, in order")
+    attempts.add_argument("--users", type=int, default=2000)
+    attempts.add_argument("--docs", type=int, default=100)
+    attempts.add_argument("--questions", type=int, default=5, help="questions per attempt")
+    attempts.add_argument("--sections", type=int, default=10, help="sections per document")
+    attempts.add_argument("--repeat", type=int, default=50)
+    attempts.add_argument("--workdir", help="directory for the attempt files (default: a fresh temp dir)")
+    attempts.add_argument("--baseline", help="previous --json results to check for p95 regressions")
+    attempts.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 slowdown against the baseline")
+    attempts.add_argument("--seed", type=int, default=0)
+    attempts.set_defaults(func=bench_attempts)
+
+    tools = subparsers.add_parser("tools", help="web search and YouTube tool latency with and without the tool cache")
+    tools.add_argument("--users", type=int, nargs="+", default=[1, 8, 32], help="concurrent users to simulate")
+    tools.add_argument("--calls", type=int, default=20, help="tool calls per user")
+    tools.add_argument("--queries", type=int, default=50, help="distinct queries the calls are drawn from")
+    tools.add_argument("--zipf", type=float, default=1.1, help="skew of query popularity")
+    tools.add_argument("--tool-latency", type=float, default=0.5, help="seconds per fake tool request")
+    tools.add_argument("--workdir", help="directory for the tool cache (default: a fresh temp dir)")
+    tools.add_argument("--baseline", help="previous --json results to check for p95 regressions")
+    tools.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 slowdown against the baseline")
+    tools.add_argument("--seed", type=int, default=0)
+    tools.set_defaults(func=bench_tools)
+
+    history = subparsers.add_parser("history", help="Streamlit rerun time and prompt size as a chat session grows")
+    history.add_argument("--turns", type=int, nargs="+", default=[10, 100, 1000], help="session lengths, in exchanges")
+    history.add_argument("--pages", type=int, default=5, help="synthetic PDF size")
+    history.add_argument("--repeat", type=int, default=3, help="renders timed per session length")
+    history.add_argument("--workdir", help="directory for vector tables and chat history (default: a fresh temp dir)")
+    history.add_argument("--baseline", help="previous --json results to check for p95 regressions")
+    history.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 slowdown against the baseline")
+    history.add_argument("--seed", type=int, default=0)
+    history.set_defaults(func=bench_history)
+
+    args = parser.parse_args(argv)
+    # Resolve output paths before a benchmark changes into its working directory
+    json_path = os.path.abspath(args.json) if args.json else None
+    baseline_path = os.path.abspath(args.baseline) if getattr(args, "baseline", None) else None
+    results = args.func(args)
+    print_table(results)
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump({"command": args.command, "results": results}, f, indent=2)
+    if baseline_path:
+        with open(baseline_path) as f:
+            regressions = compare_results(json.load(f)["results"], results, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            print_table(regressions)
+            return 1
+        print(f"\nNo p95 regressions beyond {args.tolerance:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,18 @@
-from agno.agent import Agent
-from agno.models.google.gemini import Gemini
-from agno.tools.youtube import YouTubeTools
-from agno.tools.tavily import TavilyTools
-from agno.tools.todoist import TodoistTools
-from agno.models.groq import Groq
-from agno.knowledge.pdf import PDFKnowledgeBase, PDFReader
-from agno.embedder.google import GeminiEmbedder
-from agno.document.chunking.agentic import AgenticChunking
-from agno.vectordb.lancedb import LanceDb
-
+# agno's agents, models and tools are imported where they are first built, so importing
+# this module (on every Streamlit script run) costs nothing until a chat agent is needed
+from functools import lru_cache
+import logging
 import os
+import re
+import time
 from dotenv import load_dotenv
 
+from fakes import USE_FAKES, fake_services
+from ingestion import ingest_pdf
+from response_cache import RESPONSE_CACHE_SIMILARITY, response_cache
+from tool_cache import cache_toolkit, tool_cache
+from tracing import activate, record_span, span, start_span, token_usage
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -21,89 +22,378 @@ GOOGLE_API_KEY = os.getenv("google_api_key")
 TAVILY_API_KEY = os.getenv("tavily_api_key")
 TODOIST_TOKEN = os.getenv("todoist_token")
 
-todoist_agent = Agent(
-    name="Todoist Agent",
-    role="Manage your todoist tasks",
-    instructions=[
-        "When given a task, create a todoist task for it.",
-        "When given a list of tasks, create a todoist task for each one.",
-        "When given a task to update, update the todoist task.",
-        "When given a task to delete, delete the todoist task.",
-        "When given a task to get, get the todoist task.",
-    ],
-    agent_id="todoist-agent",
-    model=Groq(id="llama-3.3-70b-versatile", api_key=GROQ_API_KEY),
-    tools=[TodoistTools(api_token=TODOIST_TOKEN)],
-    markdown=True,
-    show_tool_calls=True,
-    expected_output="Todoist task created successfully.",
+# "direct" answers from the top chunks in a single completion and only hands questions that need
+# the web, YouTube or todoist tools to the agent; "agentic" always lets the agent decide
+CHAT_MODE = os.getenv("chat_mode", "direct")
+# Chunks retrieved up front for a direct answer
+DIRECT_TOP_K = int(os.getenv("direct_top_k", "5"))
+# Runs kept in an agent's memory; only the last 3 are replayed to the model (num_history_responses),
+# and older turns reach it through the rolling summary in chat_history
+CHAT_MEMORY_RUNS = int(os.getenv("chat_memory_runs", "6"))
+# Words in questions that need a tool rather than the document
+TOOL_KEYWORDS = re.compile(
+    r"\b(?:search|web|online|internet|latest|news|article|resource|link|youtube|video|tutorial|course"
+    r"|study plan|schedule|todoist|task|remind|reminder|to-?do)s?\b",
+    re.IGNORECASE,
 )
 
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def get_todoist_agent():
+    """The todoist team member, built on first use and shared by every chat agent in the process."""
+    from agno.agent import Agent
+    from agno.models.groq import Groq
+    from agno.tools.todoist import TodoistTools
+
+    return Agent(
+        name="Todoist Agent",
+        role="Manage your todoist tasks",
+        instructions=[
+            "When given a task, create a todoist task for it.",
+            "When given a list of tasks, create a todoist task for each one.",
+            "When given a task to update, update the todoist task.",
+            "When given a task to delete, delete the todoist task.",
+            "When given a task to get, get the todoist task.",
+        ],
+        agent_id="todoist-agent",
+        model=Groq(id="llama-3.3-70b-versatile", api_key=GROQ_API_KEY),
+        tools=[TodoistTools(api_token=TODOIST_TOKEN)],
+        markdown=True,
+        show_tool_calls=True,
+        expected_output="Todoist task created successfully.",
+    )
+
+
+@lru_cache(maxsize=None)
+def get_search_tools():
+    # Stateless toolkits, so one Tavily client and one YouTube toolkit serve every agent; their
+    # results are cached and identical calls in flight share one request
+    from agno.tools.tavily import TavilyTools
+    from agno.tools.youtube import YouTubeTools
+
+    return cache_toolkit(TavilyTools(api_key=TAVILY_API_KEY)), cache_toolkit(YouTubeTools())
+
+
+def needs_tools(message) -> bool:
+    return TOOL_KEYWORDS.search(message) is not None
+
+
+class RoutedChatAgent:
+    """Answers from the document in one completion, with the top chunks retrieved up front.
+
+    Questions that need the web, YouTube or todoist tools go to the agentic chat agent instead,
+    which costs a tool-calling round-trip. Both agents share one chat memory, so follow-ups see
+    the whole conversation whichever of them answered.
+    """
+
+    def __init__(self, direct, agentic):
+        self.direct = direct
+        self.agentic = agentic
+        self.last_mode = None
+
+    @property
+    def knowledge(self):
+        return self.agentic.knowledge
+
+    @property
+    def memory(self):
+        return getattr(self.agentic, "memory", None)
+
+    @property
+    def additional_context(self):
+        return self.agentic.additional_context
+
+    @additional_context.setter
+    def additional_context(self, context):
+        # Added to the system message of whichever agent answers
+        self.direct.additional_context = context
+        self.agentic.additional_context = context
+
+    @property
+    def run_response(self):
+        return (self.agentic if self.last_mode == "agentic" else self.direct).run_response
+
+    def run(self, message, **kwargs):
+        self.last_mode = "agentic" if needs_tools(message) else "direct"
+        return (self.agentic if self.last_mode == "agentic" else self.direct).run(message, **kwargs)
+
+
+def _top_k_retriever(knowledge, top_k):
+    # The knowledge base is shared by every session, so the direct agent asks for its own top_k
+    def retriever(query, num_documents=None, **kwargs):
+        return [doc.to_dict() for doc in knowledge.search(query=query, num_documents=top_k)]
+
+    return retriever
+
+
+def build_direct_agent(knowledge, memory=None, top_k=DIRECT_TOP_K):
+    if USE_FAKES:
+        return fake_services.agent(knowledge=knowledge, num_documents=top_k)
+    from agno.agent import Agent
+    from agno.models.google.gemini import Gemini
+
+    return Agent(
+        name="StudyScout",
+        knowledge=knowledge,
+        # References go into the prompt up front, so the model never needs a search tool call
+        search_knowledge=False,
+        add_references=True,
+        retriever=_top_k_retriever(knowledge, top_k),
+        model=Gemini(id="gemini-2.0-flash", api_key=GOOGLE_API_KEY),
+        markdown=True,
+        description="You are a study partner who answers questions and provides explanations about the user's study material.",
+        instructions=[
+            "Answer from the references to the study material provided with the question.",
+            "Break down complex topics into digestible chunks and provide step-by-step explanations with practical examples.",
+            "If the references do not cover the question, say so and answer from general knowledge.",
+        ],
+        memory=memory,
+        read_chat_history=True,
+        add_history_to_messages=True,
+        num_history_responses=3,
+    )
+
+
+def build_chat_agent(knowledge, agent_name="StudyScout", agent_role="collect resources, make study plans, and provide explanations",
+                     mode=None):
+    if (mode or CHAT_MODE) != "direct":
+        return build_agentic_agent(knowledge, agent_name=agent_name, agent_role=agent_role)
+    memory = None
+    if not USE_FAKES:
+        from agno.memory.agent import AgentMemory
+
+        memory = AgentMemory()
+    return RoutedChatAgent(
+        build_direct_agent(knowledge, memory=memory),
+        build_agentic_agent(knowledge, agent_name=agent_name, agent_role=agent_role, memory=memory),
+    )
+
+
+def build_agentic_agent(knowledge, agent_name="StudyScout", agent_role="collect resources, make study plans, and provide explanations",
+                        memory=None):
+    if USE_FAKES:
+        return fake_services.agent(knowledge=knowledge, tools=True, search_knowledge=True, tool_cache=tool_cache)
+    from agno.agent import Agent
+    from agno.models.google.gemini import Gemini
+
+    # Initialize a new agent with an already ingested knowledge base
+    return Agent(
+        name="StudyScout",
+        knowledge=knowledge,
+        search_knowledge=True,
+        add_references=True,
+        role="collect resources, make study plans, and provide explanations",
+        team=[get_todoist_agent()],
+        model=Gemini(id="gemini-2.0-flash", api_key=GOOGLE_API_KEY),
+        tools=list(get_search_tools()),
+        markdown=True,
+        description="You are a study partner who assists users in finding resources, answering questions, and providing explanations on various topics.",
+        instructions=[
+            """Use Tavily to search for relevant information on the given topic and verify information from multiple reliable sources.,
+            Break down complex topics into digestible chunks and provide step-by-step explanations with practical examples.,
+            Share curated learning resources including documentation, tutorials, articles, research papers, and community discussions.,
+            Recommend high-quality YouTube videos and online courses that match the user's learning style and proficiency level.,
+            Suggest hands-on projects and exercises to reinforce learning, ranging from beginner to advanced difficulty.,
+            Create personalized study plans with clear milestones, deadlines, and progress tracking.,
+            Provide tips for effective learning techniques, time management, and maintaining motivation.,
+            Recommend relevant communities, forums, and study groups for peer learning and networking.,
+            make a todoist list for the user to follow - give a list of tasks (daily tasks as separate function calls) to the todoist agent""",
+        ],
+        memory=memory,
+        read_chat_history=True,
+        add_history_to_messages=True,
+        num_history_responses=3,
+        show_tool_calls=True
+    )
+
 
 def initialize_chat_with_pdf(pdf_file, agent_name="StudyScout", agent_role="collect resources, make study plans, and provide explanations", table_name=None):
-    import tempfile
-    import os
-    import uuid
-    
-    # Create a unique table name if not provided
-    if table_name is None:
-        table_name = f"pdf_{uuid.uuid4().hex[:8]}"
-    else:
-        # Create a PostgreSQL-safe table name
-        table_name = f"pdf_{table_name.lower().replace(' ', '_').replace('-', '_')}"
-    
-    # Save the uploaded PDF to a temporary file
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-        tmp_file.write(pdf_file.getvalue())
-        pdf_path = tmp_file.name
-    
+    document = ingest_pdf(pdf_file, name=table_name, wait=True)
+    return build_chat_agent(document.knowledge, agent_name=agent_name, agent_role=agent_role)
+
+
+def _record_tool(run_span, tool) -> float:
+    elapsed = getattr(tool.get("metrics"), "time", None) or 0.0
+    record_span("tool", elapsed, parent=run_span, tool=tool.get("tool_name"))
+    return elapsed
+
+
+def _finish_run(run_span, response, elapsed: float, tool_seconds: float, num_tools: int) -> None:
+    # Whatever the tools (knowledge search, web, YouTube, todoist) did not take was spent in the model
+    record_span("model", max(0.0, elapsed - tool_seconds), parent=run_span)
+    run_span.set(tool_calls=num_tools, **token_usage(response))
+    run_span.end()
+
+
+def stream_chat(agent, message, parent=None):
+    """Run the chat agent in streaming mode.
+
+    Yields ``("content", text)`` for every token delta and ``("tool_started", tool)`` /
+    ``("tool_completed", tool)`` for tool calls, where ``tool`` is agno's tool call dict
+    (``tool_name``, ``tool_args`` and, once completed, ``metrics``). Time to first token
+    is logged for every request, and the run is traced as an ``agent_run`` span under
+    ``parent`` with one ``tool`` span per tool call.
+    """
+    from agno.run.response import RunEvent
+
+    start = time.perf_counter()
+    time_to_first_token = None
+    running = {}
+    num_tools = 0
+    tool_seconds = 0.0
+    completed = None
+    run_span = start_span("agent_run", parent=parent)
+
     try:
-        # Create a knowledge base for this specific PDF
-        custom_kb = PDFKnowledgeBase(
-            path=pdf_path,
-            vector_db = LanceDb(
-                uri='./tmp/lancedb',
-                table_name=table_name,
-                embedder=GeminiEmbedder(api_key=GOOGLE_API_KEY),
-            ),
-            reader=PDFReader(chunk=True, chunking_strategy=AgenticChunking()),
-        )
-        
-        # Load the document into the vector DB
-        custom_kb.load(recreate=False)
-        
-        # Initialize a new agent with this knowledge base
-        agent = Agent(
-            name="StudyScout",
-            knowledge=custom_kb,
-            search_knowledge=True,
-            add_references=True,
-            role="collect resources, make study plans, and provide explanations",
-            team=[todoist_agent],
-            model=Gemini(id="gemini-2.0-flash", api_key=GOOGLE_API_KEY),
-            tools=[TavilyTools(api_key=TAVILY_API_KEY), YouTubeTools()],
-            markdown=True,
-            description="You are a study partner who assists users in finding resources, answering questions, and providing explanations on various topics.",
-            instructions=[
-                """Use Tavily to search for relevant information on the given topic and verify information from multiple reliable sources.,
-                Break down complex topics into digestible chunks and provide step-by-step explanations with practical examples.,
-                Share curated learning resources including documentation, tutorials, articles, research papers, and community discussions.,
-                Recommend high-quality YouTube videos and online courses that match the user's learning style and proficiency level.,
-                Suggest hands-on projects and exercises to reinforce learning, ranging from beginner to advanced difficulty.,
-                Create personalized study plans with clear milestones, deadlines, and progress tracking.,
-                Provide tips for effective learning techniques, time management, and maintaining motivation.,
-                Recommend relevant communities, forums, and study groups for peer learning and networking.,
-                make a todoist list for the user to follow - give a list of tasks (daily tasks as separate function calls) to the todoist agent""",
-            ],
-            read_chat_history=True,
-            add_history_to_messages=True,
-            num_history_responses=3,
-            show_tool_calls=True
-        )
-        
-        os.unlink(pdf_path)
-        
-        return agent
-    except Exception as e:
-        os.unlink(pdf_path)
-        raise e
+        chunks = iter(agent.run(message, stream=True, stream_intermediate_steps=True))
+        if getattr(agent, "last_mode", None):
+            run_span.set(mode=agent.last_mode)
+        while True:
+            # Only while the agent runs, so retrieval spans nest here whichever thread resumes us
+            with activate(run_span):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            if chunk.event == RunEvent.run_response.value and chunk.content:
+                if time_to_first_token is None:
+                    time_to_first_token = time.perf_counter() - start
+                    run_span.set(time_to_first_token=round(time_to_first_token, 4))
+                    logger.info("Chat time to first token: %.2fs", time_to_first_token)
+                yield "content", chunk.content
+            elif chunk.event == RunEvent.tool_call_started.value and chunk.tools:
+                tool = chunk.tools[-1]
+                running[tool.get("tool_call_id")] = tool
+                num_tools += 1
+                yield "tool_started", tool
+            elif chunk.event == RunEvent.tool_call_completed.value and chunk.tools:
+                for tool in chunk.tools:
+                    if tool.get("tool_call_id") in running and tool.get("metrics") is not None:
+                        del running[tool.get("tool_call_id")]
+                        tool_seconds += _record_tool(run_span, tool)
+                        yield "tool_completed", tool
+            elif chunk.event == RunEvent.run_completed.value:
+                completed = chunk
+    except BaseException as e:
+        run_span.set(error=type(e).__name__)
+        raise
+    finally:
+        _finish_run(run_span, completed if completed is not None else getattr(agent, "run_response", None),
+                    time.perf_counter() - start, tool_seconds, num_tools)
+
+    logger.info(
+        "Chat response finished in %.2fs (time to first token %s, %d tool calls)",
+        time.perf_counter() - start,
+        f"{time_to_first_token:.2f}s" if time_to_first_token is not None else "n/a",
+        num_tools,
+    )
+
+
+def trim_memory(agent, runs: int = CHAT_MEMORY_RUNS) -> None:
+    """Drop all but the last ``runs`` runs from the agent's memory, which agno otherwise keeps forever."""
+    memory = getattr(agent, "memory", None)
+    if memory is None or not hasattr(memory, "runs"):
+        return
+    if len(memory.runs) > runs:
+        memory.runs = memory.runs[-runs:]
+    # A user and an assistant message per run
+    if len(memory.messages) > 2 * runs:
+        memory.messages = memory.messages[-2 * runs:]
+
+
+def _cache_embedder(agent):
+    if RESPONSE_CACHE_SIMILARITY == "embedding" and agent.knowledge is not None:
+        return agent.knowledge.vector_db.embedder
+    return None
+
+
+def _conversation_context(agent):
+    """The previous exchange and the summary of older ones, which a question may depend on."""
+    memory = getattr(agent, "memory", None)
+    messages = [m for m in getattr(memory, "messages", None) or [] if m.role in ("user", "assistant")]
+    parts = [f"{m.role}: {m.get_content_string()}" for m in messages[-2:]]
+    if getattr(agent, "additional_context", None):
+        parts.append(agent.additional_context)
+    return "\n".join(parts) or None
+
+
+def _store_answer(agent, doc_id, message, answer, used_tools, context):
+    # Answers from a partly indexed document may miss later pages, so they are not reused
+    if getattr(agent.knowledge, "indexing", False):
+        return
+    response_cache.store(doc_id, message, answer, used_tools=used_tools, embedder=_cache_embedder(agent),
+                         context=context)
+
+
+def _cached_answer(agent, doc_id, message, context):
+    with span("cache_lookup") as lookup_span:
+        cached = response_cache.lookup(doc_id, message, embedder=_cache_embedder(agent), context=context)
+        lookup_span.set(hit=cached is not None)
+    return cached
+
+
+def get_chat_response(agent, doc_id, message, standalone=False):
+    """Answer ``message`` in one go, reusing the cached answer to a repeated question.
+
+    Cached answers are only reused within the same conversation context, unless ``standalone``
+    says the message does not depend on it (like the suggested topic prompts).
+    Returns ``(answer, served_from_cache)``.
+    """
+    with span("chat", doc_id=doc_id[:12]) as chat_span:
+        # Taken before the run, which adds this exchange to the agent's memory
+        context = None if standalone else _conversation_context(agent)
+        cached = _cached_answer(agent, doc_id, message, context)
+        chat_span.set(cached=cached is not None)
+        if cached is not None:
+            return cached.answer, True
+
+        start = time.perf_counter()
+        run_span = start_span("agent_run")
+        try:
+            with activate(run_span):
+                response = agent.run(message)
+            if getattr(agent, "last_mode", None):
+                run_span.set(mode=agent.last_mode)
+        except BaseException as e:
+            run_span.set(error=type(e).__name__)
+            _finish_run(run_span, None, time.perf_counter() - start, 0.0, 0)
+            raise
+        tools = getattr(response, 'tools', None) or []
+        tool_seconds = sum(_record_tool(run_span, tool) for tool in tools)
+        _finish_run(run_span, response, time.perf_counter() - start, tool_seconds, len(tools))
+
+        content = response.content if hasattr(response, 'content') else str(response)
+        _store_answer(agent, doc_id, message, content, bool(tools), context)
+        trim_memory(agent)
+        return content, False
+
+
+def stream_chat_response(agent, doc_id, message):
+    """stream_chat with the response cache in front of it.
+
+    A cache hit yields a single ``("cached", answer)`` event; otherwise the stream_chat events
+    are passed through and the finished answer is cached.
+    """
+    chat_span = start_span("chat", doc_id=doc_id[:12])
+    try:
+        context = _conversation_context(agent)
+        with activate(chat_span):
+            cached = _cached_answer(agent, doc_id, message, context)
+        chat_span.set(cached=cached is not None)
+        if cached is not None:
+            yield "cached", cached.answer
+            return
+
+        answer = []
+        used_tools = False
+        for kind, payload in stream_chat(agent, message, parent=chat_span):
+            if kind == "content":
+                answer.append(payload)
+            elif kind == "tool_started":
+                used_tools = True
+            yield kind, payload
+        _store_answer(agent, doc_id, message, "".join(answer), used_tools, context)
+        trim_memory(agent)
+    finally:
+        chat_span.end()
@@ -0,0 +1,144 @@
+"""Chat history of one conversation that stays the same size in memory however long it runs.
+
+Every message is appended to a JSON lines file under ./tmp; only the most recent ones are kept
+in memory, and older ones are read back from the file when the user scrolls to them. Exchanges
+older than the ones the agent sees verbatim are folded into a rolling summary of bounded size,
+which is passed to the agent instead, so prompts do not grow with the conversation either.
+"""
+from collections import Counter, deque
+from typing import Dict, List, Optional
+import json
+import os
+import re
+import uuid
+import weakref
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+CHAT_HISTORY_DIR = './tmp/chat_history'
+# Messages kept in memory; older ones are read back from disk when shown
+CHAT_HISTORY_MEMORY_MESSAGES = int(os.getenv("chat_history_memory_messages", "40"))
+# Messages shown at once; "Show earlier messages" pages back by as many again
+CHAT_HISTORY_PAGE_MESSAGES = int(os.getenv("chat_history_page_messages", "20"))
+# Size of the rolling summary in characters, roughly four per prompt token
+CHAT_SUMMARY_MAX_CHARS = int(os.getenv("chat_summary_max_chars", "1600"))
+# Exchanges the agent replays verbatim from its own memory (agno's num_history_responses)
+CHAT_VERBATIM_EXCHANGES = 3
+# Topics kept from exchanges that no longer fit in the summary
+CHAT_SUMMARY_TOPICS = 15
+
+_STOPWORDS = set("""
+about above after again against because before being below between could doing during every
+explain first further having other their there these those through under until using what
+where which while would should tell show give please more some does mean meaning into from
+with this that have will your yours them they then than when
+""".split())
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _first_sentence(text: str, limit: int = 160) -> str:
+    text = re.sub(r"[#*_`>]+", "", text)
+    text = re.sub(r"\s+", " ", text).strip()
+    sentence = re.split(r"(?<=[.!?])\s", text, maxsplit=1)[0]
+    return sentence if len(sentence) <= limit else sentence[:limit - 3].rstrip() + "..."
+
+
+class ChatHistory:
+    """Messages (dicts with ``role``, ``content`` and any extra keys) of one conversation.
+
+    Appending and indexing work like a list's; ``window`` returns a slice, reading messages no
+    longer in memory from disk. The file is removed when the history is garbage collected,
+    i.e. when its Streamlit session ends.
+    """
+
+    def __init__(self, path: Optional[str] = None, memory_messages: int = CHAT_HISTORY_MEMORY_MESSAGES,
+                 summary_max_chars: int = CHAT_SUMMARY_MAX_CHARS):
+        self.path = path or os.path.join(CHAT_HISTORY_DIR, f"{uuid.uuid4().hex}.jsonl")
+        self.summary_max_chars = summary_max_chars
+        self._recent: deque = deque(maxlen=max(memory_messages, 2 * CHAT_VERBATIM_EXCHANGES + 1))
+        # Byte offset of every message in the file, so any page is one seek away
+        self._offsets: List[int] = []
+        self._size = 0
+        # Rolling summary: a line per folded exchange, and the topics of lines that no longer fit
+        self._summarized = 0
+        self._question: Optional[str] = None
+        self._lines: deque = deque()
+        self._lines_chars = 0
+        self._topics: Counter = Counter()
+        self._finalizer = weakref.finalize(self, _remove, self.path)
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __getitem__(self, index: int) -> Dict:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("chat history index out of range")
+        return self.window(index, index + 1)[0]
+
+    def append(self, message: Dict) -> None:
+        line = (json.dumps(message) + "\n").encode()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "ab") as f:
+            f.write(line)
+        self._offsets.append(self._size)
+        self._size += len(line)
+        self._recent.append(message)
+        if message.get("role") == "assistant":
+            # Everything before the exchanges the agent still sees verbatim goes into the summary
+            while self._summarized < len(self) - 2 * CHAT_VERBATIM_EXCHANGES:
+                self._fold(self[self._summarized])
+                self._summarized += 1
+
+    def window(self, start: int, stop: int) -> List[Dict]:
+        """Messages ``start`` to ``stop`` (exclusive), oldest first."""
+        start, stop = max(0, start), min(stop, len(self))
+        if start >= stop:
+            return []
+        first_recent = len(self) - len(self._recent)
+        older = []
+        if start < first_recent:
+            end = self._offsets[min(stop, first_recent)] if min(stop, first_recent) < len(self) else self._size
+            with open(self.path, "rb") as f:
+                f.seek(self._offsets[start])
+                older = [json.loads(line) for line in f.read(end - self._offsets[start]).splitlines()]
+        recent = [self._recent[i - first_recent] for i in range(max(start, first_recent), stop)]
+        return older + recent
+
+    def _fold(self, message: Dict) -> None:
+        content = message.get("content") or ""
+        if message.get("role") == "user":
+            self._question = content
+            return
+        question, self._question = self._question, None
+        line = f"- {_first_sentence(question, 120)} -> {_first_sentence(content)}" if question else f"- {_first_sentence(content)}"
+        self._lines.append((line, question or content))
+        self._lines_chars += len(line) + 1
+        while self._lines and self._lines_chars > self.summary_max_chars * 3 // 4:
+            # The oldest exchange only keeps its topics
+            line, text = self._lines.popleft()
+            self._lines_chars -= len(line) + 1
+            self._topics.update(w for w in re.findall(r"[a-z][a-z-]{4,}", text.lower()) if w not in _STOPWORDS)
+            if len(self._topics) > 10 * CHAT_SUMMARY_TOPICS:
+                self._topics = Counter(dict(self._topics.most_common(5 * CHAT_SUMMARY_TOPICS)))
+
+    @property
+    def summary(self) -> Optional[str]:
+        """What was discussed before the exchanges the agent sees verbatim, or None before there is any."""
+        if not self._lines and not self._topics:
+            return None
+        parts = ["Summary of the earlier conversation with the student (older than your chat history):"]
+        if self._topics:
+            topics = ", ".join(word for word, _ in self._topics.most_common(CHAT_SUMMARY_TOPICS))
+            parts.append(f"Earlier topics: {topics}")
+        parts.extend(line for line, _ in self._lines)
+        return "\n".join(parts)[:self.summary_max_chars]
@@ -0,0 +1,159 @@
+from agno.document.base import Document
+from agno.document.chunking.strategy import ChunkingStrategy
+from typing import List, Optional
+import os
+import re
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Chunking mode for this deployment: "paragraph", "token" or "agentic"
+CHUNKING_MODE = os.getenv("chunking_mode", "paragraph")
+# Chunk size in characters for paragraph/agentic mode and in tokens for token mode
+CHUNK_SIZE = os.getenv("chunk_size")
+CHUNK_OVERLAP = os.getenv("chunk_overlap")
+
+_TOKEN_RE = re.compile(r"\S+")
+# Numbered headings ("2.3 Gradient Descent", "Chapter 4"), or short title-like lines
+_NUMBERED_HEADING_RE = re.compile(r"^(chapter|section|part|unit|lecture)?\s*\d+(\.\d+)*[.:)]?\s+\S", re.IGNORECASE)
+
+
+def _make_chunk(document: Document, content: str, chunk_number: int, **extra_meta) -> Document:
+    meta_data = document.meta_data.copy()
+    meta_data["chunk"] = chunk_number
+    meta_data["chunk_size"] = len(content)
+    meta_data.update(extra_meta)
+    chunk_id = None
+    if document.id:
+        chunk_id = f"{document.id}_{chunk_number}"
+    elif document.name:
+        chunk_id = f"{document.name}_{chunk_number}"
+    return Document(id=chunk_id, name=document.name, meta_data=meta_data, content=content)
+
+
+class TokenWindowChunking(ChunkingStrategy):
+    """Splits text into fixed windows of whitespace tokens with overlap, without any model calls"""
+
+    def __init__(self, chunk_size: int = 400, overlap: int = 50):
+        if overlap >= chunk_size:
+            raise ValueError(f"Invalid parameters: overlap ({overlap}) must be less than chunk size ({chunk_size}).")
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+
+    def chunk(self, document: Document) -> List[Document]:
+        tokens = _TOKEN_RE.findall(document.content or "")
+        chunks: List[Document] = []
+        step = self.chunk_size - self.overlap
+        start = 0
+        while start < len(tokens):
+            window = tokens[start:start + self.chunk_size]
+            chunks.append(_make_chunk(document, " ".join(window), len(chunks) + 1))
+            if start + self.chunk_size >= len(tokens):
+                break
+            start += step
+        return chunks
+
+
+class ParagraphChunking(ChunkingStrategy):
+    """Packs whole paragraphs into chunks up to ``chunk_size`` characters, starting a new chunk at headings.
+
+    Each chunk records the most recent heading as its ``section``, which is later used to tag
+    retrieved passages and quiz questions.
+    """
+
+    def __init__(self, chunk_size: int = 2000, overlap: int = 0, max_heading_length: int = 80):
+        if overlap >= chunk_size:
+            raise ValueError(f"Invalid parameters: overlap ({overlap}) must be less than chunk size ({chunk_size}).")
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.max_heading_length = max_heading_length
+
+    def is_heading(self, line: str) -> bool:
+        if not line or len(line) > self.max_heading_length or line[-1] in ".,;:?!":
+            return False
+        if _NUMBERED_HEADING_RE.match(line):
+            return True
+        letters = [c for c in line if c.isalpha()]
+        # ALL CAPS lines and short Title Case lines
+        if letters and all(c.isupper() for c in letters) and len(letters) > 3:
+            return True
+        words = line.split()
+        return 1 <= len(words) <= 8 and all(w[0].isupper() or not w[0].isalpha() for w in words)
+
+    def paragraphs(self, text: str) -> List[str]:
+        # Blank lines separate paragraphs; when the extractor gives none, fall back to single lines
+        blocks = re.split(r"\n\s*\n", text) if re.search(r"\n\s*\n", text) else text.split("\n")
+        return [re.sub(r"\s+", " ", block).strip() for block in blocks if block.strip()]
+
+    def chunk(self, document: Document) -> List[Document]:
+        chunks: List[Document] = []
+        section: Optional[str] = document.meta_data.get("section")
+        current: List[str] = []
+        current_len = 0
+
+        def flush():
+            nonlocal current, current_len
+            if current:
+                content = "\n".join(current)
+                chunks.append(_make_chunk(document, content, len(chunks) + 1, section=section))
+                # Carry the tail of the previous chunk over as overlap
+                tail = content[-self.overlap:] if self.overlap else ""
+                current = [tail] if tail else []
+                current_len = len(tail)
+
+        for paragraph in self.paragraphs(document.content or ""):
+            if self.is_heading(paragraph):
+                flush()
+                current, current_len = [], 0
+                section = paragraph
+            # Hard-split paragraphs that are longer than a whole chunk
+            while len(paragraph) > self.chunk_size:
+                cut = paragraph.rfind(" ", 0, self.chunk_size)
+                cut = cut if cut > 0 else self.chunk_size
+                flush()
+                current, current_len = [paragraph[:cut]], cut
+                paragraph = paragraph[cut:].lstrip()
+            if current_len + len(paragraph) > self.chunk_size:
+                flush()
+            current.append(paragraph)
+            current_len += len(paragraph) + 1
+        flush()
+        return chunks
+
+
+def chunk_pages(pages: List[Document], chunking_strategy: ChunkingStrategy,
+                section: Optional[str] = None) -> List[Document]:
+    """Chunk pages in order, carrying the last seen section heading over page breaks.
+
+    ``section`` is the heading in effect before the first page, when chunking a document in batches.
+    """
+    chunks: List[Document] = []
+    for page in pages:
+        if section is not None:
+            page.meta_data.setdefault("section", section)
+        page_chunks = chunking_strategy.chunk(page)
+        if page_chunks:
+            section = page_chunks[-1].meta_data.get("section", section)
+        chunks.extend(page_chunks)
+    return chunks
+
+
+def get_chunking_strategy(mode: Optional[str] = None) -> ChunkingStrategy:
+    """Build the chunking strategy for ``mode``, defaulting to the ``chunking_mode`` env var."""
+    mode = (mode or CHUNKING_MODE).lower()
+    kwargs = {}
+    if CHUNK_SIZE:
+        kwargs["chunk_size"] = int(CHUNK_SIZE)
+    if CHUNK_OVERLAP:
+        kwargs["overlap"] = int(CHUNK_OVERLAP)
+
+    if mode == "token":
+        return TokenWindowChunking(**kwargs)
+    if mode in ("paragraph", "heading"):
+        return ParagraphChunking(**kwargs)
+    if mode == "agentic":
+        from agno.document.chunking.agentic import AgenticChunking
+
+        return AgenticChunking(**({"max_chunk_size": kwargs["chunk_size"]} if "chunk_size" in kwargs else {}))
+    raise ValueError(f"Unknown chunking mode '{mode}', expected one of: paragraph, token, agentic")
@@ -0,0 +1,230 @@
+from agno.embedder.base import Embedder
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+EMBED_BATCH_SIZE = int(os.getenv("embed_batch_size", "32"))
+EMBED_MAX_IN_FLIGHT = int(os.getenv("embed_max_in_flight", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("embed_max_retries", "6"))
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PrecomputedEmbedder(Embedder):
+    """Serves vectors computed ahead of time and falls through to ``embedder`` for anything else.
+
+    LanceDb.insert embeds every document itself, so this is how the batched vectors
+    from embed_documents reach the table without a second round of requests.
+    """
+
+    embedder: Optional[Embedder] = None
+    vectors: Dict[str, List[float]] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self.dimensions = self.embedder.dimensions
+
+    def get_embedding(self, text: str) -> List[float]:
+        vector = self.vectors.get(_text_key(text))
+        return vector if vector is not None else self.embedder.get_embedding(text)
+
+    def get_embedding_and_usage(self, text: str) -> Tuple[List[float], Optional[Dict]]:
+        vector = self.vectors.get(_text_key(text))
+        if vector is not None:
+            return vector, None
+        return self.embedder.get_embedding_and_usage(text)
+
+
+def _text_key(text: str) -> str:
+    return hashlib.md5(text.encode()).hexdigest()
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    if getattr(error, "code", None) == 429 or getattr(error, "status_code", None) == 429:
+        return True
+    message = str(error)
+    return "429" in message or "RESOURCE_EXHAUSTED" in message
+
+
+class _Backpressure:
+    """Caps in-flight requests and halves the cap whenever the provider answers with a 429.
+
+    The cap grows back by one after every ``recover_after`` consecutive successes.
+    """
+
+    def __init__(self, max_in_flight: int, recover_after: int = 8):
+        self.max_in_flight = max_in_flight
+        self.limit = max_in_flight
+        self.recover_after = recover_after
+        self.in_flight = 0
+        self.resume_at = 0.0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        with self._cond:
+            while True:
+                wait = self.resume_at - time.monotonic()
+                if wait <= 0 and self.in_flight < self.limit:
+                    break
+                self._cond.wait(timeout=wait if wait > 0 else None)
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def success(self):
+        with self._cond:
+            self._successes += 1
+            if self._successes >= self.recover_after and self.limit < self.max_in_flight:
+                self.limit += 1
+                self._successes = 0
+                self._cond.notify_all()
+
+    def rate_limited(self, pause: float):
+        with self._cond:
+            self.limit = max(1, self.limit // 2)
+            self._successes = 0
+            self.resume_at = max(self.resume_at, time.monotonic() + pause)
+
+
+def _embed_batch(embedder: Embedder, texts: List[str]) -> List[List[float]]:
+    batch_fn = getattr(embedder, "get_embeddings_batch", None)
+    if batch_fn is not None:
+        return batch_fn(texts)
+    try:
+        from agno.embedder.google import GeminiEmbedder
+    except ImportError:
+        GeminiEmbedder = None
+    if GeminiEmbedder is not None and isinstance(embedder, GeminiEmbedder):
+        # embed_content accepts a list of texts and returns one embedding per text
+        response = embedder._response(text=texts)
+        return [embedding.values for embedding in response.embeddings]
+    return [embedder.get_embedding(text) for text in texts]
+
+
+def _read_checkpoint(path: Optional[str]) -> Dict[str, List[float]]:
+    vectors: Dict[str, List[float]] = {}
+    if not path or not os.path.exists(path):
+        return vectors
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A torn final line from an interrupted write
+                continue
+            vectors[record["k"]] = record["v"]
+    return vectors
+
+
+def embed_documents(
+    documents,
+    embedder: Embedder,
+    batch_size: int = EMBED_BATCH_SIZE,
+    max_in_flight: int = EMBED_MAX_IN_FLIGHT,
+    max_retries: int = EMBED_MAX_RETRIES,
+    backoff: float = 1.0,
+    checkpoint_path: Optional[str] = None,
+    vectors: Optional[Dict[str, List[float]]] = None,
+) -> Tuple[Dict[str, List[float]], Dict[str, Any]]:
+    """Embed the contents of ``documents`` in concurrent batches.
+
+    Returns a mapping of content key to vector, suitable for PrecomputedEmbedder, and a stats
+    dict. Each finished batch is appended to ``checkpoint_path`` so that a load that fails
+    part way resumes from the last completed batch instead of starting over.
+
+    ``vectors`` from an earlier call for the same document are added to rather than read back
+    from the checkpoint, when a document is embedded a batch of pages at a time.
+    """
+    start = time.perf_counter()
+    if vectors is None:
+        vectors = _read_checkpoint(checkpoint_path)
+
+    pending: Dict[str, str] = {}
+    resumed = 0
+    for document in documents:
+        key = _text_key(document.content)
+        if key in vectors:
+            resumed += 1
+        else:
+            pending[key] = document.content
+    keys = list(pending)
+    batches = [keys[i:i + batch_size] for i in range(0, len(keys), batch_size)]
+
+    stats = {"chunks": len(documents), "resumed": resumed, "embedded": 0, "requests": 0, "retries": 0, "rate_limited": 0}
+    stats_lock = threading.Lock()
+    backpressure = _Backpressure(max_in_flight)
+    checkpoint_file = None
+    if checkpoint_path:
+        os.makedirs(os.path.dirname(checkpoint_path) or ".", exist_ok=True)
+        checkpoint_file = open(checkpoint_path, "a")
+
+    def run_batch(batch_keys: List[str]) -> None:
+        texts = [pending[key] for key in batch_keys]
+        for attempt in range(max_retries + 1):
+            try:
+                with backpressure:
+                    with stats_lock:
+                        stats["requests"] += 1
+                    batch_vectors = _embed_batch(embedder, texts)
+                backpressure.success()
+                break
+            except Exception as e:
+                if attempt == max_retries:
+                    raise
+                delay = min(backoff * 2 ** attempt, 30.0) * (0.5 + random.random() / 2)
+                with stats_lock:
+                    stats["retries"] += 1
+                if is_rate_limit_error(e):
+                    delay = max(delay, getattr(e, "retry_after", 0.0))
+                    with stats_lock:
+                        stats["rate_limited"] += 1
+                    backpressure.rate_limited(delay)
+                    logger.debug("Embedding rate limited, backing off %.2fs", delay)
+                else:
+                    logger.warning("Embedding batch failed (%s), retrying in %.2fs", e, delay)
+                    time.sleep(delay)
+        with stats_lock:
+            for key, vector in zip(batch_keys, batch_vectors):
+                vectors[key] = vector
+            stats["embedded"] += len(batch_keys)
+            if checkpoint_file is not None:
+                checkpoint_file.write("".join(json.dumps({"k": k, "v": vectors[k]}) + "\n" for k in batch_keys))
+                checkpoint_file.flush()
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, max_in_flight)) as executor:
+            futures = [executor.submit(run_batch, batch) for batch in batches]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        if checkpoint_file is not None:
+            checkpoint_file.close()
+
+    stats["seconds"] = time.perf_counter() - start
+    stats["chunks_per_sec"] = stats["embedded"] / stats["seconds"] if stats["seconds"] else 0.0
+    logger.info(
+        "Embedded %d chunks (%d resumed from checkpoint) in %.2fs, %.1f chunks/sec, %d requests, %d retries",
+        stats["embedded"], resumed, stats["seconds"], stats["chunks_per_sec"], stats["requests"], stats["retries"],
+    )
+    return vectors, stats
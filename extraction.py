@@ -0,0 +1,92 @@
+"""Parallel page text extraction with pypdf, streamed back in page order.
+
+Pages are split into batches that worker processes extract concurrently while the caller
+chunks, embeds and stores the batches already returned. This module imports nothing heavy
+at the top, since every worker process imports it.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, Iterator, List, Optional
+import io
+import logging
+import multiprocessing
+import os
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+if TYPE_CHECKING:
+    from agno.document.base import Document
+
+# Pages per batch; the first batch is what a new upload waits for before chat and quiz open up
+PDF_PAGE_BATCH = int(os.getenv("pdf_page_batch", "16"))
+# Extraction processes, 0 for one per CPU core; 1 extracts in the calling process
+PDF_EXTRACT_WORKERS = int(os.getenv("pdf_extract_workers", "0")) or os.cpu_count() or 1
+
+logger = logging.getLogger(__name__)
+
+# The PDF opened once per worker process by _init_worker
+_reader = None
+
+
+def _init_worker(pdf_bytes: bytes) -> None:
+    global _reader
+    from pypdf import PdfReader
+
+    _reader = PdfReader(io.BytesIO(pdf_bytes))
+
+
+def _extract(start: int, stop: int, reader=None) -> List[str]:
+    reader = reader or _reader
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def count_pages(pdf_bytes: bytes) -> int:
+    from pypdf import PdfReader
+
+    return len(PdfReader(io.BytesIO(pdf_bytes)).pages)
+
+
+def iter_page_batches(pdf_bytes: bytes, doc_name: str, batch_pages: Optional[int] = None,
+                      workers: Optional[int] = None) -> Iterator[List["Document"]]:
+    """Yield the PDF's pages in order, ``batch_pages`` at a time, as agno PDFReader documents.
+
+    With more than one worker and more than one batch, batches are extracted by a pool of
+    processes running ahead of the consumer; otherwise pages are extracted in this process.
+    The pool's processes are spawned, so a script calling this needs the usual
+    ``if __name__ == "__main__":`` guard.
+    """
+    from agno.document.base import Document
+    from pypdf import PdfReader
+
+    batch_pages = batch_pages or PDF_PAGE_BATCH
+    workers = workers or PDF_EXTRACT_WORKERS
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    num_pages = len(reader.pages)
+    ranges = [(start, min(start + batch_pages, num_pages)) for start in range(0, num_pages, batch_pages)]
+
+    def documents(start: int, texts: List[str]) -> List[Document]:
+        # The same name, id and page numbering as agno's PDFReader(chunk=False)
+        return [Document(name=doc_name, id=f"{doc_name}_{start + offset + 1}", meta_data={"page": start + offset + 1},
+                         content=text) for offset, text in enumerate(texts)]
+
+    if workers <= 1 or len(ranges) <= 1:
+        for start, stop in ranges:
+            yield documents(start, _extract(start, stop, reader))
+        return
+
+    # The first batch is extracted here, before starting worker processes can slow it down
+    start, stop = ranges[0]
+    yield documents(start, _extract(start, stop, reader))
+    # Spawned rather than forked: the Streamlit and uvicorn processes that call this run many threads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(ranges) - 1), mp_context=context,
+                             initializer=_init_worker, initargs=(pdf_bytes,)) as executor:
+        futures = [executor.submit(_extract, start, stop) for start, stop in ranges[1:]]
+        try:
+            for (start, _), future in zip(ranges[1:], futures):
+                yield documents(start, future.result())
+        finally:
+            # The consumer stopped early or a batch failed; drop the batches not started yet
+            for future in futures:
+                future.cancel()
@@ -0,0 +1,391 @@
+"""Deterministic local stand-ins for the remote services, used by benchmark.py and for offline runs."""
+from agno.embedder.base import Embedder
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import hashlib
+import math
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+if TYPE_CHECKING:
+    from agno.run.response import RunResponse
+
+# Set use_fakes=1 to run the app and the API against these stand-ins instead of the real services
+USE_FAKES = os.getenv("use_fakes", "").lower() in ("1", "true", "yes")
+# Seconds before the first token, per streamed word, and per embedding request when faked
+FAKE_MODEL_LATENCY = float(os.getenv("fake_model_latency", "0.2"))
+FAKE_TOKEN_LATENCY = float(os.getenv("fake_token_latency", "0.01"))
+FAKE_EMBED_LATENCY = float(os.getenv("fake_embed_latency", "0.02"))
+FAKE_TOOL_LATENCY = float(os.getenv("fake_tool_latency", "0.5"))
+# Prompt tokens each tool definition adds to every completion that offers it
+FAKE_TOOL_SCHEMA_TOKENS = 120
+
+
+class FakeRateLimitError(Exception):
+    """Raised by the fakes when their rate limit is exceeded, shaped like a provider 429."""
+
+    code = 429
+    status_code = 429
+
+    def __init__(self, retry_after: float = 0.0):
+        super().__init__(f"429 RESOURCE_EXHAUSTED: rate limit exceeded, retry after {retry_after:.2f}s")
+        self.retry_after = retry_after
+
+
+class FakeServiceError(Exception):
+    """Raised by the fakes for injected non-rate-limit failures."""
+
+    code = 503
+    status_code = 503
+
+
+class _RateLimiter:
+    """Sliding one-second window allowing ``requests_per_second`` calls."""
+
+    def __init__(self, requests_per_second: Optional[float]):
+        self.requests_per_second = requests_per_second
+        self._calls: List[float] = []
+        self._lock = threading.Lock()
+
+    def check(self) -> None:
+        if not self.requests_per_second:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._calls = [t for t in self._calls if now - t < 1.0]
+            if len(self._calls) >= self.requests_per_second:
+                raise FakeRateLimitError(retry_after=1.0 - (now - self._calls[0]))
+            self._calls.append(now)
+
+
+@dataclass
+class FakeEmbedder(Embedder):
+    """Embedder returning stable pseudo-random unit vectors derived from a hash of the text.
+
+    ``latency`` is paid per request (a batch is one request), ``requests_per_second`` is
+    enforced with a 429-style error and ``failure_rate`` injects transient 503s.
+    """
+
+    id: str = "fake-embedder"
+    dimensions: Optional[int] = 64
+    latency: float = 0.0
+    requests_per_second: Optional[float] = None
+    failure_rate: float = 0.0
+    seed: int = 0
+    requests: int = 0
+    _limiter: _RateLimiter = field(default=None, repr=False)
+    _rng: random.Random = field(default=None, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def __post_init__(self):
+        self._limiter = _RateLimiter(self.requests_per_second)
+        self._rng = random.Random(self.seed)
+
+    def _request(self) -> None:
+        self._limiter.check()
+        with self._lock:
+            self.requests += 1
+            fail = self.failure_rate and self._rng.random() < self.failure_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise FakeServiceError("503 UNAVAILABLE: injected failure")
+
+    def vector(self, text: str) -> List[float]:
+        # Bag of hashed words, so texts sharing vocabulary end up close together
+        values = [0.0] * self.dimensions
+        for word in text.lower().split():
+            digest = hashlib.md5(word.encode()).digest()
+            values[digest[0] % self.dimensions] += 1.0 if digest[1] & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in values)) or 1.0
+        return [v / norm for v in values]
+
+    def get_embedding(self, text: str) -> List[float]:
+        self._request()
+        return self.vector(text)
+
+    def get_embedding_and_usage(self, text: str) -> Tuple[List[float], Optional[Dict]]:
+        return self.get_embedding(text), {"characters": len(text)}
+
+    def get_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
+        self._request()
+        return [self.vector(text) for text in texts]
+
+
+class _Faults:
+    """Latency, rate limit and failure injection shared by the fake model and tools."""
+
+    def __init__(self, latency: float = 0.0, requests_per_second: Optional[float] = None,
+                 failure_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self._limiter = _RateLimiter(requests_per_second)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def request(self) -> None:
+        self._limiter.check()
+        with self._lock:
+            self.requests += 1
+            fail = self.failure_rate and self._rng.random() < self.failure_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise FakeServiceError("503 UNAVAILABLE: injected failure")
+
+
+class FakeTool:
+    """Stand-in for one agent tool (web search, YouTube, Todoist) that returns canned text.
+
+    The fake model calls it when the user message contains one of ``keywords``.
+    """
+
+    def __init__(self, name: str, keywords: Sequence[str], faults: Optional[_Faults] = None):
+        self.name = name
+        self.keywords = tuple(keywords)
+        self.faults = faults or _Faults()
+
+    def matches(self, message: str) -> bool:
+        message = message.lower()
+        return any(keyword in message for keyword in self.keywords)
+
+    def __call__(self, query: str) -> str:
+        self.faults.request()
+        digest = hashlib.md5(f"{self.name}:{query}".encode()).hexdigest()[:8]
+        return f"[{self.name}] result {digest} for '{query}': https://example.com/{digest}"
+
+
+def _sentences(text: str) -> List[str]:
+    return [s.strip() for s in re.split(r"(?<=[.!?])\s+|\n+", text) if len(s.split()) >= 5]
+
+
+def _fake_question(text: str, rng: random.Random, used: set) -> Optional[Dict[str, Any]]:
+    """A fill-in-the-blank question from one sentence of ``text``, distractors taken from the rest."""
+    vocabulary = sorted({w for w in re.findall(r"[A-Za-z]{5,}", text)}, key=str.lower)
+    sentences = _sentences(text)
+    for sentence in rng.sample(sentences, len(sentences)):
+        if sentence in used:
+            continue
+        words = re.findall(r"[A-Za-z]{5,}", sentence)
+        if not words:
+            continue
+        answer = max(words, key=len)
+        distractors = [w for w in vocabulary if w.lower() != answer.lower()]
+        rng.shuffle(distractors)
+        options = [answer]
+        for word in distractors + ["none of these", "all of these", "not stated"]:
+            if word.lower() not in {o.lower() for o in options}:
+                options.append(word)
+            if len(options) == 4:
+                break
+        rng.shuffle(options)
+        used.add(sentence)
+        blanked = re.sub(rf"\b{re.escape(answer)}\b", "_____", sentence, count=1)
+        return {"question": f"Which word completes: \"{blanked}\"?", "options": options,
+                "correct": options.index(answer)}
+    return None
+
+
+class FakeAgent:
+    """Stand-in for agno's Agent that answers from its knowledge base without calling a model.
+
+    Runs return agno RunResponse objects, streamed as RunEvent deltas when ``stream=True``, so
+    stream_chat and the quiz helpers work unchanged. ``faults`` (latency before the first token,
+    rate limit, failures) applies per completion and ``token_latency`` per streamed word. Like
+    agno with ``add_references``, retrieved chunks are added to the prompt up front; with
+    ``search_knowledge`` (or a matching tool) the first completion only calls tools, including a
+    knowledge search, and the answer comes from a second completion. With a
+    ``response_model`` (quiz_ques or Quiz) the content is a fill-in-the-blank quiz built from the
+    prompt or the retrieved chunks. Tool calls go through ``tool_cache`` (a tool_cache.ToolCache)
+    when one is given, like the real agent's cached toolkits.
+    """
+
+    def __init__(self, knowledge=None, response_model=None, tools: Optional[List[FakeTool]] = None,
+                 faults: Optional[_Faults] = None, token_latency: float = 0.0, seed: int = 0,
+                 num_documents: int = 3, search_knowledge: bool = False, tool_cache=None):
+        self.knowledge = knowledge
+        self.response_model = response_model
+        self.tools = tools or []
+        self.faults = faults or _Faults()
+        self.token_latency = token_latency
+        self.num_documents = num_documents
+        self.search_knowledge = search_knowledge
+        self.tool_cache = tool_cache
+        self.seed = seed
+        self.additional_context: Optional[str] = None
+        self.run_response = None
+
+    def _references(self, query: str) -> List[str]:
+        if self.knowledge is None:
+            return []
+        return [doc.content for doc in self.knowledge.search(query=query, num_documents=self.num_documents)]
+
+    def _structured(self, message: str):
+        rng = random.Random(f"{self.seed}:{message}")
+        fields = getattr(self.response_model, "model_fields", {})
+        if "quiz" in fields:
+            count = re.search(r"generate (\d+)", message)
+            topic = re.search(r"questions about (.+?)\.?\n", message)
+            text = "\n".join(self._references(topic.group(1) if topic else message))
+            used: set = set()
+            questions = [_fake_question(text, rng, used) for _ in range(int(count.group(1)) if count else 5)]
+            return self.response_model(quiz=[q for q in questions if q is not None])
+        # Only the study material part of quiz_agent's single-question prompt
+        text = message.split("study material:", 1)[-1].split("It must be clearly different", 1)[0]
+        question = _fake_question(text, rng, set())
+        return self.response_model(**question) if question is not None else None
+
+    def _answer(self, message: str, references: List[str], tool_results: List[Dict[str, Any]]) -> str:
+        lines = [f"Here is what your notes say about \"{message.strip()}\":", ""]
+        for reference in references:
+            sentences = _sentences(reference) or [reference.strip()]
+            lines.append(f"- {' '.join(sentences[:2])[:300]}")
+        for tool in tool_results:
+            lines.append(f"- {tool['content']}")
+        return "\n".join(lines)
+
+    def _chat(self, message: str):
+        """Yields ("tool_started" | "tool_completed", tool) steps and returns (content, tools, metrics)."""
+        from agno.models.message import MessageMetrics
+
+        prompt = message + (self.additional_context or "")
+        offered = len(self.tools) + (1 if self.search_knowledge else 0)
+        references = self._references(message)
+        calls = [(tool.name, tool if self.tool_cache is None else self.tool_cache.wrap(tool.name, tool))
+                 for tool in self.tools if tool.matches(message)]
+        if self.search_knowledge:
+            def search_knowledge_base(query: str) -> str:
+                return "\n".join(self._references(query))
+
+            calls.insert(0, ("search_knowledge_base", search_knowledge_base))
+
+        # First completion: the answer itself, or the decision which tools to call
+        self.faults.request()
+        input_tokens = [_tokens(prompt + "".join(references)) + offered * FAKE_TOOL_SCHEMA_TOKENS]
+        tools: List[Dict[str, Any]] = []
+        for name, tool in calls:
+            call = {"tool_call_id": uuid.uuid4().hex[:12], "tool_name": name, "tool_args": {"query": message}}
+            yield "tool_started", call
+            started = time.perf_counter()
+            try:
+                content = tool(message)
+            except Exception as e:
+                # Like agno, a failing tool is reported back to the model rather than raised
+                content = f"Error running {name}: {e}"
+            tools.append(dict(call, content=content, metrics=MessageMetrics(time=time.perf_counter() - started)))
+            yield "tool_completed", tools[-1]
+        if tools:
+            # Second completion, now with the tool results in the prompt
+            self.faults.request()
+            input_tokens.append(_tokens(prompt + "".join(t["content"] for t in tools)) + offered * FAKE_TOOL_SCHEMA_TOKENS)
+
+        content = self._answer(message, references, [t for t in tools if t["tool_name"] != "search_knowledge_base"])
+        return content, tools, {"input_tokens": input_tokens, "output_tokens": [_tokens(content)]}
+
+    def run(self, message: str, stream: bool = False, stream_intermediate_steps: bool = False, **kwargs):
+        # agno's run types pull in the model clients, which the app only needs once it answers something
+        from agno.run.response import RunResponse
+
+        if stream:
+            return self._stream(message, stream_intermediate_steps)
+        if self.response_model is not None:
+            self.faults.request()
+            content = self._structured(message)
+            self.run_response = RunResponse(content=content, content_type=self.response_model.__name__,
+                                            metrics={"input_tokens": [_tokens(message)],
+                                                     "output_tokens": [_tokens(str(content))]})
+            return self.run_response
+        steps = self._chat(message)
+        while True:
+            try:
+                next(steps)
+            except StopIteration as done:
+                content, tools, metrics = done.value
+                break
+        self.run_response = RunResponse(content=content, tools=tools or None, metrics=metrics)
+        return self.run_response
+
+    def _stream(self, message: str, intermediate_steps: bool) -> Iterator["RunResponse"]:
+        from agno.run.response import RunEvent, RunResponse
+
+        if intermediate_steps:
+            yield RunResponse(event=RunEvent.run_started.value)
+        steps = self._chat(message)
+        running: List[Dict[str, Any]] = []
+        while True:
+            try:
+                kind, tool = next(steps)
+            except StopIteration as done:
+                content, tools, metrics = done.value
+                break
+            if intermediate_steps and kind == "tool_started":
+                yield RunResponse(event=RunEvent.tool_call_started.value, tools=running + [tool])
+            elif kind == "tool_completed":
+                running.append(tool)
+                if intermediate_steps:
+                    yield RunResponse(event=RunEvent.tool_call_completed.value, tools=list(running))
+        for word in re.findall(r"\S+\s*", content):
+            if self.token_latency:
+                time.sleep(self.token_latency)
+            yield RunResponse(event=RunEvent.run_response.value, content=word)
+        self.run_response = RunResponse(event=RunEvent.run_completed.value, content=content, tools=tools or None,
+                                        metrics=metrics)
+        yield self.run_response
+
+
+def _tokens(text: str) -> int:
+    # Roughly four characters per token, like the providers' own estimates
+    return len(text) // 4
+
+
+class FakeServices:
+    """Process-wide fake backends shared by every agent, so rate limits and failure rates apply
+    across all users at once like a real provider's.
+
+    Each service is configured with a dict of ``latency``, ``requests_per_second`` and
+    ``failure_rate``; the model also takes ``token_latency``.
+    """
+
+    def __init__(self):
+        self.configure()
+
+    def configure(self, model: Optional[Dict] = None, embedder: Optional[Dict] = None, tavily: Optional[Dict] = None,
+                  youtube: Optional[Dict] = None, todoist: Optional[Dict] = None, seed: int = 0) -> None:
+        model = dict({"latency": FAKE_MODEL_LATENCY, "token_latency": FAKE_TOKEN_LATENCY}, **(model or {}))
+        self.token_latency = model.pop("token_latency")
+        self.seed = seed
+        self.model = _Faults(seed=seed, **model)
+        self.embedder = FakeEmbedder(seed=seed, **dict({"latency": FAKE_EMBED_LATENCY}, **(embedder or {})))
+        # Names match the functions exposed by TavilyTools, YouTubeTools and the todoist team member
+        self.tools = [
+            FakeTool("web_search_using_tavily", ("search", "resources", "latest", "articles", "applications"),
+                     _Faults(seed=seed, **dict({"latency": FAKE_TOOL_LATENCY}, **(tavily or {})))),
+            FakeTool("get_youtube_video_captions", ("youtube", "video", "tutorial"),
+                     _Faults(seed=seed, **dict({"latency": FAKE_TOOL_LATENCY}, **(youtube or {})))),
+            FakeTool("transfer_task_to_todoist_agent", ("study plan", "todo", "task", "schedule"),
+                     _Faults(seed=seed, **dict({"latency": FAKE_TOOL_LATENCY}, **(todoist or {})))),
+        ]
+
+    def agent(self, knowledge=None, response_model=None, tools: bool = False,
+              search_knowledge: bool = False, num_documents: int = 3, tool_cache=None) -> FakeAgent:
+        return FakeAgent(knowledge=knowledge, response_model=response_model, tools=self.tools if tools else None,
+                         faults=self.model, token_latency=self.token_latency, seed=self.seed,
+                         search_knowledge=search_knowledge, num_documents=num_documents, tool_cache=tool_cache)
+
+    @property
+    def requests(self) -> Dict[str, int]:
+        counts = {"model": self.model.requests, "embedder": self.embedder.requests}
+        counts.update({tool.name: tool.faults.requests for tool in self.tools})
+        return counts
+
+
+fake_services = FakeServices()
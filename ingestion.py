@@ -0,0 +1,519 @@
+from chunking import chunk_pages, get_chunking_strategy
+from embedding import PrecomputedEmbedder, embed_documents
+from fakes import USE_FAKES, fake_services
+from ingestion_cache import IngestionCache, KeyLock
+from tracing import activate, propagate, record_span, start_span
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+import logging
+import os
+import queue
+import threading
+import time
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+if TYPE_CHECKING:
+    from agno.knowledge.agent import AgentKnowledge
+
+# Get API keys from environment variables
+GOOGLE_API_KEY = os.getenv("google_api_key")
+
+LANCEDB_URI = './tmp/lancedb'
+# Partially embedded documents, so a failed load resumes where it stopped
+EMBED_CHECKPOINT_DIR = './tmp/embed_checkpoints'
+
+# Ingested PDFs are cached by content hash; least recently used tables are dropped past this size
+INGEST_CACHE_MAX_MB = int(os.getenv("ingest_cache_max_mb", "2048"))
+
+ingestion_cache = IngestionCache(LANCEDB_URI, max_bytes=INGEST_CACHE_MAX_MB * 1024 * 1024)
+
+# Documents whose BM25 index stays loaded in this process between searches
+LEXICAL_CACHE_MAX_DOCS = int(os.getenv("lexical_cache_max_docs", "256"))
+
+# doc_id -> ((mtime_ns, size) of the index file when loaded, BM25Index), least recently used first
+_lexical_indexes: "OrderedDict[str, Tuple[Tuple[int, int], Any]]" = OrderedDict()
+_lexical_indexes_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionProgress:
+    """Pages and chunks indexed so far by a streaming ingestion.
+
+    Shared by every session holding the document, so each can show progress and wait for the
+    first batch or for the whole document.
+    """
+
+    def __init__(self, total_pages: int = 0):
+        self.total_pages = total_pages
+        self.pages = 0
+        self.chunks = 0
+        # Set when ingestion stopped part way; the pages indexed before it stay searchable
+        self.error: Optional[BaseException] = None
+        self._lock = threading.Lock()
+        self._first_batch = threading.Event()
+        self._done = threading.Event()
+        self._callbacks: List[Callable[["IngestionProgress"], None]] = []
+
+    @classmethod
+    def finished(cls, pages: int, chunks: int) -> "IngestionProgress":
+        progress = cls(pages)
+        progress.advance(pages, chunks)
+        progress.finish()
+        return progress
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    @property
+    def fraction(self) -> float:
+        return self.pages / self.total_pages if self.total_pages else float(self.done)
+
+    def wait_first_batch(self, timeout: Optional[float] = None) -> bool:
+        return self._first_batch.wait(timeout)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def on_done(self, callback: Callable[["IngestionProgress"], None]) -> None:
+        """Call ``callback(progress)`` once ingestion has stopped, right away if it already has."""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def advance(self, pages: int, chunks: int) -> None:
+        with self._lock:
+            self.pages += pages
+            self.chunks += chunks
+        self._first_batch.set()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            self.error = error
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        self._first_batch.set()
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                logger.exception("Ingestion progress callback failed")
+
+
+@dataclass
+class IngestedDocument:
+    """Handle to a parsed, chunked and embedded PDF, shared by the quiz and chat agents."""
+    knowledge: "AgentKnowledge"
+    table_name: str
+    # Content hash of the PDF bytes and ingestion config
+    doc_id: str
+    name: Optional[str] = None
+    num_pages: int = 0
+    num_chunks: int = 0
+    # Section headings found while chunking, in document order
+    sections: List[str] = field(default_factory=list)
+    # True when the vector table was attached from the ingestion cache
+    cached: bool = False
+    # Seconds spent in each stage: parse, chunk, embed, store (or attach on a cache hit), total
+    timings: Dict[str, float] = field(default_factory=dict)
+    # Embedding throughput, request and retry counts from embed_documents
+    embed_stats: Dict[str, Any] = field(default_factory=dict)
+    # Pages and chunks indexed so far; a fresh upload is searchable before it is done
+    progress: IngestionProgress = field(default_factory=lambda: IngestionProgress.finished(0, 0))
+
+
+def ingestion_config(chunking_strategy, embedder) -> Dict[str, Any]:
+    # Everything that changes the stored vectors must be part of the cache key
+    return {
+        'chunking': type(chunking_strategy).__name__,
+        'chunking_params': {
+            k: v for k, v in vars(chunking_strategy).items() if isinstance(v, (bool, int, float, str))
+        },
+        'embedder': getattr(embedder, 'id', type(embedder).__name__),
+        'dimensions': embedder.dimensions,
+    }
+
+
+def default_embedder():
+    if USE_FAKES:
+        return fake_services.embedder
+    # google.genai alone takes most of a second to import, so only pay for it when embedding
+    from agno.embedder.google import GeminiEmbedder
+
+    return GeminiEmbedder(api_key=GOOGLE_API_KEY)
+
+
+def document_id(pdf_bytes: bytes, chunking_mode: Optional[str] = None, embedder=None) -> str:
+    """The identity ingest_pdf gives these bytes under the current chunking and embedder config."""
+    embedder = embedder or default_embedder()
+    return IngestionCache.key_for(pdf_bytes, ingestion_config(get_chunking_strategy(chunking_mode), embedder))
+
+
+def _index_version(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _lexical_index(doc_id: str, vector_db, library: bool):
+    from lexical import BM25Index, index_path
+
+    path = index_path(LANCEDB_URI, IngestionCache.table_name_for(doc_id))
+    # A re-ingested document gets a new file and an evicted one loses it, in this process or another
+    version = _index_version(path)
+    with _lexical_indexes_lock:
+        cached = _lexical_indexes.get(doc_id)
+        if cached is not None and version is not None and cached[0] == version:
+            _lexical_indexes.move_to_end(doc_id)
+            return cached[1]
+        _lexical_indexes.pop(doc_id, None)
+
+    lexical = BM25Index.load(path) if version is not None else None
+    if lexical is None:
+        # Documents ingested before the lexical index existed get one built from their stored chunks
+        payloads = (vector_db.payloads({'doc_id': doc_id}) if library
+                    else vector_db.table.to_arrow().column('payload').to_pylist())
+        lexical = BM25Index.from_payloads(payloads)
+        lexical.save(path)
+        version = _index_version(path)
+    with _lexical_indexes_lock:
+        _lexical_indexes[doc_id] = (version, lexical)
+        while len(_lexical_indexes) > LEXICAL_CACHE_MAX_DOCS:
+            _lexical_indexes.popitem(last=False)
+    return lexical
+
+
+def _forget_lexical_index(doc_id: str) -> None:
+    with _lexical_indexes_lock:
+        _lexical_indexes.pop(doc_id, None)
+
+
+def _attach(table_name: str, embedder, doc_ids: List[str], library: bool = True, lexical=None) -> "AgentKnowledge":
+    """Knowledge over the shared library table scoped to ``doc_ids``, or over a legacy per-document table."""
+    from knowledge import TracedKnowledge
+    from lexical import LibraryIndex
+
+    if library:
+        from library import LibraryDb
+
+        vector_db = LibraryDb(uri=LANCEDB_URI, table_name=table_name, embedder=embedder)
+    else:
+        from agno.vectordb.lancedb import LanceDb
+
+        vector_db = LanceDb(uri=LANCEDB_URI, table_name=table_name, embedder=embedder)
+    if lexical is None:
+        indexes = [_lexical_index(doc_id, vector_db, library) for doc_id in doc_ids]
+        lexical = indexes[0] if len(indexes) == 1 else LibraryIndex(indexes)
+    return TracedKnowledge(vector_db=vector_db, lexical=lexical, doc_ids=list(doc_ids) if library else None)
+
+
+def attach_document(doc_id: str, cache: Optional[IngestionCache] = None, embedder=None) -> Optional[IngestedDocument]:
+    """Open an already ingested document by id, e.g. one ingested by another worker process.
+
+    Returns None when the ingestion cache has no table for ``doc_id``.
+    """
+    cache = cache or ingestion_cache
+    start = time.perf_counter()
+    entry = cache.get(doc_id)
+    if entry is None:
+        return None
+    knowledge = _attach(entry['table_name'], embedder or default_embedder(), [doc_id], library=entry.get('library', False))
+    attach_time = time.perf_counter() - start
+    return IngestedDocument(
+        knowledge=knowledge,
+        table_name=entry['table_name'],
+        doc_id=doc_id,
+        name=entry.get('name'),
+        num_pages=entry['num_pages'],
+        num_chunks=entry['num_chunks'],
+        sections=entry.get('sections', []),
+        cached=True,
+        timings={'attach': attach_time, 'total': attach_time},
+        progress=IngestionProgress.finished(entry['num_pages'], entry['num_chunks']),
+    )
+
+
+def library_knowledge(doc_ids: Optional[List[str]] = None, cache: Optional[IngestionCache] = None,
+                      embedder=None) -> "AgentKnowledge":
+    """Knowledge over several ingested documents at once: ``doc_ids``, or the whole library when None.
+
+    Raises KeyError for a document that is not in the ingestion cache or predates the shared library.
+    """
+    from library import library_table_name
+
+    cache = cache or ingestion_cache
+    embedder = embedder or default_embedder()
+    table_name = library_table_name(embedder)
+    entries = cache.entries()
+    selected = [doc_id for doc_id, entry in entries.items() if entry.get('library') and entry['table_name'] == table_name]
+    if doc_ids is not None:
+        for doc_id in doc_ids:
+            if doc_id not in selected:
+                raise KeyError(doc_id)
+        selected = list(doc_ids)
+    knowledge = _attach(table_name, embedder, selected)
+    if doc_ids is None:
+        # Everything in the table, without a long IN (...) filter on every search
+        knowledge.doc_ids = None
+    return knowledge
+
+
+def ingest_pdf(pdf_file, name=None, cache: Optional[IngestionCache] = None, chunking_mode: Optional[str] = None,
+               embedder=None, wait: bool = False) -> IngestedDocument:
+    """Parse, chunk and embed a PDF exactly once and return a knowledge base handle.
+
+    Identical PDFs (same bytes and ingestion config) share one vector table across
+    sessions, so repeat uploads attach the existing table instead of re-embedding.
+    ``chunking_mode`` overrides the deployment's ``chunking_mode`` setting.
+
+    Pages are extracted in parallel and indexed a batch at a time on a background thread. The
+    handle is returned as soon as the first batch is searchable and ``document.progress``
+    tracks the rest; with ``wait`` it is returned once every page is indexed.
+    """
+    ingest_span = start_span("ingest", document=name)
+    try:
+        with activate(ingest_span):
+            document = _ingest_pdf(pdf_file, name, cache, chunking_mode, embedder, ingest_span)
+    except BaseException as e:
+        ingest_span.set(error=type(e).__name__)
+        ingest_span.end()
+        raise
+    if document.cached:
+        _end_ingest_span(ingest_span, document)
+    progress = document.progress
+    if wait:
+        progress.wait()
+    if progress.error is not None and (wait or progress.pages == 0):
+        raise progress.error
+    return document
+
+
+def _end_ingest_span(ingest_span, document: IngestedDocument) -> None:
+    ingest_span.set(doc_id=document.doc_id[:12], cached=document.cached)
+    if not document.cached:
+        ingest_span.set(pages=document.progress.pages, chunks=document.num_chunks)
+        if 'first_batch' in document.timings:
+            ingest_span.set(first_batch=round(document.timings['first_batch'], 6))
+    stats = document.embed_stats
+    for stage in ('attach', 'parse', 'chunk', 'embed', 'store'):
+        if stage not in document.timings:
+            continue
+        attrs = {k: stats.get(k, 0) for k in ('requests', 'retries', 'rate_limited')} if stage == 'embed' else {}
+        record_span(stage, document.timings[stage], parent=ingest_span, **attrs)
+    ingest_span.end()
+
+
+def _ingest_pdf(pdf_file, name, cache, chunking_mode, embedder, ingest_span) -> IngestedDocument:
+    cache = cache or ingestion_cache
+    start = time.perf_counter()
+
+    chunking_strategy = get_chunking_strategy(chunking_mode)
+    embedder = embedder or default_embedder()
+    pdf_bytes = pdf_file.getvalue()
+    doc_id = cache.key_for(pdf_bytes, ingestion_config(chunking_strategy, embedder))
+    from library import library_table_name
+
+    table_name = library_table_name(embedder)
+
+    # Held until every page is stored and the cache entry written, by the indexing thread once it has
+    # started; another worker process ingesting the same PDF waits here and then attaches it
+    lock = cache.lock_for(doc_id)
+    lock.acquire()
+    started = False
+    try:
+        document = attach_document(doc_id, cache=cache, embedder=embedder)
+        if document is not None:
+            document.name = name or document.name
+            logger.info("Ingestion cache hit for %s (%s) in %.3fs", name, table_name, document.timings['total'])
+            return document
+
+        from extraction import count_pages
+        from lexical import BM25Index
+
+        # Chunks are inserted with the vectors computed for them batch by batch; queries fall through to the embedder
+        knowledge = _attach(table_name, PrecomputedEmbedder(embedder=embedder), [doc_id], lexical=BM25Index.build([]))
+        knowledge.indexing = True
+        # Rows left behind by an interrupted ingestion of the same document
+        knowledge.vector_db.remove(doc_id)
+        _forget_lexical_index(doc_id)
+        num_pages = count_pages(pdf_bytes)
+        document = IngestedDocument(
+            knowledge=knowledge,
+            table_name=table_name,
+            doc_id=doc_id,
+            name=name,
+            num_pages=num_pages,
+            timings={'parse': 0.0, 'chunk': 0.0, 'embed': 0.0, 'store': 0.0},
+            progress=IngestionProgress(num_pages),
+        )
+        # PDFReader's document name, which chunk ids are derived from
+        doc_name = (getattr(pdf_file, 'name', None) or 'pdf').split('.')[0]
+        threading.Thread(
+            target=_index_pages,
+            args=(document, pdf_bytes, doc_name, chunking_strategy, embedder, cache, lock, ingest_span, start),
+            name=f"ingest-{doc_id[:8]}",
+            daemon=True,
+        ).start()
+        started = True
+    finally:
+        if not started:
+            lock.release()
+
+    document.progress.wait_first_batch()
+    return document
+
+
+def _read_ahead(batches, max_ahead: int = 8):
+    """Run the ``batches`` iterator on its own thread, yielding everything it produced since the last step as one list.
+
+    The first batch always comes alone, so it is searchable as soon as possible. After that the
+    consumer gets a single batch while it keeps up and several at once when it falls behind,
+    which it can then embed and store together.
+    """
+    ready: "queue.Queue" = queue.Queue(maxsize=max_ahead)
+    stop = threading.Event()
+    end = object()
+
+    def produce():
+        try:
+            for batch in batches:
+                while not stop.is_set():
+                    try:
+                        ready.put(batch, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    batches.close()
+                    return
+            ready.put(end)
+        except BaseException as e:
+            ready.put(e)
+
+    threading.Thread(target=propagate(produce), name="ingest-read-ahead", daemon=True).start()
+    first = True
+    try:
+        while True:
+            items = [ready.get()]
+            while not first:
+                try:
+                    items.append(ready.get_nowait())
+                except queue.Empty:
+                    break
+            first = False
+            finished = items[-1] is end or isinstance(items[-1], BaseException)
+            produced = items[:-1] if finished else items
+            if produced:
+                yield produced
+            if finished:
+                if items[-1] is not end:
+                    raise items[-1]
+                return
+    finally:
+        stop.set()
+
+
+def _index_pages(document: IngestedDocument, pdf_bytes: bytes, doc_name: str, chunking_strategy, embedder,
+                 cache: IngestionCache, lock: KeyLock, ingest_span, start: float) -> None:
+    """Extract, chunk, embed and store the PDF a batch of pages at a time, then record it in the cache."""
+    from extraction import iter_page_batches
+    from lexical import index_path
+
+    doc_id = document.doc_id
+    knowledge = document.knowledge
+    progress = document.progress
+    timings = document.timings
+    embed_stats = document.embed_stats
+    checkpoint_path = os.path.join(EMBED_CHECKPOINT_DIR, f"{doc_id}.jsonl")
+    vectors = None
+    section = None
+    error = None
+    try:
+        with activate(ingest_span):
+            stage_start = time.perf_counter()
+            # Later pages are extracted while these are embedded and stored; batches that queue up meanwhile are
+            # handled together, so their chunks are embedded with the full request concurrency
+            for batches in _read_ahead(iter_page_batches(pdf_bytes, doc_name)):
+                pages = [page for batch in batches for page in batch]
+                timings['parse'] += time.perf_counter() - stage_start
+
+                # Chunk the batch with the configured strategy, carrying the section heading over from the last one
+                stage_start = time.perf_counter()
+                chunks = chunk_pages(pages, chunking_strategy, section=section)
+                for chunk in chunks:
+                    chunk.meta_data['doc_id'] = doc_id
+                    if chunk.meta_data.get('section') and chunk.meta_data['section'] not in document.sections:
+                        document.sections.append(chunk.meta_data['section'])
+                if chunks:
+                    section = chunks[-1].meta_data.get('section', section)
+                timings['chunk'] += time.perf_counter() - stage_start
+
+                # Embed the chunks in concurrent batches, checkpointing as we go
+                stage_start = time.perf_counter()
+                vectors, stats = embed_documents(chunks, embedder, checkpoint_path=checkpoint_path, vectors=vectors)
+                knowledge.vector_db.embedder.vectors = vectors
+                for key in ('chunks', 'resumed', 'embedded', 'requests', 'retries', 'rate_limited', 'seconds'):
+                    embed_stats[key] = embed_stats.get(key, 0) + stats[key]
+                embed_stats['chunks_per_sec'] = embed_stats['embedded'] / embed_stats['seconds'] if embed_stats['seconds'] else 0.0
+                timings['embed'] += time.perf_counter() - stage_start
+
+                # Store the chunks in the shared library table and the document's BM25 index, where searches see them
+                stage_start = time.perf_counter()
+                knowledge.load_documents(chunks, skip_existing=False)
+                knowledge.lexical.add(chunks)
+                document.num_chunks += len(chunks)
+                timings['store'] += time.perf_counter() - stage_start
+
+                if 'first_batch' not in timings:
+                    timings['first_batch'] = time.perf_counter() - start
+                progress.advance(len(pages), len(chunks))
+                stage_start = time.perf_counter()
+
+            knowledge.lexical.save(index_path(LANCEDB_URI, cache.table_name_for(doc_id)))
+            # Queries go straight to the real embedder from here on
+            knowledge.vector_db.embedder = embedder
+            knowledge.vector_db.start_indexing()
+            knowledge.indexing = False
+            timings['total'] = time.perf_counter() - start
+
+            cache.put(doc_id, {
+                'table_name': document.table_name,
+                'library': True,
+                # This document's share of the library table: vectors plus chunk payloads
+                'size_bytes': sum(4 * embedder.dimensions + len(entry['content'].encode())
+                                  for entry in knowledge.lexical.documents),
+                'name': document.name,
+                'num_pages': document.num_pages,
+                'num_chunks': document.num_chunks,
+                'sections': document.sections,
+            })
+            try:
+                os.remove(checkpoint_path)
+            except FileNotFoundError:
+                pass
+
+        logger.info(
+            "Ingested %s into %s: %d pages, %d chunks, first batch searchable after %.2fs (parse %.2fs, "
+            "chunk %.2fs, embed %.2fs at %.1f chunks/sec, store %.2fs, total %.2fs)",
+            document.name, document.table_name, document.num_pages, document.num_chunks,
+            timings.get('first_batch', 0.0), timings['parse'], timings['chunk'], timings['embed'],
+            embed_stats.get('chunks_per_sec', 0.0), timings['store'], timings['total'],
+        )
+    except BaseException as e:
+        error = e
+        ingest_span.set(error=type(e).__name__)
+        logger.exception("Ingestion of %s stopped after %d of %d pages", document.name, progress.pages,
+                         progress.total_pages)
+    finally:
+        lock.release()
+        _end_ingest_span(ingest_span, document)
+        progress.finish(error)
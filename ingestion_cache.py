@@ -0,0 +1,247 @@
+from contextlib import contextmanager
+from datetime import timedelta
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class KeyLock:
+    """Lock on one cache key against other threads of this process and other worker processes.
+
+    Pairs a threading.Lock with an fcntl lock on a file, both of which may be released by a
+    different thread than the one that acquired them.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def acquire(self) -> bool:
+        self._lock.acquire()
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._file = open(self.path, 'a')
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        except BaseException:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._lock.release()
+            raise
+        return True
+
+    def release(self) -> None:
+        lock_file, self._file = self._file, None
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+        finally:
+            self._lock.release()
+
+    def __enter__(self) -> "KeyLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+
+class IngestionCache:
+    """Persistent manifest of ingested PDFs keyed by a hash of the PDF bytes and the ingestion config.
+
+    Each entry points at the LanceDB table that already holds the embedded chunks (the shared
+    library table, or a per-document table from before it), so a hit skips parsing, chunking
+    and embedding entirely. Entries are evicted least recently used
+    first once the tables on disk exceed ``max_bytes``.
+
+    Worker processes share the manifest: every change re-reads it and writes it back under a
+    lock file, so entries one worker evicted are not brought back by another.
+    """
+
+    def __init__(self, uri: str, manifest_path: Optional[str] = None, max_bytes: int = 2 * 1024 ** 3):
+        self.uri = uri
+        self.manifest_path = manifest_path or os.path.join(os.path.dirname(uri.rstrip('/')), 'ingest_cache.json')
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, KeyLock] = {}
+        # Optional check for keys whose tables are open somewhere and must not be dropped
+        self.in_use: Optional[Callable[[str], bool]] = None
+        # (mtime_ns, size) of the manifest when this process last read or wrote it
+        self._version = None
+        self._reload()
+
+    @staticmethod
+    def key_for(pdf_bytes: bytes, config: Dict[str, Any]) -> str:
+        digest = hashlib.sha256(pdf_bytes)
+        digest.update(json.dumps(config, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def table_name_for(key: str) -> str:
+        return f"pdf_{key[:16]}"
+
+    def lock_for(self, key: str) -> KeyLock:
+        # Serialise concurrent ingestion of the same PDF across threads and worker processes
+        lock_path = os.path.join(os.path.dirname(self.manifest_path), 'ingest_locks', f"{key}.lock")
+        with self._lock:
+            if key not in self._key_locks:
+                self._key_locks[key] = KeyLock(lock_path)
+            return self._key_locks[key]
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._locked():
+            entry = self._manifest['entries'].get(key)
+            if entry is not None and not self._exists(key, entry):
+                # Its rows were removed behind our back, forget the entry
+                del self._manifest['entries'][key]
+                entry = None
+            if entry is None:
+                self._manifest['stats']['misses'] += 1
+            else:
+                self._manifest['stats']['hits'] += 1
+                entry['last_used'] = time.time()
+            return dict(entry) if entry is not None else None
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        now = time.time()
+        entry = dict(entry, created=now, last_used=now)
+        if 'size_bytes' not in entry:
+            entry['size_bytes'] = _dir_size(os.path.join(self.uri, f"{entry['table_name']}.lance"))
+        lexical_path = os.path.join(self.uri, f"{self.table_name_for(key)}.bm25.json")
+        if os.path.exists(lexical_path):
+            entry['size_bytes'] += os.path.getsize(lexical_path)
+        with self._locked():
+            self._manifest['entries'][key] = entry
+            self._evict(keep=key)
+
+    def entries(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            self._reload()
+            return {key: dict(entry) for key, entry in self._manifest['entries'].items()}
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._reload()
+            stats = dict(self._manifest['stats'])
+            stats['entries'] = len(self._manifest['entries'])
+            stats['size_bytes'] = sum(e.get('size_bytes', 0) for e in self._manifest['entries'].values())
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def _exists(self, key: str, entry: Dict[str, Any]) -> bool:
+        import lancedb
+
+        db = lancedb.connect(self.uri)
+        if entry['table_name'] not in db.table_names():
+            return False
+        if not entry.get('library'):
+            return True
+        # The shared library table always exists; the document needs its own rows and BM25 index in it
+        if not os.path.exists(os.path.join(self.uri, f"{self.table_name_for(key)}.bm25.json")):
+            return False
+        return db.open_table(entry['table_name']).count_rows(f"doc_id = '{key}'") > 0
+
+    def _evict(self, keep: str) -> None:
+        import lancedb
+
+        entries = self._manifest['entries']
+        total = sum(e.get('size_bytes', 0) for e in entries.values())
+        compact = set()
+        for key in sorted(entries, key=lambda k: entries[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if key == keep or (self.in_use is not None and self.in_use(key)):
+                continue
+            entry = entries.pop(key)
+            total -= entry.get('size_bytes', 0)
+            self._manifest['stats']['evictions'] += 1
+            try:
+                if entry.get('library'):
+                    # Documents in the shared library table only lose their own rows
+                    lancedb.connect(self.uri).open_table(entry['table_name']).delete(f"doc_id = '{key}'")
+                    compact.add(entry['table_name'])
+                else:
+                    lancedb.connect(self.uri).drop_table(entry['table_name'])
+            except Exception as e:
+                logger.warning("Could not remove evicted %s from %s: %s", key[:12], entry['table_name'], e)
+            # The document's BM25 index, see lexical.index_path
+            try:
+                os.remove(os.path.join(self.uri, f"{self.table_name_for(key)}.bm25.json"))
+            except OSError:
+                pass
+            logger.info("Evicted %s (%s) from the ingestion cache", key[:12], entry.get('name'))
+        for table_name in compact:
+            # A delete only marks rows as deleted; rewrite the fragments and drop the old versions so the disk space is freed
+            try:
+                lancedb.connect(self.uri).open_table(table_name).optimize(cleanup_older_than=timedelta(0))
+            except Exception as e:
+                logger.warning("Could not compact %s after eviction: %s", table_name, e)
+
+    @contextmanager
+    def _locked(self):
+        # Read-modify-write of the manifest, serialised across threads and worker processes
+        with self._lock:
+            os.makedirs(os.path.dirname(self.manifest_path) or '.', exist_ok=True)
+            with open(f"{self.manifest_path}.lock", 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self._version = None
+                    self._reload()
+                    yield
+                    self._write()
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _manifest_version(self):
+        try:
+            stat = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _reload(self) -> None:
+        # Pick up changes other worker processes wrote since this one last read the manifest
+        version = self._manifest_version()
+        if version is None or version != self._version:
+            self._manifest = self._read()
+            self._version = version
+
+    def _read(self) -> Dict[str, Any]:
+        manifest = {'entries': {}, 'stats': {'hits': 0, 'misses': 0, 'evictions': 0}}
+        try:
+            with open(self.manifest_path) as f:
+                manifest.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable ingestion cache manifest %s: %s", self.manifest_path, e)
+        return manifest
+
+    def _write(self) -> None:
+        os.makedirs(os.path.dirname(self.manifest_path) or '.', exist_ok=True)
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+        self._version = self._manifest_version()
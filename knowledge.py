@@ -0,0 +1,53 @@
+from agno.knowledge.agent import AgentKnowledge
+from typing import Any, Dict, List, Optional
+import os
+from dotenv import load_dotenv
+
+from tracing import span
+
+# Load environment variables from .env file
+load_dotenv()
+
+# "hybrid" fuses the document's BM25 index with vector search, "vector" only embeds, "lexical" never does
+RETRIEVAL_MODE = os.getenv("retrieval_mode", "hybrid")
+
+
+class TracedKnowledge(AgentKnowledge):
+    """AgentKnowledge that records a retrieve span (query embedding plus vector search) per search.
+
+    With a ``lexical`` BM25 index, searches fuse lexical and vector hits and rerank them locally.
+    A query whose best lexical hit contains every query term is answered from the index alone,
+    without an embedding request. Over the shared library table, ``doc_ids`` scopes every search
+    to those documents.
+    """
+
+    lexical: Optional[Any] = None
+    retrieval_mode: str = RETRIEVAL_MODE
+    doc_ids: Optional[List[str]] = None
+    # True while a streaming ingestion is still adding the document's later pages
+    indexing: bool = False
+
+    def search(self, query: str, num_documents: Optional[int] = None, filters: Optional[Dict[str, Any]] = None):
+        if self.doc_ids is not None:
+            filters = dict(filters or {}, doc_id=self.doc_ids)
+        with span("retrieve") as retrieve_span:
+            if self.lexical is None or self.retrieval_mode == "vector":
+                documents = super().search(query=query, num_documents=num_documents, filters=filters)
+                mode = "vector"
+            else:
+                documents, mode = self._hybrid_search(query, num_documents or self.num_documents, filters)
+            retrieve_span.set(retrieved=len(documents), mode=mode)
+        return documents
+
+    def _hybrid_search(self, query: str, num_documents: int, filters: Optional[Dict[str, Any]]):
+        from lexical import HYBRID_CANDIDATES, LexicalReranker, fuse
+
+        candidates = num_documents * HYBRID_CANDIDATES
+        hits = self.lexical.search(query, candidates, filters=filters)
+        rankings = [[self.lexical.document(i) for i, _ in hits]]
+        mode = "lexical"
+        if self.retrieval_mode != "lexical" and not (hits and self.lexical.covers(query, hits[0][0])):
+            rankings.append(super().search(query=query, num_documents=candidates, filters=filters))
+            mode = "hybrid"
+        documents = LexicalReranker(index=self.lexical).rerank(query, fuse(rankings))
+        return documents[:num_documents], mode
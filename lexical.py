@@ -0,0 +1,246 @@
+"""Local BM25 index over a document's chunks, fused with vector search results and reranked on CPU.
+
+The index is built at ingestion and saved as JSON next to the document's LanceDB table. Exact
+terms from lecture notes (formula names, acronyms, theorem and section numbers) are matched here
+even when their embeddings are not close to the query's.
+"""
+from agno.document import Document
+from agno.reranker.base import Reranker
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import heapq
+import json
+import logging
+import math
+import os
+import re
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Reciprocal rank fusion constant; larger values flatten the difference between top and lower ranks
+RRF_K = int(os.getenv("hybrid_rrf_k", "60"))
+# Candidates taken from each retriever per requested chunk, before fusion and reranking
+HYBRID_CANDIDATES = int(os.getenv("hybrid_candidates", "10"))
+
+# Keeps terms like "3.2", "l2-norm" and "k-means" together rather than splitting on the punctuation
+_TOKEN = re.compile(r"[a-z0-9]+(?:[.\-_'][a-z0-9]+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from has have how i in is it its me of on or that the their "
+    "this to was what when where which who why will with you your about between into than then there these "
+    "they those explain describe define summarise summarize tell mean means meaning".split()
+)
+
+logger = logging.getLogger(__name__)
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _TOKEN.findall(text.lower()) if token not in _STOPWORDS]
+
+
+def identifiers(text: str) -> List[str]:
+    # Section and theorem numbers, formula names with digits and upper case acronyms
+    return [token.lower() for token in re.findall(r"[A-Za-z0-9]+(?:[.\-_'][A-Za-z0-9]+)*", text)
+            if any(c.isdigit() for c in token) or (len(token) > 1 and token.isupper())]
+
+
+def index_path(uri: str, table_name: str) -> str:
+    return os.path.join(uri, f"{table_name}.bm25.json")
+
+
+class BM25Index:
+    """Okapi BM25 inverted index over the chunks of one vector table."""
+
+    def __init__(self, documents: List[Dict[str, Any]], postings: Dict[str, List[List[int]]], lengths: List[int],
+                 k1: float = 1.2, b: float = 0.75):
+        self.documents = documents
+        self.postings = postings
+        self.lengths = lengths
+        self.k1 = k1
+        self.b = b
+        self.average_length = sum(lengths) / len(lengths) if lengths else 0.0
+        # Tokenized chunk contents for the reranker, filled on first use
+        self._tokens: Dict[str, List[str]] = {}
+
+    @classmethod
+    def build(cls, chunks: Iterable[Document], **params) -> "BM25Index":
+        index = cls([], {}, [], **params)
+        index.add(chunks)
+        return index
+
+    def add(self, chunks: Iterable[Document]) -> None:
+        """Index more chunks, e.g. each batch of a document that is still being ingested.
+
+        Searches running meanwhile on other threads see either none or some of the new chunks.
+        """
+        for chunk in chunks:
+            # Stored the way LanceDb stores it, so lexical and vector hits of one chunk share a content key
+            content = chunk.content.replace("\x00", "\ufffd")
+            tokens = tokenize(content)
+            # The chunk and its length go in before any posting can point at them
+            self.documents.append({"name": chunk.name, "content": content, "meta_data": chunk.meta_data})
+            self.lengths.append(len(tokens))
+            for term, count in Counter(tokens).items():
+                self.postings.setdefault(term, []).append([len(self.documents) - 1, count])
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+
+    @classmethod
+    def from_payloads(cls, payloads: Iterable[str]) -> "BM25Index":
+        """Rebuild the index from the JSON payloads of chunks already stored in a LanceDb table."""
+        return cls.build(Document(**{k: v for k, v in json.loads(p).items() if k != "usage"}) for p in payloads)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["BM25Index"]:
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable lexical index %s: %s", path, e)
+            return None
+        return cls(data["documents"], data["postings"], data["lengths"], k1=data["k1"], b=data["b"])
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"k1": self.k1, "b": self.b, "documents": self.documents, "postings": self.postings,
+                       "lengths": self.lengths}, f)
+        os.replace(tmp_path, path)
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def idf(self, term: str) -> float:
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.documents) - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, limit: int, filters: Optional[Dict[str, Any]] = None,
+               idf: Optional[Callable[[str], float]] = None) -> List[Tuple[int, float]]:
+        """Indices and BM25 scores of the best ``limit`` chunks whose meta_data matches ``filters``.
+
+        A list filter value matches any of its items. ``idf`` overrides this index's own term
+        statistics, e.g. with those of a whole library.
+        """
+        idf = idf or self.idf
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            term_idf = idf(term)
+            for i, tf in self.postings.get(term, ()):
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[i] / (self.average_length or 1))
+                scores[i] = scores.get(i, 0.0) + term_idf * tf * (self.k1 + 1) / (tf + norm)
+        if filters:
+            scores = {i: s for i, s in scores.items() if _matches(self.documents[i]["meta_data"], filters)}
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+    def document(self, i: int) -> Document:
+        entry = self.documents[i]
+        return Document(name=entry["name"], content=entry["content"], meta_data=dict(entry["meta_data"] or {}))
+
+    def tokens(self, content: str) -> List[str]:
+        tokens = self._tokens.get(content)
+        if tokens is None:
+            tokens = self._tokens[content] = tokenize(content)
+        return tokens
+
+    def covers(self, query: str, i: int) -> bool:
+        """True when chunk ``i`` answers the query lexically, so it needs no vector search.
+
+        That is when the chunk contains every identifier in the query (numbers like "3.2" and
+        acronyms like "SVD"), or every query term if there are none.
+        """
+        terms = set(identifiers(query)) or set(tokenize(query))
+        return bool(terms) and terms <= set(self.tokens(self.documents[i]["content"]))
+
+
+def _matches(meta_data: Dict[str, Any], filters: Dict[str, Any]) -> bool:
+    return all(meta_data.get(k) in v if isinstance(v, (list, tuple, set)) else meta_data.get(k) == v
+               for k, v in filters.items())
+
+
+class LibraryIndex:
+    """Several documents' BM25 indexes searched as one, with term statistics of the whole set.
+
+    Chunks are addressed by ``(index number, chunk number)``; otherwise it is used like a BM25Index.
+    """
+
+    def __init__(self, indexes: List[BM25Index]):
+        self.indexes = indexes
+        self._size = sum(len(index) for index in indexes)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def idf(self, term: str) -> float:
+        df = sum(len(index.postings.get(term, ())) for index in self.indexes)
+        return math.log(1 + (self._size - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, limit: int, filters: Optional[Dict[str, Any]] = None) -> List[Tuple[Tuple[int, int], float]]:
+        hits = ((j, i, score) for j, index in enumerate(self.indexes)
+                for i, score in index.search(query, limit, filters=filters, idf=self.idf))
+        return [((j, i), score) for j, i, score in heapq.nlargest(limit, hits, key=lambda hit: hit[2])]
+
+    def document(self, key: Tuple[int, int]) -> Document:
+        return self.indexes[key[0]].document(key[1])
+
+    def tokens(self, content: str) -> List[str]:
+        # Any index's cache will do; they all tokenize the same way
+        return self.indexes[0].tokens(content) if self.indexes else tokenize(content)
+
+    def covers(self, query: str, key: Tuple[int, int]) -> bool:
+        return self.indexes[key[0]].covers(query, key[1])
+
+
+def fuse(rankings: List[List[Document]], k: int = RRF_K) -> List[Document]:
+    """Reciprocal rank fusion of several rankings, keyed on chunk content.
+
+    The fused score is left in ``reranking_score`` for the reranker to use as a prior.
+    """
+    fused: Dict[str, Document] = {}
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking):
+            fused.setdefault(document.content, document)
+            scores[document.content] = scores.get(document.content, 0.0) + 1 / (k + rank + 1)
+    for content, document in fused.items():
+        document.reranking_score = scores[content]
+    return sorted(fused.values(), key=lambda d: d.reranking_score, reverse=True)
+
+
+def _ngrams(tokens: List[str], n: Optional[int] = None) -> set:
+    # Trigrams where the query is long enough, since bigrams of common terms match almost any chunk
+    n = n or (3 if len(tokens) >= 3 else 2)
+    return set(zip(*(tokens[i:] for i in range(n))))
+
+
+class LexicalReranker(Reranker):
+    """CPU reranker scoring query term coverage (weighted by IDF), phrase matches and the fused rank.
+
+    Uses the document's BM25 statistics and cached chunk tokens, so it needs no model download
+    and takes a few microseconds per candidate.
+    """
+
+    index: Any
+    coverage_weight: float = 0.5
+    phrase_weight: float = 0.2
+    prior_weight: float = 0.3
+
+    def rerank(self, query: str, documents: List[Document]) -> List[Document]:
+        terms = tokenize(query)
+        if not terms or not documents:
+            return documents
+        weights = {term: self.index.idf(term) for term in set(terms)}
+        total_weight = sum(weights.values()) or 1.0
+        phrases = _ngrams(terms)
+        top_prior = max(d.reranking_score or 0.0 for d in documents) or 1.0
+        for document in documents:
+            tokens = self.index.tokens(document.content)
+            present = set(tokens)
+            coverage = sum(w for term, w in weights.items() if term in present) / total_weight
+            phrase = len(phrases & _ngrams(tokens, len(next(iter(phrases))))) / len(phrases) if phrases else 0.0
+            prior = (document.reranking_score or 0.0) / top_prior
+            document.reranking_score = (self.coverage_weight * coverage + self.phrase_weight * phrase
+                                        + self.prior_weight * prior)
+        return sorted(documents, key=lambda d: d.reranking_score, reverse=True)
@@ -0,0 +1,211 @@
+"""One shared LanceDB table holding the chunks of every ingested document.
+
+Rows carry doc_id, page and section columns next to agno's id, vector and payload, so a search
+can be scoped to one document, a selected set or the whole library with a prefiltered ``where``.
+Once the table is large an IVF_PQ index replaces the flat scan, and rows added later are folded
+into it as the library grows.
+"""
+from agno.document import Document
+from agno.vectordb.lancedb import LanceDb
+from datetime import timedelta
+from functools import lru_cache
+from hashlib import md5
+from typing import Any, Dict, List, Optional
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+LIBRARY_TABLE = os.getenv("library_table", "library")
+# Rows before the IVF_PQ index is built; below this a flat scan is both exact and fast enough
+LIBRARY_ANN_MIN_ROWS = int(os.getenv("library_ann_min_rows", "20000"))
+# IVF partitions probed per query, and how many times ``limit`` candidates are re-scored exactly
+LIBRARY_NPROBES = int(os.getenv("library_nprobes", "20"))
+LIBRARY_REFINE_FACTOR = int(os.getenv("library_refine_factor", "10"))
+# Searches scoped to at most this many documents scan their rows exactly; the IVF partitions
+# probed for a query rarely hold a small document's chunks, and its rows are few enough to scan
+LIBRARY_EXACT_MAX_DOCS = int(os.getenv("library_exact_max_docs", "20"))
+
+logger = logging.getLogger(__name__)
+
+_index_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def connection(uri: str):
+    """One connection per process, checking for rows added by other workers on every read."""
+    import lancedb
+
+    return lancedb.connect(uri, read_consistency_interval=timedelta(0))
+
+
+def library_table_name(embedder) -> str:
+    # Vectors from different embedders are not comparable, so each embedder gets its own library table
+    config = f"{getattr(embedder, 'id', type(embedder).__name__)}:{embedder.dimensions}"
+    return f"{LIBRARY_TABLE}_{hashlib.sha256(config.encode()).hexdigest()[:8]}"
+
+
+def _sql_value(value) -> str:
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return str(value)
+
+
+def where_clause(filters: Optional[Dict[str, Any]]) -> Optional[str]:
+    """SQL filter on the doc_id, page and section columns; list values match any of their items."""
+    clauses = []
+    for column, value in (filters or {}).items():
+        if column not in ("doc_id", "page", "section"):
+            raise ValueError(f"Cannot filter the library on {column!r}")
+        if isinstance(value, (list, tuple, set)):
+            clauses.append(f"{column} IN ({', '.join(_sql_value(v) for v in value)})" if value else "false")
+        else:
+            clauses.append(f"{column} = {_sql_value(value)}")
+    return " AND ".join(clauses) or None
+
+
+class LibraryDb(LanceDb):
+    """agno LanceDb over the shared library table, with metadata columns and filtered search.
+
+    Chunks must carry their ``doc_id`` in ``meta_data``; ``page`` and ``section`` are copied
+    into columns when present.
+    """
+
+    def __init__(self, uri: str, table_name: str, embedder, **kwargs):
+        shared = connection(uri)
+        super().__init__(uri=uri, connection=shared, table_name=table_name, embedder=embedder, **kwargs)
+        if self.connection is not shared:
+            # agno opens its own connection when ours is falsy, which an empty database is
+            self.connection = shared
+            self.table = shared.open_table(table_name)
+
+    def _init_table(self):
+        # Unlike agno's, never overwrite a library table another worker has just created
+        return self.connection.create_table(self.table_name, schema=self._base_schema(), exist_ok=True)
+
+    def _base_schema(self):
+        import pyarrow as pa
+
+        # agno asks the embedder for a test embedding here; the dimensions are known already
+        return pa.schema([
+            pa.field(self._vector_col, pa.list_(pa.float32(), self.dimensions)),
+            pa.field(self._id, pa.string()),
+            pa.field("payload", pa.string()),
+            pa.field("doc_id", pa.string()),
+            pa.field("page", pa.int32()),
+            pa.field("section", pa.string()),
+        ])
+
+    @staticmethod
+    def row_id(document: Document) -> str:
+        # The same chunk text in two documents must still be two rows
+        content = document.content.replace("\x00", "\ufffd")
+        return md5(f"{document.meta_data.get('doc_id')}:{content}".encode()).hexdigest()
+
+    def doc_exists(self, document: Document) -> bool:
+        return self.table is not None and self.table.count_rows(f"{self._id} = '{self.row_id(document)}'") > 0
+
+    def insert(self, documents: List[Document], filters: Optional[Dict[str, Any]] = None) -> None:
+        data = []
+        for document in documents:
+            document.embed(embedder=self.embedder)
+            meta_data = document.meta_data
+            data.append({
+                self._vector_col: document.embedding,
+                self._id: self.row_id(document),
+                "payload": json.dumps({
+                    "name": document.name,
+                    "meta_data": meta_data,
+                    "content": document.content.replace("\x00", "\ufffd"),
+                    "usage": document.usage,
+                }),
+                "doc_id": meta_data["doc_id"],
+                "page": meta_data.get("page") if isinstance(meta_data.get("page"), int) else None,
+                "section": meta_data.get("section"),
+            })
+        if data:
+            self.table.add(data)
+
+    def search(self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+        query_embedding = self.embedder.get_embedding(query)
+        if query_embedding is None:
+            logger.error("Error getting embedding for query: %s", query)
+            return []
+        return self.search_vector(query_embedding, limit, filters)
+
+    def search_vector(self, vector: List[float], limit: int = 5, filters: Optional[Dict[str, Any]] = None,
+                      exact: bool = False) -> List[Document]:
+        """Nearest chunks to ``vector`` among the rows matching ``filters``; ``exact`` skips the ANN index."""
+        results = self.table.search(vector, vector_column_name=self._vector_col).distance_type("cosine")
+        where = where_clause(filters)
+        if where is not None:
+            results = results.where(where, prefilter=True)
+        doc_ids = (filters or {}).get("doc_id")
+        if doc_ids is not None and (isinstance(doc_ids, str) or len(doc_ids) <= LIBRARY_EXACT_MAX_DOCS):
+            exact = True
+        if exact:
+            results = results.bypass_vector_index()
+        else:
+            results = results.nprobes(LIBRARY_NPROBES).refine_factor(LIBRARY_REFINE_FACTOR)
+        return self._build_search_results(results.limit(limit).to_pandas())
+
+    def payloads(self, filters: Optional[Dict[str, Any]] = None) -> List[str]:
+        where = where_clause(filters)
+        count = self.table.count_rows(where)
+        query = self.table.search().select(["payload"])
+        if where is not None:
+            query = query.where(where)
+        return query.limit(count).to_arrow().column("payload").to_pylist() if count else []
+
+    def remove(self, doc_id: str) -> None:
+        self.table.delete(f"doc_id = {_sql_value(doc_id)}")
+
+    def start_indexing(self) -> None:
+        """Run ensure_index in the background, so the ingestion that crosses the threshold does not wait for it."""
+        # Not a daemon: exiting mid-build would kill the thread inside LanceDB and leave a partial index behind
+        threading.Thread(target=self.ensure_index, name="library-index").start()
+
+    def ensure_index(self, min_rows: int = LIBRARY_ANN_MIN_ROWS) -> bool:
+        """Build the IVF_PQ and doc_id indexes once the table has ``min_rows``, or fold new rows into them.
+
+        Returns True when an index was built or updated.
+        """
+        if not _index_lock.acquire(blocking=False):
+            # Another ingestion in this process is already indexing
+            return False
+        try:
+            rows = self.table.count_rows()
+            if rows < min_rows:
+                return False
+            indices = {index.name: index for index in self.table.list_indices()}
+            vector_index = next((name for name, index in indices.items() if self._vector_col in index.columns), None)
+            if vector_index is None:
+                # sqrt(rows) partitions, and sub-vectors of 8 dimensions where the dimensions allow it
+                dimensions = self.dimensions
+                self.table.create_index(
+                    metric="cosine",
+                    num_partitions=max(1, int(math.sqrt(rows))),
+                    num_sub_vectors=dimensions // 8 if dimensions % 8 == 0 else dimensions,
+                    vector_column_name=self._vector_col,
+                )
+                self.table.create_scalar_index("doc_id", index_type="BITMAP")
+                logger.info("Built IVF_PQ index on %s (%d rows)", self.table_name, rows)
+                return True
+            stats = self.table.index_stats(vector_index)
+            if stats is not None and stats.num_unindexed_rows > 0.1 * stats.num_indexed_rows:
+                self.table.optimize()
+                logger.info("Added %d rows to the indexes of %s", stats.num_unindexed_rows, self.table_name)
+                return True
+            return False
+        except Exception as e:
+            # Another worker process may be indexing the same table; it will catch up next time
+            logger.warning("Could not index %s: %s", self.table_name, e)
+            return False
+        finally:
+            _index_lock.release()
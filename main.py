@@ -1,12 +1,16 @@
 import streamlit as st
-import pandas as pd
-from datetime import datetime
-import random
 import io
+import uuid
 
 # Import agent functions
-from quiz_agent import initialize_agent_with_pdf, generate_quiz
-from chat_agent import initialize_chat_with_pdf
+from attempts import attempt_scores, attempt_store, comprehension, coverage, section_mastery
+from chat_history import CHAT_HISTORY_PAGE_MESSAGES, ChatHistory
+from ingestion import ingestion_cache, library_knowledge
+from registry import registry
+from response_cache import response_cache
+from tool_cache import tool_cache
+from question_bank import get_quiz_questions, start_bank_build
+from chat_agent import build_chat_agent, get_chat_response, stream_chat_response
 
 # Page configuration
 st.set_page_config(
@@ -18,24 +22,103 @@ st.set_page_config(
 # Initialize session state variables
 if 'pdf_data' not in st.session_state:
     # Store all PDF-specific data in this dictionary
-    # Structure: { 'pdf_name': {'agent': agent_obj, 'file': file_obj, 'chat_history': [], 'quiz_state': {}} }
+    # Structure: { 'pdf_name': {'handle': DocumentHandle, 'chat': agent_obj, 'chat_history': ChatHistory, 'quiz_state': {}} }
+    # Knowledge bases themselves live in the process-wide registry and are shared between sessions
     st.session_state.pdf_data = {}
 
 if 'current_topic' not in st.session_state:
     st.session_state.current_topic = None
 
-# Function to get AI response using study_partner agent
-def get_ai_response(message, topic=None):
+if 'user_id' not in st.session_state:
+    # Quiz attempts are recorded per user; the id is kept in the URL so a bookmarked page keeps its progress
+    st.session_state.user_id = st.query_params.get("user") or uuid.uuid4().hex[:12]
+    st.query_params["user"] = st.session_state.user_id
+
+# Function to get the chat agent and response cache key for a topic; questions search the topic's PDF
+# plus any other PDFs selected in its search scope, through one agent per selection
+def get_chat_target(pdf_data):
+    scope = [t for t in pdf_data.get('scope', []) if t in st.session_state.pdf_data]
+    if not scope:
+        return pdf_data['chat'], pdf_data['handle'].doc_id
+    
+    doc_ids = sorted({pdf_data['handle'].doc_id} | {st.session_state.pdf_data[t]['handle'].doc_id for t in scope})
+    scoped_chats = pdf_data.setdefault('scoped_chats', {})
+    if tuple(doc_ids) not in scoped_chats:
+        try:
+            scoped_chats[tuple(doc_ids)] = build_chat_agent(library_knowledge(doc_ids))
+        except KeyError:
+            # PDFs processed before the shared library existed, or still being indexed, are searched on their own
+            st.warning("Some selected PDFs can't be searched together with this one yet; searching this PDF only.")
+            return pdf_data['chat'], pdf_data['handle'].doc_id
+    return scoped_chats[tuple(doc_ids)], "library:" + ",".join(doc_id[:12] for doc_id in doc_ids)
+
+# Function to pre-generate quiz questions in the background once every page of a document is indexed
+def start_bank_build_when_indexed(document, topic):
+    def build(progress):
+        if progress.error is None:
+            start_bank_build(document.knowledge, document.doc_id, document.sections, topic)
+    
+    document.progress.on_done(build)
+
+# Function to show live progress of PDFs still being indexed; chat and quiz already use the pages done so far
+def show_indexing_progress():
+    indexing = False
+    for topic, data in st.session_state.pdf_data.items():
+        progress = data['handle'].document.progress
+        if progress.done:
+            continue
+        indexing = True
+        st.progress(
+            progress.fraction,
+            text=f"Indexing {topic}: {progress.pages}/{progress.total_pages} pages, {progress.chunks} chunks"
+        )
+    if not indexing:
+        # Everything is indexed; refresh the whole page once for the final document details
+        st.rerun()
+
+# Function to get AI response using study_partner agent; returns (answer, served_from_cache)
+def get_ai_response(message, topic=None, standalone=False):
+    if not topic:
+        return "Please upload or select notes first.", False
+    
+    pdf_data = st.session_state.pdf_data.get(topic)
+    if not pdf_data or 'chat' not in pdf_data:
+        return "Chat agent not initialized for this topic.", False
+    
+    agent, cache_key = get_chat_target(pdf_data)
+    agent.additional_context = pdf_data['chat_history'].summary
+    return get_chat_response(agent, cache_key, message, standalone=standalone)
+
+# Function to stream the AI response token by token, reporting tool calls in a status box;
+# run_info['cached'] is set when the answer came from the response cache
+def stream_ai_response(message, topic, status, run_info):
     if not topic:
-        return "Please upload or select notes first."
+        yield "Please upload or select notes first."
+        return
     
     pdf_data = st.session_state.pdf_data.get(topic)
     if not pdf_data or 'chat' not in pdf_data:
-        return "Chat agent not initialized for this topic."
+        yield "Chat agent not initialized for this topic."
+        return
     
-    chat_agent = pdf_data['chat']
-    response = chat_agent.run(message)
-    return response.content if hasattr(response, 'content') else str(response)
+    agent, cache_key = get_chat_target(pdf_data)
+    # The agent replays its last few exchanges itself; everything older reaches it as a summary
+    agent.additional_context = pdf_data['chat_history'].summary
+    for kind, payload in stream_chat_response(agent, cache_key, message):
+        if kind == "cached":
+            run_info['cached'] = True
+            yield payload
+        elif kind == "content":
+            yield payload
+        elif kind == "tool_started":
+            status.update(label=f"Running {payload.get('tool_name')}...", state="running")
+        elif kind == "tool_completed":
+            elapsed = getattr(payload.get('metrics'), 'time', None)
+            status.write(
+                f"✓ {payload.get('tool_name')}" + (f" ({elapsed:.1f}s)" if elapsed is not None else "")
+            )
+            status.update(label="Writing answer...", state="running")
+    status.update(label="Done", state="complete")
 
 # Function to handle quiz submission
 def submit_quiz(topic):
@@ -53,6 +136,10 @@ def submit_quiz(topic):
     quiz_state['score'] = score
     quiz_state['total'] = len(quiz_state['questions'])
     quiz_state['active'] = False
+    
+    handle = pdf_data['handle']
+    attempt_store.record(st.session_state.user_id, handle.doc_id, topic, quiz_state['custom_topic'] or None,
+                         quiz_state['questions'], quiz_state['answers'])
 
 # Main app UI
 st.title("📚 EduChat AI Learning Platform")
@@ -65,47 +152,69 @@ with st.sidebar:
     uploaded_file = st.file_uploader("Upload PDF for study and quizzes", type=["pdf"])
     
     if uploaded_file is not None:
-        # Create BytesIO object from the uploaded file
-        pdf_file = io.BytesIO(uploaded_file.getvalue())
-        pdf_file.name = uploaded_file.name  # Add name attribute
-        
         topic_name = uploaded_file.name.split(".")[0]
         
         # Check if this PDF was already uploaded
         if topic_name not in st.session_state.pdf_data:
-            # Initialize PDF agent with the uploaded file
-            with st.spinner("Processing PDF..."):
+            # Initialize PDF agent with the uploaded file; this waits only for the first batch of pages
+            with st.spinner("Processing the first pages..."):
                 try:
-                    pdf_agent = initialize_agent_with_pdf(
-                        pdf_file=pdf_file,
-                        agent_name="StudyScout",
-                        agent_role="study assistant",
-                        table_name=topic_name.lower().replace(" ", "_")
-                    )
+                    # Create BytesIO object from the uploaded file; it is dropped once ingested
+                    pdf_file = io.BytesIO(uploaded_file.getvalue())
+                    pdf_file.name = uploaded_file.name  # Add name attribute
                     
-                    chat_agent = initialize_chat_with_pdf(
-                        pdf_file=pdf_file,
-                        table_name=topic_name.lower().replace(" ", "_")
-                    )
+                    # Parse, chunk and embed once per process; every session shares the knowledge base
+                    handle = registry.open(pdf_file, name=topic_name)
+                    del pdf_file
+                    document = handle.document
+                    
+                    chat_agent = build_chat_agent(document.knowledge)
+                    
+                    # Pre-generate quiz questions for this document once all of it is indexed
+                    start_bank_build_when_indexed(document, topic_name)
 
                     # Create a new entry for this PDF
                     st.session_state.pdf_data[topic_name] = {
-                        'agent': pdf_agent,
+                        'handle': handle,
                         'chat': chat_agent,
-                        'file': pdf_file,
-                        'chat_history': [],
+                        # Recent messages in memory, older ones on disk, plus a rolling summary for the agent
+                        'chat_history': ChatHistory(),
+                        # Most recent messages shown; "Show earlier messages" raises it
+                        'visible_messages': CHAT_HISTORY_PAGE_MESSAGES,
+                        # Other PDFs this topic's chat also searches
+                        'scope': [],
                         'quiz_state': {
                             'active': False,
                             'questions': [],
                             'answers': [],
                             'score': 0,
                             'total': 0,
-                            'custom_topic': ""
+                            'custom_topic': "",
+                            # Question bank ids already served in this session
+                            'seen': []
                         }
                     }
                     
                     st.session_state.current_topic = topic_name
                     st.success(f"'{topic_name}' PDF processed successfully!")
+                    timings = document.timings
+                    if document.cached:
+                        st.caption(
+                            f"{document.num_pages} pages, {document.num_chunks} chunks · "
+                            f"loaded from cache in {timings['total'] * 1000:.0f}ms"
+                        )
+                    elif not document.progress.done:
+                        st.caption(
+                            f"First {document.progress.pages} of {document.num_pages} pages ready in "
+                            f"{timings['first_batch']:.1f}s · the rest is indexed in the background"
+                        )
+                    else:
+                        st.caption(
+                            f"{document.num_pages} pages, {document.num_chunks} chunks · "
+                            f"parse {timings['parse']:.1f}s · chunk {timings['chunk']:.1f}s · "
+                            f"embed {timings['embed']:.1f}s ({document.embed_stats.get('chunks_per_sec', 0):.0f} chunks/s) · "
+                            f"store {timings['store']:.1f}s · total {timings['total']:.1f}s"
+                        )
                 except Exception as e:
                     st.error(f"Error processing PDF: {str(e)}")
         else:
@@ -125,6 +234,24 @@ with st.sidebar:
                 st.rerun()
     else:
         st.info("No PDFs uploaded yet. Upload a PDF to get started!")
+    
+    if any(not data['handle'].document.progress.done for data in st.session_state.pdf_data.values()):
+        st.fragment(show_indexing_progress, run_every=1.0)()
+    
+    cache_stats = ingestion_cache.stats
+    st.caption(
+        f"Ingestion cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+        f"({cache_stats['hit_rate']:.0%}), {cache_stats['entries']} documents"
+    )
+    
+    with st.expander("Shared knowledge bases"):
+        # Expander bodies run on every rerun, even collapsed, so the report is only built on request
+        if st.toggle("Show memory report", key="show_memory_report"):
+            memory_report = registry.memory_report()
+            if memory_report:
+                st.dataframe(memory_report, hide_index=True)
+            else:
+                st.write("Nothing loaded in this process yet.")
 
 # Main content area
 col1, col2 = st.columns([2, 1])
@@ -142,8 +269,24 @@ with col1:
         
         # Chat interface tab
         with chat_tab:
-            # Display chat history
-            for message in pdf_data['chat_history']:
+            # Search scope: this PDF alone, or together with some or all of the other PDFs
+            other_topics = [t for t in st.session_state.pdf_data if t != topic]
+            if other_topics:
+                pdf_data['scope'] = st.multiselect(
+                    "Also search in:",
+                    options=other_topics,
+                    default=[t for t in pdf_data.get('scope', []) if t in other_topics],
+                    key=f"scope_{topic}",
+                    help="Answer from several of your PDFs at once"
+                )
+            
+            # Display only the most recent messages, so reruns do not get slower as the chat grows
+            chat_history = pdf_data['chat_history']
+            first_visible = max(0, len(chat_history) - pdf_data['visible_messages'])
+            if first_visible > 0 and st.button(f"Show earlier messages ({first_visible} more)", key=f"earlier_{topic}"):
+                pdf_data['visible_messages'] += CHAT_HISTORY_PAGE_MESSAGES
+                st.rerun()
+            for message in chat_history.window(first_visible, len(chat_history)):
                 if message["role"] == "user":
                     with st.chat_message("user"):
                         st.markdown(message["content"])
@@ -151,6 +294,8 @@ with col1:
                     with st.chat_message("assistant"):
                         # Use markdown to render links as clickable
                         st.markdown(message["content"])
+                        if message.get("cached"):
+                            st.caption("⚡ Cached answer")
             
             # Chat input
             user_message = st.chat_input(f"Ask about {topic}...")
@@ -158,12 +303,15 @@ with col1:
                 st.chat_message("user").write(user_message)
                 pdf_data['chat_history'].append({"role": "user", "content": user_message})
                 
-                # Get AI response
-                with st.spinner("Thinking..."):
-                    response = get_ai_response(user_message, topic)
+                # Answer instantly from the response cache, otherwise stream the AI response as it is generated
+                with st.chat_message("assistant"):
+                    status = st.status("Thinking...", expanded=False)
+                    run_info = {'cached': False}
+                    response = st.write_stream(stream_ai_response(user_message, topic, status, run_info))
+                    if run_info['cached']:
+                        st.caption("⚡ Cached answer")
                 
-                st.chat_message("assistant").write(response)
-                pdf_data['chat_history'].append({"role": "assistant", "content": response})
+                pdf_data['chat_history'].append({"role": "assistant", "content": response, "cached": run_info['cached']})
         
         # Quiz interface tab
         with quiz_tab:
@@ -182,18 +330,19 @@ with col1:
                 # Quiz generation button
                 if st.button("Generate Quiz", key=f"gen_quiz_{topic}"):
                     with st.spinner("Generating quiz questions..."):
-                        quiz_topic = quiz_state['custom_topic'] if quiz_state['custom_topic'] else topic
                         try:
-                            quiz_response = generate_quiz(pdf_data['agent'], quiz_topic, num_questions)
-                            
-                            # Convert Pydantic quiz to format needed for UI
-                            questions = []
-                            for q in quiz_response.quiz:
-                                questions.append({
-                                    "question": q.question,
-                                    "options": q.options,
-                                    "correct": q.correct
-                                })
+                            # Sample from the pre-generated bank; the LLM only fills any shortfall
+                            questions = get_quiz_questions(
+                                pdf_data['handle'].knowledge,
+                                pdf_data['handle'].doc_id,
+                                quiz_state['custom_topic'] or None,
+                                num_questions,
+                                exclude=quiz_state['seen'],
+                                default_topic=topic
+                            )
+                            if not questions:
+                                raise ValueError("no valid questions could be generated for this topic")
+                            quiz_state['seen'] += [q['id'] for q in questions]
                             
                             quiz_state['questions'] = questions
                             quiz_state['answers'] = [None] * len(questions)
@@ -257,34 +406,48 @@ with col2:
         # Display information about the PDF
         st.metric("Current PDF", topic)
         
+        progress = pdf_data['handle'].document.progress
+        if progress.error is not None:
+            st.warning(f"Only {progress.pages} of {progress.total_pages} pages could be indexed: {progress.error}")
+        
         if quiz_state['custom_topic']:
             st.metric("Quiz Topic", quiz_state['custom_topic'])
             
         # Learning progress tracking section
         st.subheader("Learning Progress")
         
-        # Display a progress bar for current topic comprehension (simplified)
-        comprehension = min(0.1 * len(pdf_data['chat_history']), 1.0)
+        # This user's recorded quiz answers on the document; pandas and pyarrow are only imported once any exist
+        attempts = attempt_store.frame(doc_id=pdf_data['handle'].doc_id, user_id=st.session_state.user_id)
+        sections = pdf_data['handle'].document.sections or None
+        
+        # Comprehension: recency weighted quiz accuracy per section, averaged over the sections quizzed so far
         st.write("Topic Comprehension")
-        st.progress(comprehension)
+        st.progress(comprehension(attempts, sections))
+        if sections and attempts is not None and len(attempts) > 0:
+            st.caption(f"Sections covered by your quizzes: {coverage(attempts, sections):.0%}")
         
         # Display quiz performance if available
-        if quiz_state['total'] > 0:
-            quiz_accuracy = quiz_state['score'] / quiz_state['total']
+        if attempts is not None and len(attempts) > 0:
+            scores = attempt_scores(attempts)
             st.write("Quiz Performance")
-            st.progress(quiz_accuracy)
-            
-            # Generate some performance data
-            dates = pd.date_range(end=datetime.now(), periods=5).tolist()
-            performances = [random.uniform(0.6, 0.95) for _ in range(5)]
-            performances[-1] = quiz_accuracy  # Set the latest performance to actual quiz result
+            st.progress(float(scores['score'].iloc[-1]))
+            st.line_chart(scores.set_index('answered_at')['score'].rename("performance"))
             
-            chart_data = pd.DataFrame({
-                "date": dates,
-                "performance": performances
-            })
+            if sections:
+                # The sections most in need of revision
+                mastery = section_mastery(attempts, sections)
+                st.write("Weakest Sections")
+                st.bar_chart(mastery.nsmallest(5).rename("mastery"))
             
-            st.line_chart(chart_data.set_index("date"))
+        # Share of chat questions answered from the response cache, across all sessions
+        cache_stats = response_cache.stats
+        st.metric("Response cache hit rate", f"{cache_stats['hit_rate']:.0%}",
+                  help=f"{cache_stats['hits']} hits / {cache_stats['misses']} misses, {cache_stats['entries']} cached answers")
+        # Web searches and YouTube lookups answered without a request of their own, in this process
+        tool_stats = tool_cache.stats
+        if tool_stats['hits'] or tool_stats['misses']:
+            st.metric("Web/YouTube cache hit rate", f"{tool_stats['hit_rate']:.0%}",
+                      help=f"{tool_stats['hits']} hits / {tool_stats['coalesced']} shared / {tool_stats['misses']} requests")
             
         # Study resources section
         st.subheader("Additional Study Resources")
@@ -303,8 +466,8 @@ with col2:
                 # Add this query to chat and get response
                 pdf_data['chat_history'].append({"role": "user", "content": suggested_topic})
                 with st.spinner("Searching for resources..."):
-                    response = get_ai_response(suggested_topic, topic)
-                pdf_data['chat_history'].append({"role": "assistant", "content": response})
+                    response, cached = get_ai_response(suggested_topic, topic, standalone=True)
+                pdf_data['chat_history'].append({"role": "assistant", "content": response, "cached": cached})
                 st.rerun()
     else:
         st.info("Upload a PDF document to get started with your AI learning assistant!")
\ No newline at end of file
@@ -0,0 +1,215 @@
+from quiz_agent import generate_questions, is_near_duplicate, quiz_ques, validate_question
+from tracing import span
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+import fcntl
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Question banks live next to the vector store, one file per ingested document
+QUESTION_BANK_DIR = './tmp/question_bank'
+# Questions generated per section by the background build, and the cap on sections covered
+BANK_QUESTIONS_PER_SECTION = int(os.getenv("bank_questions_per_section", "3"))
+BANK_MAX_SECTIONS = int(os.getenv("bank_max_sections", "20"))
+
+logger = logging.getLogger(__name__)
+
+_banks: Dict[str, "QuestionBank"] = {}
+_banks_lock = threading.Lock()
+_build_jobs: Dict[str, threading.Thread] = {}
+
+
+def _words(text: str) -> List[str]:
+    return [w for w in re.findall(r"[a-z0-9]+", text.lower()) if len(w) > 2]
+
+
+class QuestionBank:
+    """Persistent pool of validated quiz questions for one document, tagged by section/topic.
+
+    Worker processes share the file: changes are made under a lock file after reloading what
+    the others wrote, and reads reload the file when it has changed since it was last read.
+    """
+
+    def __init__(self, doc_id: str, path: Optional[str] = None):
+        self.doc_id = doc_id
+        self.path = path or os.path.join(QUESTION_BANK_DIR, f"{doc_id}.json")
+        self._lock = threading.Lock()
+        self._items: List[Dict] = []
+        # (mtime_ns, size) of the file when it was last read or written by this process
+        self._version = None
+        self._refresh()
+
+    @property
+    def items(self) -> List[Dict]:
+        with self._lock:
+            self._refresh()
+            return self._items
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, questions, topic: str) -> int:
+        """Add (quiz_ques, section) pairs, skipping invalid questions and near-duplicates."""
+        added = 0
+        with self._locked():
+            existing = [quiz_ques(**{k: item[k] for k in ("question", "options", "correct")}) for item in self._items]
+            for question, section in questions:
+                if validate_question(question) is not None or is_near_duplicate(question, existing):
+                    continue
+                meta = getattr(section, "meta_data", None) or {}
+                self._items.append({
+                    "id": uuid.uuid4().hex[:12],
+                    "question": question.question,
+                    "options": question.options,
+                    "correct": question.correct,
+                    "topic": topic,
+                    "section": meta.get("section"),
+                    "page": meta.get("page"),
+                    "created": time.time(),
+                    "served": 0,
+                })
+                existing.append(question)
+                added += 1
+            if added:
+                self._save()
+        return added
+
+    def matching(self, topic: Optional[str] = None, exclude: Iterable[str] = ()) -> List[Dict]:
+        return _matching(self.items, topic, exclude)
+
+    def sample(self, n: int, topic: Optional[str] = None, exclude: Iterable[str] = ()) -> List[Dict]:
+        """Pick up to ``n`` questions on ``topic``, least served first, skipping ids in ``exclude``."""
+        with self._locked():
+            candidates = _matching(self._items, topic, exclude)
+            random.shuffle(candidates)
+            candidates.sort(key=lambda item: item["served"])
+            picked = candidates[:n]
+            for item in picked:
+                item["served"] += 1
+            if picked:
+                self._save()
+            return [dict(item) for item in picked]
+
+    @contextmanager
+    def _locked(self):
+        # Held from reloading the file to saving it, so no process overwrites another's changes
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(f"{self.path}.lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self._refresh()
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _refresh(self) -> None:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if (stat.st_mtime_ns, stat.st_size) == self._version:
+            return
+        with open(self.path) as f:
+            self._items = json.load(f)
+        self._version = (stat.st_mtime_ns, stat.st_size)
+
+    def _save(self) -> None:
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._items, f)
+        os.replace(tmp_path, self.path)
+        stat = os.stat(self.path)
+        self._version = (stat.st_mtime_ns, stat.st_size)
+
+
+def _matching(items: List[Dict], topic: Optional[str] = None, exclude: Iterable[str] = ()) -> List[Dict]:
+    excluded = set(exclude)
+    items = [item for item in items if item["id"] not in excluded]
+    if not topic:
+        return items
+    topic_words = set(_words(topic))
+    if not topic_words:
+        return items
+    return [
+        item for item in items
+        if topic_words <= set(_words(" ".join(filter(None, (item["topic"], item["section"], item["question"])))))
+    ]
+
+
+def get_bank(doc_id: str) -> QuestionBank:
+    with _banks_lock:
+        if doc_id not in _banks:
+            _banks[doc_id] = QuestionBank(doc_id)
+        return _banks[doc_id]
+
+
+def top_up(knowledge, doc_id: str, topic: str, num_questions: int) -> int:
+    questions = generate_questions(knowledge, topic, num_questions=num_questions)
+    return get_bank(doc_id).add(questions, topic)
+
+
+def build_bank(knowledge, doc_id: str, sections: List[str], fallback_topic: str) -> None:
+    """Fill the bank with questions for every section that has none yet."""
+    start = time.perf_counter()
+    bank = get_bank(doc_id)
+    topics = sections[:BANK_MAX_SECTIONS] or [fallback_topic]
+    per_topic = BANK_QUESTIONS_PER_SECTION if sections else BANK_QUESTIONS_PER_SECTION * 5
+    added = 0
+    for topic in topics:
+        if bank.matching(topic):
+            continue
+        try:
+            added += top_up(knowledge, doc_id, topic, per_topic)
+        except Exception as e:
+            logger.warning("Question bank build for %s failed on '%s': %s", doc_id, topic, e)
+    logger.info("Question bank for %s: added %d questions (%d total) in %.1fs",
+                doc_id, added, len(bank), time.perf_counter() - start)
+
+
+def start_bank_build(knowledge, doc_id: str, sections: List[str], fallback_topic: str) -> bool:
+    """Build the bank in a background thread unless a build for this document is already running."""
+    with _banks_lock:
+        job = _build_jobs.get(doc_id)
+        if job is not None and job.is_alive():
+            return False
+        job = threading.Thread(
+            target=build_bank, args=(knowledge, doc_id, sections, fallback_topic),
+            name=f"question-bank-{doc_id[:8]}", daemon=True,
+        )
+        _build_jobs[doc_id] = job
+    job.start()
+    return True
+
+
+def get_quiz_questions(knowledge, doc_id: str, topic: Optional[str], num_questions: int,
+                       exclude: Iterable[str] = (), default_topic: Optional[str] = None) -> List[Dict]:
+    """Serve a quiz from the bank, calling the LLM only for the shortfall when the bank runs dry.
+
+    ``topic`` of None samples from the whole document; ``default_topic`` is then used as the
+    retrieval query if new questions have to be generated.
+    """
+    with span("quiz", doc_id=doc_id[:12], requested=num_questions) as quiz_span:
+        bank = get_bank(doc_id)
+        exclude = set(exclude)
+        questions = bank.sample(num_questions, topic, exclude)
+        quiz_span.set(from_bank=len(questions))
+        missing = num_questions - len(questions)
+        if missing > 0:
+            logger.info("Question bank for %s has %d/%d unseen questions on '%s', generating the rest",
+                        doc_id, len(questions), num_questions, topic)
+            top_up(knowledge, doc_id, topic or default_topic or "key concepts", missing)
+            exclude.update(item["id"] for item in questions)
+            questions += bank.sample(missing, topic, exclude)
+        quiz_span.set(questions=len(questions))
+        return questions
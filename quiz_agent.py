@@ -1,13 +1,16 @@
-from agno.agent import Agent
-from agno.models.google.gemini import Gemini
-from agno.knowledge.pdf import PDFKnowledgeBase, PDFReader
-from agno.embedder.google import GeminiEmbedder
-from agno.document.chunking.agentic import AgenticChunking
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from difflib import SequenceMatcher
+from typing import List, Optional, Tuple
 from pydantic import BaseModel, Field
+import logging
 import os
+import re
+import time
 from dotenv import load_dotenv
-from agno.vectordb.lancedb import LanceDb
+
+from fakes import USE_FAKES, fake_services
+from ingestion import ingest_pdf
+from tracing import propagate, span, token_usage
 
 
 # Load environment variables from .env file
@@ -16,6 +19,14 @@ load_dotenv()
 # Get API keys from environment variables
 GOOGLE_API_KEY = os.getenv("google_api_key")
 
+# "single" asks for the whole quiz in one completion, "parallel" fans out one completion per question
+QUIZ_MODE = os.getenv("quiz_mode", "single")
+QUIZ_MAX_WORKERS = int(os.getenv("quiz_max_workers", "10"))
+# Questions whose normalised text is at least this similar to an accepted one are regenerated
+QUIZ_DUPLICATE_THRESHOLD = float(os.getenv("quiz_duplicate_threshold", "0.85"))
+
+logger = logging.getLogger(__name__)
+
 class quiz_ques(BaseModel):
     question: str =  Field(..., description="The question text")
     options: List[str] = Field(..., description="options for the quiz Option A Option B Option C Option D")
@@ -26,72 +37,178 @@ class Quiz(BaseModel):
 
 
 
-def generate_quiz(agent, topic, num_questions=5):
+def validate_question(question) -> Optional[str]:
+    """Return why a generated question is unusable, or None when it is valid."""
+    if not isinstance(question, quiz_ques):
+        return "response was not a quiz question"
+    if not question.question.strip():
+        return "empty question text"
+    if len(question.options) != 4:
+        return f"expected 4 options, got {len(question.options)}"
+    if any(not option.strip() for option in question.options):
+        return "empty option"
+    if len({_normalize(option) for option in question.options}) != 4:
+        return "duplicate options"
+    if not 0 <= question.correct < len(question.options):
+        return f"correct index {question.correct} out of range"
+    return None
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"[^a-z0-9 ]", "", re.sub(r"\s+", " ", text.lower())).strip()
+
+
+def is_near_duplicate(question: quiz_ques, accepted: List[quiz_ques], threshold: float = QUIZ_DUPLICATE_THRESHOLD) -> bool:
+    text = _normalize(question.question)
+    return any(SequenceMatcher(None, text, _normalize(other.question)).ratio() >= threshold for other in accepted)
+
+
+def build_question_agent():
+    # A fresh single-question agent per call, so concurrent requests never share run state
+    if USE_FAKES:
+        return fake_services.agent(response_model=quiz_ques)
+    from agno.agent import Agent
+    from agno.models.google.gemini import Gemini
+
+    return Agent(
+        model=Gemini(id="gemini-2.0-flash", api_key=GOOGLE_API_KEY),
+        search_knowledge=False,
+        description="you write one multiple-choice quiz question from the study material you are given.",
+        instructions=[
+            "Base the question only on the provided section of the document",
+            "Give exactly 4 distinct options and set correct to the 0-based index of the right option",
+        ],
+        response_model=quiz_ques,
+    )
+
+
+def _question_prompt(topic, section, avoid):
     prompt = f"""
-    Please generate {num_questions} multiple-choice quiz questions about {topic}.
-    The questions should be based on the information in the knowledge base.
-    Make sure each question has 4 options and marks the correct answer.
+    Write one multiple-choice quiz question about {topic} based on this section of the study material:
+
+    {section.content}
     """
-    
-    # Get the response as a Pydantic model
-    response = agent.run(prompt)
-    
-    # Extract the quiz questions from the response
-    return response.content
+    if avoid:
+        prompt += "\n    It must be clearly different from these existing questions:\n"
+        prompt += "\n".join(f"    - {question}" for question in avoid)
+    return prompt
 
-def initialize_agent_with_pdf(pdf_file, agent_name="StudyScout", agent_role="study assistant", table_name=None):
-    import tempfile
-    import os
-    import uuid
-    
-    # Create a unique table name if not provided
-    if table_name is None:
-        table_name = f"pdf_{uuid.uuid4().hex[:8]}"
-    else:
-        # Create a PostgreSQL-safe table name
-        table_name = f"pdf_{table_name.lower().replace(' ', '_').replace('-', '_')}"
-    
-    # Save the uploaded PDF to a temporary file
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-        tmp_file.write(pdf_file.getvalue())
-        pdf_path = tmp_file.name
-    
-    try:
-        # Create a knowledge base for this specific PDF
-        custom_kb = PDFKnowledgeBase(
-            path=pdf_path,
-            vector_db = LanceDb(
-                uri='./tmp/lancedb',
-                table_name=table_name,
-                embedder=GeminiEmbedder(api_key=GOOGLE_API_KEY),
-            ),
-            reader=PDFReader(chunk=True, chunking_strategy=AgenticChunking()),
-        )
-        
-        # Load the document into the vector DB
-        custom_kb.load(recreate=False)
-        
-        # Initialize a new agent with this knowledge base
-        agent = Agent(
-            name=agent_name,
-            knowledge=custom_kb,
-            search_knowledge=True,
-            role=agent_role,
-            model=Gemini(id="gemini-2.0-flash", api_key=GOOGLE_API_KEY),
-            markdown=True,
-            description="you are a study partner who assists users in finding resources and make quizes on various topics.",
-            instructions=[
-                "Use the knowledge base to answer questions about the PDF content",
-                "make quizes on the given topic from the knowledge base",
-                "evaluate the answers of the user from the knowledge base",
-                "provide explanations on the answers",
-            ],
-            response_model=Quiz,
-        )
+
+def _ask(topic, section, avoid):
+    with span("model") as model_span:
+        try:
+            response = build_question_agent().run(_question_prompt(topic, section, avoid))
+        except Exception as e:
+            model_span.set(error=type(e).__name__)
+            logger.warning("Question generation failed: %s", e)
+            return None
+        model_span.set(**token_usage(response))
+        return response.content
+
+
+def generate_questions(knowledge, topic, num_questions=5, max_workers=QUIZ_MAX_WORKERS,
+                       max_rounds=3) -> List[Tuple[quiz_ques, object]]:
+    """Generate ``num_questions`` validated, de-duplicated questions concurrently.
+
+    One completion is issued per question, each grounded in a different retrieved section
+    (sections are reused round-robin when the search returns fewer). Invalid or duplicate
+    questions are regenerated for up to ``max_rounds`` rounds. Returns (question, section) pairs.
+    """
+    with span("generate_questions", requested=num_questions) as generate_span:
+        accepted = _generate_questions(knowledge, topic, num_questions, max_workers, max_rounds)
+        generate_span.set(accepted=len(accepted))
+    return accepted
+
+
+def _generate_questions(knowledge, topic, num_questions, max_workers, max_rounds):
+    start = time.perf_counter()
+    sections = knowledge.search(query=topic, num_documents=num_questions) if knowledge is not None else []
+    if not sections:
+        return []
+
+    accepted: List[Tuple[quiz_ques, object]] = []
+    slots = [sections[i % len(sections)] for i in range(num_questions)]
+    rejected = 0
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, num_questions))) as executor:
+        for _ in range(max_rounds):
+            avoid = [question.question for question, _ in accepted]
+            results = list(executor.map(propagate(lambda section: _ask(topic, section, avoid)), slots))
+            retry = []
+            for section, question in zip(slots, results):
+                problem = validate_question(question)
+                if problem is None and is_near_duplicate(question, [q for q, _ in accepted]):
+                    problem = "near-duplicate of an accepted question"
+                if problem is None:
+                    accepted.append((question, section))
+                else:
+                    rejected += 1
+                    logger.info("Regenerating quiz question: %s", problem)
+                    retry.append(section)
+            slots = retry
+            if not slots:
+                break
+
+    logger.info(
+        "Generated %d/%d quiz questions in %.2fs (%d regenerated)",
+        len(accepted), num_questions, time.perf_counter() - start, rejected,
+    )
+    return accepted
+
+
+def generate_quiz_parallel(agent, topic, num_questions=5):
+    questions = generate_questions(agent.knowledge, topic, num_questions=num_questions)
+    return Quiz(quiz=[question for question, _ in questions])
+
+
+def generate_quiz(agent, topic, num_questions=5, mode=None):
+    mode = mode or QUIZ_MODE
+    with span("quiz", mode=mode, requested=num_questions) as quiz_span:
+        if mode == "parallel":
+            quiz = generate_quiz_parallel(agent, topic, num_questions)
+            quiz_span.set(questions=len(quiz.quiz))
+            return quiz
+
+        prompt = f"""
+        Please generate {num_questions} multiple-choice quiz questions about {topic}.
+        The questions should be based on the information in the knowledge base.
+        Make sure each question has 4 options and marks the correct answer.
+        """
         
-        os.unlink(pdf_path)
+        # Get the response as a Pydantic model
+        with span("model") as model_span:
+            response = agent.run(prompt)
+            model_span.set(**token_usage(response))
         
-        return agent
-    except Exception as e:
-        os.unlink(pdf_path)
-        raise e
+        # Extract the quiz questions from the response
+        quiz_span.set(questions=len(getattr(response.content, "quiz", None) or []))
+        return response.content
+
+
+def build_quiz_agent(knowledge, agent_name="StudyScout", agent_role="study assistant"):
+    if USE_FAKES:
+        return fake_services.agent(knowledge=knowledge, response_model=Quiz)
+    from agno.agent import Agent
+    from agno.models.google.gemini import Gemini
+
+    # Initialize a new agent with an already ingested knowledge base
+    return Agent(
+        name=agent_name,
+        knowledge=knowledge,
+        search_knowledge=True,
+        role=agent_role,
+        model=Gemini(id="gemini-2.0-flash", api_key=GOOGLE_API_KEY),
+        markdown=True,
+        description="you are a study partner who assists users in finding resources and make quizes on various topics.",
+        instructions=[
+            "Use the knowledge base to answer questions about the PDF content",
+            "make quizes on the given topic from the knowledge base",
+            "evaluate the answers of the user from the knowledge base",
+            "provide explanations on the answers",
+        ],
+        response_model=Quiz,
+    )
+
+
+def initialize_agent_with_pdf(pdf_file, agent_name="StudyScout", agent_role="study assistant", table_name=None):
+    document = ingest_pdf(pdf_file, name=table_name, wait=True)
+    return build_quiz_agent(document.knowledge, agent_name=agent_name, agent_role=agent_role)
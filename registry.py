@@ -0,0 +1,169 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from ingestion import LANCEDB_URI, IngestedDocument, attach_document, document_id, ingest_pdf, ingestion_cache
+from typing import Any, Callable, Dict, List, Optional
+import logging
+import os
+import threading
+import time
+import weakref
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Unreferenced knowledge bases kept in memory before the least recently used is dropped
+REGISTRY_MAX_ENTRIES = int(os.getenv("registry_max_entries", "64"))
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RegistryEntry:
+    document: IngestedDocument
+    refcount: int = 0
+    created: float = field(default_factory=time.time)
+    last_used: float = field(default_factory=time.time)
+
+
+class DocumentHandle:
+    """Lightweight per-session reference to a shared knowledge base.
+
+    The reference is released when the handle is released explicitly or garbage collected
+    together with the Streamlit session that owns it.
+    """
+
+    def __init__(self, registry: "KnowledgeRegistry", doc_id: str, name: Optional[str]):
+        self.doc_id = doc_id
+        self.name = name
+        self._registry = registry
+        self._finalizer = weakref.finalize(self, registry.release, doc_id)
+
+    @property
+    def document(self) -> IngestedDocument:
+        return self._registry.get(self.doc_id)
+
+    @property
+    def knowledge(self):
+        return self.document.knowledge
+
+    def release(self) -> None:
+        self._finalizer()
+
+
+def _estimated_bytes(document: IngestedDocument) -> int:
+    # Vectors of every chunk plus the document's BM25 index, without walking the object graph
+    from lexical import index_path
+
+    dimensions = getattr(document.knowledge.vector_db.embedder, "dimensions", None) or 0
+    try:
+        lexical_bytes = os.path.getsize(index_path(LANCEDB_URI, ingestion_cache.table_name_for(document.doc_id)))
+    except OSError:
+        lexical_bytes = 0
+    return document.num_chunks * dimensions * 4 + lexical_bytes
+
+
+class KnowledgeRegistry:
+    """Process-wide registry of ingested knowledge bases keyed by document identity.
+
+    Every browser session that opens the same PDF shares one entry; entries are reference
+    counted and the least recently used unreferenced ones are dropped past ``max_entries``.
+    """
+
+    def __init__(self, max_entries: int = REGISTRY_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, RegistryEntry]" = OrderedDict()
+        # Re-entrant because handle finalizers can run release() during garbage collection at any point
+        self._lock = threading.RLock()
+        self._open_locks: Dict[str, threading.Lock] = {}
+
+    def open(self, pdf_file, name: Optional[str] = None, **ingest_kwargs) -> DocumentHandle:
+        """Return a handle for ``pdf_file``, ingesting it only if no session has it loaded."""
+        doc_id = document_id(pdf_file.getvalue(), ingest_kwargs.get("chunking_mode"), ingest_kwargs.get("embedder"))
+        self._acquire(doc_id, lambda: ingest_pdf(pdf_file, name=name, **ingest_kwargs))
+        return DocumentHandle(self, doc_id, name)
+
+    def attach(self, doc_id: str, embedder=None) -> DocumentHandle:
+        """Return a handle for an already ingested document, e.g. one ingested by another worker.
+
+        Raises KeyError when ``doc_id`` is neither loaded nor in the ingestion cache.
+        """
+        def load():
+            document = attach_document(doc_id, embedder=embedder)
+            if document is None:
+                raise KeyError(doc_id)
+            return document
+
+        document = self._acquire(doc_id, load)
+        return DocumentHandle(self, doc_id, document.name)
+
+    def _acquire(self, doc_id: str, load: Callable[[], IngestedDocument]) -> IngestedDocument:
+        with self._lock:
+            open_lock = self._open_locks.setdefault(doc_id, threading.Lock())
+        with open_lock:
+            with self._lock:
+                entry = self._entries.get(doc_id)
+            if entry is None or entry.document.progress.error is not None:
+                # Not loaded yet, or an ingestion that stopped part way and is started over
+                document = load()
+                with self._lock:
+                    entry = self._entries.setdefault(doc_id, RegistryEntry(document=document))
+                    entry.document = document
+            with self._lock:
+                entry.refcount += 1
+                entry.last_used = time.time()
+                self._entries.move_to_end(doc_id)
+                self._evict()
+                return entry.document
+
+    def get(self, doc_id: str) -> IngestedDocument:
+        with self._lock:
+            entry = self._entries[doc_id]
+            entry.last_used = time.time()
+            self._entries.move_to_end(doc_id)
+            return entry.document
+
+    def release(self, doc_id: str) -> None:
+        with self._lock:
+            entry = self._entries.get(doc_id)
+            if entry is not None:
+                entry.refcount = max(0, entry.refcount - 1)
+                self._evict()
+
+    def _evict(self) -> None:
+        for doc_id in list(self._entries):
+            if len(self._entries) <= self.max_entries:
+                break
+            if self._entries[doc_id].refcount == 0:
+                entry = self._entries.pop(doc_id)
+                self._open_locks.pop(doc_id, None)
+                logger.info("Dropped %s (%s) from the knowledge registry", doc_id[:12], entry.document.name)
+
+    def is_referenced(self, doc_id: str) -> bool:
+        with self._lock:
+            entry = self._entries.get(doc_id)
+            return entry is not None and entry.refcount > 0
+
+    def memory_report(self) -> List[Dict[str, Any]]:
+        """Per-entry reference counts and estimated size (vectors plus BM25 index) and disk footprint."""
+        with self._lock:
+            entries = list(self._entries.items())
+        cache_entries = ingestion_cache.entries()
+        report = []
+        for doc_id, entry in entries:
+            document = entry.document
+            report.append({
+                "doc_id": doc_id[:12],
+                "name": document.name,
+                "refcount": entry.refcount,
+                "chunks": document.num_chunks,
+                "estimated_bytes": _estimated_bytes(document),
+                "disk_bytes": cache_entries.get(doc_id, {}).get("size_bytes", 0),
+                "idle_seconds": round(time.time() - entry.last_used, 1),
+            })
+        return report
+
+
+registry = KnowledgeRegistry()
+# Never let the ingestion cache drop a table that a live session is reading from
+ingestion_cache.in_use = registry.is_referenced
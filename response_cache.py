@@ -0,0 +1,170 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import logging
+import math
+import os
+import re
+import threading
+import time
+from dotenv import load_dotenv
+
+from lexical import identifiers
+
+# Load environment variables from .env file
+load_dotenv()
+
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("response_cache_max_entries", "2000"))
+# Minimum similarity (0-1) between a new question and a cached one for the cached answer to be reused
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("response_cache_threshold", "0.92"))
+# Answers that used web/YouTube tools go stale much sooner than answers from the document alone
+RESPONSE_CACHE_TTL = float(os.getenv("response_cache_ttl", str(7 * 24 * 3600)))
+RESPONSE_CACHE_TOOL_TTL = float(os.getenv("response_cache_tool_ttl", str(6 * 3600)))
+# Questions shorter than this many words (e.g. "explain more") depend on chat history and are never cached
+RESPONSE_CACHE_MIN_WORDS = int(os.getenv("response_cache_min_words", "3"))
+# "lexical" matches cached questions on normalised text, "embedding" on question embeddings
+RESPONSE_CACHE_SIMILARITY = os.getenv("response_cache_similarity", "lexical")
+
+logger = logging.getLogger(__name__)
+
+# Words that point back at the conversation ("explain that", "in simpler terms", "more detail"); questions
+# containing them are never cached, even where they would not refer back ("show that ...")
+_FOLLOW_UP = re.compile(r"\b(?:it|its|that|this|these|those|they|them|simpler|simply|detail|details|elaborate|again|"
+                        r"above|previous|earlier|else)\b")
+_NEGATION = re.compile(r"\b(?:not|no|never|none|nor|neither|nothing|without|cannot)\b|n't\b")
+
+
+def normalize_question(question: str) -> str:
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s]", " ", question.lower())).strip()
+
+
+def context_key(context: Optional[str]) -> str:
+    """Hash of the conversation a question was asked in, or "" for the start of a conversation."""
+    return hashlib.sha256(context.encode()).hexdigest()[:16] if context else ""
+
+
+def _same_terms(a: str, b: str) -> bool:
+    # Questions differing only in a number, formula or negation ("theorem 3.1" / "theorem 3.2",
+    # "x^2" / "x^3", "convex" / "not convex") look alike but ask something else
+    if sorted(identifiers(a)) != sorted(identifiers(b)):
+        return False
+    return sorted(_NEGATION.findall(a.lower())) == sorted(_NEGATION.findall(b.lower()))
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+@dataclass
+class CachedResponse:
+    question: str
+    answer: str
+    used_tools: bool
+    expires: float
+    vector: Optional[List[float]] = None
+    hits: int = 0
+    created: float = field(default_factory=time.time)
+
+
+class ResponseCache:
+    """LRU cache of chat answers per document, matched on normalised or similar questions.
+
+    Similarity is lexical (difflib ratio on the normalised text) unless an ``embedder`` is
+    passed to lookup/store, in which case cosine similarity of question embeddings is used.
+    Similar questions only match when their numbers, identifiers and negations are the same;
+    otherwise only the exact normalised question does. Answers are only reused in the same
+    conversation ``context`` (e.g. the previous exchange), and follow-ups are never cached.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, threshold: float = RESPONSE_CACHE_THRESHOLD,
+                 ttl: float = RESPONSE_CACHE_TTL, tool_ttl: float = RESPONSE_CACHE_TOOL_TTL):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self.tool_ttl = tool_ttl
+        # (doc_id, context_key, normalised question) -> answer
+        self._entries: "OrderedDict[Tuple[str, str, str], CachedResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def cacheable(question: str) -> bool:
+        key = normalize_question(question)
+        return len(key.split()) >= RESPONSE_CACHE_MIN_WORDS and not _FOLLOW_UP.search(key)
+
+    def lookup(self, doc_id: str, question: str, embedder=None, context: Optional[str] = None) -> Optional[CachedResponse]:
+        if not self.cacheable(question):
+            return None
+        key = normalize_question(question)
+        conversation = context_key(context)
+        vector = embedder.get_embedding(question) if embedder is not None else None
+        now = time.time()
+        with self._lock:
+            best, best_score = None, 0.0
+            for entry_id, entry in list(self._entries.items()):
+                entry_doc, entry_conversation, entry_key = entry_id
+                if entry.expires <= now:
+                    del self._entries[entry_id]
+                    continue
+                if entry_doc != doc_id or entry_conversation != conversation:
+                    continue
+                if entry_key == key:
+                    best, best_score = entry_id, 1.0
+                    break
+                if vector is not None and entry.vector is not None:
+                    score = _cosine(vector, entry.vector)
+                else:
+                    matcher = SequenceMatcher(None, key, entry_key)
+                    # Cheap upper bounds first; ratio() is only computed for plausible matches
+                    if matcher.real_quick_ratio() < self.threshold or matcher.quick_ratio() < self.threshold:
+                        continue
+                    score = matcher.ratio()
+                if score > best_score and score >= self.threshold and _same_terms(question, entry.question):
+                    best, best_score = entry_id, score
+            if best is not None and best_score >= self.threshold:
+                self.hits += 1
+                entry = self._entries[best]
+                entry.hits += 1
+                self._entries.move_to_end(best)
+                logger.info("Response cache hit (similarity %.2f) for %r", best_score, question)
+                return entry
+            self.misses += 1
+            return None
+
+    def store(self, doc_id: str, question: str, answer: str, used_tools: bool = False, embedder=None,
+              context: Optional[str] = None) -> None:
+        if not self.cacheable(question) or not answer:
+            return
+        vector = embedder.get_embedding(question) if embedder is not None else None
+        entry = CachedResponse(
+            question=question,
+            answer=answer,
+            used_tools=used_tools,
+            expires=time.time() + (self.tool_ttl if used_tools else self.ttl),
+            vector=vector,
+        )
+        entry_id = (doc_id, context_key(context), normalize_question(question))
+        with self._lock:
+            self._entries[entry_id] = entry
+            self._entries.move_to_end(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+            }
+
+
+response_cache = ResponseCache()
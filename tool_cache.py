@@ -0,0 +1,274 @@
+"""Cache of web search and YouTube tool results, shared by every chat agent and session.
+
+Results are keyed by tool name and normalized arguments, so the same search asked by many
+students, or the same video asked about in different URL forms, reaches the remote API once
+per TTL. Entries are kept in memory and as one JSON file each under ./tmp, so other worker
+processes and restarts reuse them too. Identical calls already in flight in this process wait
+for the first one instead of making their own request.
+"""
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import re
+import threading
+import time
+from dotenv import load_dotenv
+
+from tracing import metrics
+
+# Load environment variables from .env file
+load_dotenv()
+
+TOOL_CACHE_DIR = './tmp/tool_cache'
+# Entries kept on disk across all processes, and the most recently used of them kept in memory
+TOOL_CACHE_MAX_ENTRIES = int(os.getenv("tool_cache_max_entries", "5000"))
+TOOL_CACHE_MEMORY_ENTRIES = int(os.getenv("tool_cache_memory_entries", "500"))
+# Web search results go stale within hours; a video's captions, metadata and timestamps practically never change
+TOOL_CACHE_SEARCH_TTL = float(os.getenv("tool_cache_search_ttl", str(6 * 3600)))
+TOOL_CACHE_VIDEO_TTL = float(os.getenv("tool_cache_video_ttl", str(7 * 24 * 3600)))
+
+# Functions of TavilyTools and YouTubeTools whose results are cached, and for how long; other
+# tools, like the todoist team member, have side effects and are always called
+CACHED_TOOLS = {
+    "web_search_using_tavily": TOOL_CACHE_SEARCH_TTL,
+    "web_search_with_tavily": TOOL_CACHE_SEARCH_TTL,
+    "get_youtube_video_captions": TOOL_CACHE_VIDEO_TTL,
+    "get_youtube_video_data": TOOL_CACHE_VIDEO_TTL,
+    "get_video_timestamps": TOOL_CACHE_VIDEO_TTL,
+}
+
+# agno's YouTubeTools report failures as results rather than raising; those are not cached
+_FAILED_RESULT = re.compile(r"^(?:Error\b|No URL provided)")
+_URL = re.compile(r"^https?://", re.IGNORECASE)
+
+logger = logging.getLogger(__name__)
+
+
+def _youtube_id(url: str) -> Optional[str]:
+    # The same forms agno's YouTubeTools.get_youtube_video_id accepts
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+    if host == "youtu.be":
+        return parsed.path[1:] or None
+    if host in ("www.youtube.com", "youtube.com", "m.youtube.com"):
+        if parsed.path == "/watch":
+            return parse_qs(parsed.query).get("v", [None])[0]
+        if parsed.path.startswith(("/embed/", "/v/", "/shorts/")):
+            return parsed.path.split("/")[2] or None
+    return None
+
+
+def normalize_argument(value: Any) -> Any:
+    """Search queries in lower case with collapsed whitespace and no closing punctuation;
+    YouTube URLs as their video id. Other URLs and non-strings are left as they are."""
+    if not isinstance(value, str):
+        return value
+    value = value.strip()
+    if _URL.match(value):
+        video_id = _youtube_id(value)
+        return f"youtube:{video_id}" if video_id else value
+    return re.sub(r"\s+", " ", value.lower()).strip(" \"'").rstrip("?!.").strip()
+
+
+def cache_key(tool: str, arguments: Dict[str, Any]) -> str:
+    normalized = {name: normalize_argument(value) for name, value in arguments.items()}
+    return hashlib.sha256(json.dumps([tool, normalized], sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ToolCache:
+    """TTL cache of tool results in memory and on disk, with in-flight request coalescing.
+
+    ``ttls`` maps the tool names to cache to their TTL in seconds; calls to other tools pass
+    straight through. Disk entries are evicted soonest-expiring first once there are more than
+    ``max_entries``; the directory is swept every ``max_entries // 20`` writes of a process.
+    """
+
+    def __init__(self, path: str = TOOL_CACHE_DIR, ttls: Optional[Dict[str, float]] = None,
+                 max_entries: int = TOOL_CACHE_MAX_ENTRIES, memory_entries: int = TOOL_CACHE_MEMORY_ENTRIES):
+        self.path = path
+        self.ttls = dict(CACHED_TOOLS if ttls is None else ttls)
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        # key -> (expires, result), least recently used first
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def call(self, tool: str, function: Callable[..., str], **arguments) -> str:
+        """``function(**arguments)``, or the cached result of an equivalent earlier call to ``tool``."""
+        ttl = self.ttls.get(tool)
+        if not ttl:
+            return function(**arguments)
+        key = cache_key(tool, arguments)
+        result = self._get(key)
+        if result is None:
+            with self._lock:
+                result = self._get_memory(key)
+                future = self._in_flight.get(key) if result is None else None
+                leader = result is None and future is None
+                if leader:
+                    future = self._in_flight[key] = Future()
+        if result is not None:
+            self._count(tool, "hit")
+            return result
+        if not leader:
+            self._count(tool, "coalesced")
+            logger.debug("Waiting for the %s call already in flight", tool)
+            return future.result()
+
+        self._count(tool, "miss")
+        try:
+            result = function(**arguments)
+        except BaseException as e:
+            # Waiting callers get the same error; nothing is cached, so the next call retries
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+        if isinstance(result, str) and not _FAILED_RESULT.match(result):
+            self._put(key, tool, arguments, result, time.time() + ttl)
+        with self._lock:
+            del self._in_flight[key]
+        future.set_result(result)
+        return result
+
+    def wrap(self, tool: str, function: Callable[..., str]) -> Callable[..., str]:
+        """``function`` with its results cached as ``tool``; its signature and docstring are kept,
+        so agno still builds the same tool definition from it."""
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def cached(*args, **kwargs):
+            # Defaults are filled in, so leaving out an argument and passing its default hit the same entry
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return self.call(tool, function, **bound.arguments)
+
+        return cached
+
+    def _count(self, tool: str, result: str) -> None:
+        with self._lock:
+            if result == "hit":
+                self.hits += 1
+            elif result == "miss":
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        metrics.inc("study_buddy_tool_cache_total", tool=tool, result=result)
+
+    def _get_memory(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            result = self._get_memory(key)
+        if result is not None:
+            return result
+        # Written by another process, or by this one before it dropped the entry from memory
+        try:
+            with open(self._file(key)) as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if entry["expires"] <= time.time():
+            return None
+        with self._lock:
+            self._remember(key, entry["expires"], entry["result"])
+        return entry["result"]
+
+    def _remember(self, key: str, expires: float, result: str) -> None:
+        self._entries[key] = (expires, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.memory_entries:
+            self._entries.popitem(last=False)
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.json")
+
+    def _put(self, key: str, tool: str, arguments: Dict[str, Any], result: str, expires: float) -> None:
+        with self._lock:
+            self._remember(key, expires, result)
+            # The first write of a process sweeps too, catching up on what earlier processes left behind
+            sweep = self._writes % max(1, self.max_entries // 20) == 0
+            self._writes += 1
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            path = self._file(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"tool": tool, "arguments": arguments, "result": result, "expires": expires,
+                           "created": time.time()}, f, default=str)
+            # The modification time is the expiry, so sweeping never has to open the files
+            os.utime(tmp_path, (expires, expires))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Could not persist %s result: %s", tool, e)
+            return
+        if sweep:
+            self.sweep()
+
+    def sweep(self) -> int:
+        """Remove expired entries from disk, then the soonest expiring beyond ``max_entries``.
+
+        Returns the number of entries removed.
+        """
+        try:
+            with os.scandir(self.path) as entries:
+                files = [(entry.stat().st_mtime, entry.path) for entry in entries if entry.name.endswith(".json")]
+        except FileNotFoundError:
+            return 0
+        now = time.time()
+        files.sort()
+        expired = sum(1 for expires, _ in files if expires <= now)
+        doomed = files[:max(expired, len(files) - self.max_entries)]
+        for _, path in doomed:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        if doomed:
+            logger.info("Evicted %d tool cache entries (%d expired)", len(doomed), expired)
+        return len(doomed)
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            calls = self.hits + self.misses + self.coalesced
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                # Calls answered without a request of their own
+                "hit_rate": (self.hits + self.coalesced) / calls if calls else 0.0,
+                "entries": len(self._entries),
+            }
+
+
+tool_cache = ToolCache()
+
+
+def cache_toolkit(toolkit, cache: Optional[ToolCache] = None):
+    """Route an agno toolkit's cacheable functions (see CACHED_TOOLS) through ``cache``, in place."""
+    cache = cache or tool_cache
+    for name, function in toolkit.functions.items():
+        if name in cache.ttls and function.entrypoint is not None:
+            function.entrypoint = cache.wrap(name, function.entrypoint)
+    return toolkit
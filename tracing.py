@@ -0,0 +1,259 @@
+"""Lightweight spans and Prometheus-style metrics for the ingestion, retrieval, model and tool stages.
+
+Every finished span updates in-process histograms and counters (rendered by ``metrics.render()``
+for a /metrics endpoint); every finished root span appends its whole trace as one JSON line to
+``trace_log``. The log is rotated to ``<trace_log>.1`` once it reaches ``trace_max_bytes``, so the
+two files together stay around twice that size. Spans nest through a context variable, so
+helpers called inside a span need no extra arguments.
+"""
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+TRACING_ENABLED = os.getenv("tracing", "1").lower() not in ("0", "false", "no")
+TRACE_LOG_PATH = os.getenv("trace_log", "./tmp/traces.jsonl")
+# Fraction of traces written to the JSON log; metrics always count every span
+TRACE_SAMPLE_RATE = float(os.getenv("trace_sample_rate", "1.0"))
+# Size at which the trace log is rotated, keeping one previous file; 0 never rotates
+TRACE_MAX_BYTES = int(os.getenv("trace_max_bytes", str(50 * 1024 * 1024)))
+
+# Histogram buckets in seconds, from a cache hit up to a slow multi-tool answer or a large PDF
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# Numeric span attributes that are also exported as counters
+_COUNTED = ("input_tokens", "output_tokens", "pages", "chunks", "retrieved", "tool_calls")
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics:
+    """Thread-safe counters and histograms rendered in the Prometheus text exposition format."""
+
+    def __init__(self, buckets: Tuple[float, ...] = _BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple], List] = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+
+    def render(self) -> str:
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(h[0]), h[1], h[2])) for key, h in self._histograms.items())
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{_labels(labels)} {value:g}")
+        for (name, labels), (counts, total, count) in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_labels(labels + (('le', f'{bound:g}'),))} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {total:g}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: Tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+metrics = Metrics()
+
+
+class _Trace:
+    def __init__(self, sampled: bool):
+        self.trace_id = uuid.uuid4().hex
+        self.sampled = sampled
+        self.spans: List[Dict[str, Any]] = []
+        self.lock = threading.Lock()
+
+
+@dataclass
+class Span:
+    name: str
+    trace: Optional[_Trace] = None
+    parent: Optional["Span"] = None
+    attrs: Dict[str, Any] = field(default_factory=dict)
+    span_id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    started: float = field(default_factory=time.time)
+    duration: Optional[float] = None
+    _start: float = field(default_factory=time.perf_counter, repr=False)
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def end(self) -> None:
+        if self.duration is not None or self.trace is None:
+            return
+        self.duration = time.perf_counter() - self._start
+        _finish(self)
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar("tracing_span", default=None)
+_log_lock = threading.Lock()
+
+
+def start_span(name: str, /, parent: Optional[Span] = None, **attrs) -> Span:
+    """Start a span under ``parent`` (default: the current span). Call ``end()`` when done.
+
+    Use this instead of ``span()`` around generators, which may be resumed from other
+    threads, together with ``activate()`` around each step.
+    """
+    if not TRACING_ENABLED:
+        return Span(name, attrs=attrs)
+    parent = parent if parent is not None else _current.get()
+    trace = parent.trace if parent is not None else _Trace(sampled=random.random() < TRACE_SAMPLE_RATE)
+    return Span(name, trace=trace, parent=parent, attrs=attrs)
+
+
+@contextmanager
+def activate(current: Span):
+    """Make ``current`` the parent of spans opened inside the block."""
+    token = _current.set(current)
+    try:
+        yield current
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name: str, /, **attrs):
+    """Time the block as a child of the current span, or as a new trace at the top level."""
+    current = start_span(name, **attrs)
+    try:
+        with activate(current):
+            yield current
+    except BaseException as e:
+        current.set(error=type(e).__name__)
+        raise
+    finally:
+        current.end()
+
+
+def record_span(name: str, duration: float, /, parent: Optional[Span] = None, **attrs) -> None:
+    """Record a finished span whose duration was measured elsewhere, e.g. agno's tool call metrics."""
+    current = start_span(name, parent=parent, **attrs)
+    if current.trace is None:
+        return
+    current.started -= duration
+    current.duration = duration
+    _finish(current)
+
+
+def propagate(fn):
+    """Wrap ``fn`` so spans it opens on a worker thread nest under the caller's current span."""
+    parent = _current.get()
+
+    def run(*args, **kwargs):
+        token = _current.set(parent)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+
+    return run
+
+
+def token_usage(response) -> Dict[str, int]:
+    """Input and output token counts of an agno RunResponse, from its metrics or its messages."""
+    usage = {"input_tokens": 0, "output_tokens": 0}
+    run_metrics = getattr(response, "metrics", None)
+    if run_metrics:
+        for key in usage:
+            value = run_metrics.get(key) or 0
+            usage[key] = sum(value) if isinstance(value, list) else value
+        return usage
+    for message in getattr(response, "messages", None) or []:
+        message_metrics = getattr(message, "metrics", None)
+        if getattr(message, "role", None) == "assistant" and message_metrics is not None:
+            usage["input_tokens"] += message_metrics.input_tokens or 0
+            usage["output_tokens"] += message_metrics.output_tokens or 0
+    return usage
+
+
+def _finish(current: Span) -> None:
+    stage = current.name
+    if stage == "tool":
+        metrics.observe("study_buddy_tool_seconds", current.duration, tool=current.attrs.get("tool", "unknown"))
+    else:
+        metrics.observe("study_buddy_stage_seconds", current.duration, stage=stage)
+    if "error" in current.attrs:
+        metrics.inc("study_buddy_stage_errors_total", stage=stage)
+    for key in _COUNTED:
+        value = current.attrs.get(key)
+        if isinstance(value, (int, float)) and value:
+            metrics.inc(f"study_buddy_{key}_total", value, stage=stage)
+
+    trace = current.trace
+    if not trace.sampled:
+        return
+    record = {
+        "span_id": current.span_id,
+        "parent_id": current.parent.span_id if current.parent is not None else None,
+        "name": stage,
+        "start": round(current.started, 6),
+        "duration": round(current.duration, 6),
+        **current.attrs,
+    }
+    with trace.lock:
+        trace.spans.append(record)
+    if current.parent is None:
+        _write_trace(trace, current)
+
+
+def _write_trace(trace: _Trace, root: Span) -> None:
+    line = json.dumps({
+        "trace_id": trace.trace_id,
+        "name": root.name,
+        "duration": round(root.duration, 6),
+        "spans": trace.spans,
+    }, default=str)
+    try:
+        with _log_lock:
+            os.makedirs(os.path.dirname(TRACE_LOG_PATH) or ".", exist_ok=True)
+            with open(TRACE_LOG_PATH, "a") as f:
+                f.write(line + "\n")
+                size = f.tell()
+            if TRACE_MAX_BYTES and size >= TRACE_MAX_BYTES:
+                os.replace(TRACE_LOG_PATH, f"{TRACE_LOG_PATH}.1")
+    except OSError as e:
+        logger.warning("Could not write trace to %s: %s", TRACE_LOG_PATH, e)